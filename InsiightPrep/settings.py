@@ -2,6 +2,7 @@
 from pathlib import Path
 from decouple import config
 import os  # Keep os imported
+import tempfile
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,6 +31,91 @@ for host in additional_hosts:
 # CART SESSION CONFIG
 # ====================================================================
 CART_SESSION_ID = 'cart'
+# The cart only writes the session when it changes, so anonymous browsing creates
+# no session at all. 'django.contrib.sessions.backends.signed_cookies' keeps carts
+# entirely client-side (zero session rows); '...backends.cached_db' serves reads
+# from the cache and only writes through on changes.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+# ====================================================================
+# CACHE CONFIG
+# ====================================================================
+# LocMemCache is per-process; point CACHE_BACKEND at a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache) when running several
+# gunicorn workers so catalog invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='insiightprep'),
+    }
+}
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+# Anonymous, empty-cart page views (shop.page_cache); keys follow the catalog version
+PAGE_CACHE_ENABLED = config('PAGE_CACHE_ENABLED', default=True, cast=bool)
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=10 * 60, cast=int)
+# Paper card fragments (shop.fragments) are keyed on id + updated_at; the
+# timeout only bounds how stale their view counts can get
+FRAGMENT_CACHE_TIMEOUT = config('FRAGMENT_CACHE_TIMEOUT', default=10 * 60, cast=int)
+# Facet counts for the browse page (shop.facets); keys follow the catalog version
+FACET_CACHE_TIMEOUT = config('FACET_CACHE_TIMEOUT', default=60 * 60, cast=int)
+# Per-identity sets of purchased paper ids behind the "Purchased" badges (shop.entitlements)
+ENTITLEMENT_CACHE_TIMEOUT = config('ENTITLEMENT_CACHE_TIMEOUT', default=15 * 60, cast=int)
+
+# Pending paper view counts live in their own cache so page/fragment entries
+# never evict them; use a shared backend so `flush_view_counts` sees every worker.
+COUNTER_CACHE_BACKEND = config('COUNTER_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHES['counters'] = {
+    'BACKEND': COUNTER_CACHE_BACKEND,
+    'LOCATION': config('COUNTER_CACHE_LOCATION', default='insiightprep-counters'),
+    'TIMEOUT': None,
+}
+if COUNTER_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['counters']['OPTIONS'] = {'MAX_ENTRIES': 100000}
+VIEW_COUNTER_CACHE = 'counters'
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=10, cast=int)  # seconds
+
+# Download events are buffered per process and written with bulk_create
+DOWNLOAD_BUFFER_ENABLED = config('DOWNLOAD_BUFFER_ENABLED', default=True, cast=bool)
+DOWNLOAD_BUFFER_SIZE = config('DOWNLOAD_BUFFER_SIZE', default=50, cast=int)
+DOWNLOAD_BUFFER_MAX_AGE = config('DOWNLOAD_BUFFER_MAX_AGE', default=5, cast=int)  # seconds
+
+# PDF size/page/hash extraction runs in a background pool after upload (shop.pdf_metadata)
+PDF_METADATA_ON_SAVE = config('PDF_METADATA_ON_SAVE', default=True, cast=bool)
+PDF_METADATA_WORKERS = config('PDF_METADATA_WORKERS', default=2, cast=int)
+# Processes parsing PDF text for content search (`manage.py extract_pdf_text`)
+PDF_TEXT_WORKERS = config('PDF_TEXT_WORKERS', default=2, cast=int)
+# Processes rendering WebP thumbnails and sample previews (`manage.py render_previews`)
+PREVIEW_WORKERS = config('PREVIEW_WORKERS', default=2, cast=int)
+# Password-protected copies of paid papers (`manage.py encrypt_papers`), encrypted with
+# one of pypdf's algorithms (the AES ones use the `cryptography` package)
+PROTECTED_PDF_WORKERS = config('PROTECTED_PDF_WORKERS', default=2, cast=int)
+PROTECTED_PDF_ALGORITHM = config('PROTECTED_PDF_ALGORITHM', default='AES-256')
+# Serve the encrypted copy to downloads of papers that have a password. Until the worker
+# has produced it the uploaded file is sent, or with PROTECTED_PDF_WAIT a 503 + Retry-After.
+PROTECTED_PDF_DELIVERY = config('PROTECTED_PDF_DELIVERY', default=True, cast=bool)
+PROTECTED_PDF_WAIT = config('PROTECTED_PDF_WAIT', default=False, cast=bool)
+# A file one of those workers fails on is retried after PDF_JOB_RETRY_DELAY seconds,
+# doubling with each failure up to PDF_JOB_MAX_RETRY_DELAY (see shop.pdf_jobs)
+PDF_JOB_RETRY_DELAY = config('PDF_JOB_RETRY_DELAY', default=5 * 60, cast=int)
+PDF_JOB_MAX_RETRY_DELAY = config('PDF_JOB_MAX_RETRY_DELAY', default=24 * 60 * 60, cast=int)
+
+# How /download/<slug>/ serves PDFs: 'stream' (chunked, Range-capable, through Django),
+# 'accel' / 'sendfile' (hand local files to nginx / Apache via X-Accel-Redirect / X-Sendfile;
+# remote storages fall back to 'stream'), 'redirect' (to the storage URL) or 'auto'
+# ('stream' for files on local disk, 'redirect' for remote storage such as Cloudinary).
+DOWNLOAD_SERVE_MODE = config('DOWNLOAD_SERVE_MODE', default='auto')
+DOWNLOAD_ACCEL_PREFIX = config('DOWNLOAD_ACCEL_PREFIX', default='/protected-media/')
+DOWNLOAD_CHUNK_SIZE = config('DOWNLOAD_CHUNK_SIZE', default=64 * 1024, cast=int)
+DOWNLOAD_CACHE_MAX_AGE = config('DOWNLOAD_CACHE_MAX_AGE', default=60 * 60, cast=int)
+# Paid papers are downloaded through per-order signed links (shop.download_links). Each link
+# lives DOWNLOAD_LINK_TTL seconds; the storage URL it redirects to lives DOWNLOAD_STORAGE_URL_TTL
+# seconds and is cached until DOWNLOAD_STORAGE_URL_MARGIN seconds before that.
+DOWNLOAD_LINK_TTL = config('DOWNLOAD_LINK_TTL', default=7 * 24 * 60 * 60, cast=int)
+DOWNLOAD_STORAGE_URL_TTL = config('DOWNLOAD_STORAGE_URL_TTL', default=10 * 60, cast=int)
+DOWNLOAD_STORAGE_URL_MARGIN = config('DOWNLOAD_STORAGE_URL_MARGIN', default=60, cast=int)
+
+# `manage.py rollup_stats` leaves downloads and verified orders from the last N seconds for the next run
+ROLLUP_SETTLE_SECONDS = config('ROLLUP_SETTLE_SECONDS', default=60, cast=int)
 
 # ====================================================================
 # API KEYS
@@ -39,6 +125,28 @@ PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY', default='')
 HTTPSMS_API_KEY = config('HTTPSMS_API_KEY', default='')
 CURRENCY_CODE = config('CURRENCY_CODE', default='GHS')
 
+# ====================================================================
+# OUTBOUND GATEWAYS (shop.gateways)
+# ====================================================================
+PAYSTACK_BASE_URL = config('PAYSTACK_BASE_URL', default='https://api.paystack.co')
+HTTPSMS_BASE_URL = config('HTTPSMS_BASE_URL', default='https://api.httpsms.com')
+GATEWAY_POOL_CONNECTIONS = config('GATEWAY_POOL_CONNECTIONS', default=4, cast=int)
+GATEWAY_POOL_MAXSIZE = config('GATEWAY_POOL_MAXSIZE', default=16, cast=int)
+GATEWAY_MAX_RETRIES = config('GATEWAY_MAX_RETRIES', default=2, cast=int)
+GATEWAY_BREAKER_THRESHOLD = config('GATEWAY_BREAKER_THRESHOLD', default=5, cast=int)
+GATEWAY_BREAKER_RESET = config('GATEWAY_BREAKER_RESET', default=30, cast=int)  # seconds
+
+# ====================================================================
+# SMS FULFILLMENT OUTBOX (drained by `manage.py send_sms_outbox`)
+# ====================================================================
+HTTPSMS_FROM_NUMBER = config('HTTPSMS_FROM_NUMBER', default='+233542232515')
+SMS_MAX_LENGTH = config('SMS_MAX_LENGTH', default=160, cast=int)
+SMS_MAX_ATTEMPTS = config('SMS_MAX_ATTEMPTS', default=6, cast=int)
+SMS_RETRY_BASE_DELAY = config('SMS_RETRY_BASE_DELAY', default=30, cast=int)  # seconds
+SMS_RETRY_MAX_DELAY = config('SMS_RETRY_MAX_DELAY', default=60 * 60, cast=int)
+SMS_WORKER_CONCURRENCY = config('SMS_WORKER_CONCURRENCY', default=4, cast=int)
+SMS_CLAIM_LEASE = config('SMS_CLAIM_LEASE', default=5 * 60, cast=int)
+
 # ====================================================================
 # EMAIL CONFIG (No change)
 # ====================================================================
@@ -102,6 +210,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'InsiightPrep.wsgi.application'
+# Keeps background pools out of the test run (see InsiightPrep.test_runner)
+TEST_RUNNER = 'InsiightPrep.test_runner.TestRunner'
 
 # ====================================================================
 # DATABASE (No change)
@@ -110,6 +220,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed so threaded tests take real SQLite locks (shared-cache in-memory
+        # databases fail with "table is locked" instead of waiting); kept out of the tree.
+        'TEST': {'NAME': config('TEST_DATABASE_NAME', default=os.path.join(tempfile.gettempdir(), 'insiightprep_test.sqlite3'))},
     }
 }
 
@@ -0,0 +1,22 @@
+# InsightInnovations/test_runner.py
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Django's runner with shop's on-upload PDF metadata pool switched off.
+
+    The pool's threads outlive the test that scheduled them and write while
+    later tests hold the database. Tests that exercise it turn it back on and
+    wait for it with shop.pdf_metadata.shutdown().
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.background_work = override_settings(PDF_METADATA_ON_SAVE=False)
+        self.background_work.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.background_work.disable()
+        super().teardown_test_environment(**kwargs)
@@ -11,11 +11,12 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     
+    # Paystack webhook URL must be at the root, and before the shop URLs:
+    # shop's '<class_slug>/<term_slug>/' pattern would otherwise swallow it.
+    path('webhooks/paystack/', paystack_webhook, name='paystack-webhook'),
+    
     # All base URLs ('') are now routed to the 'shop' app.
     path('', include('shop.urls')),
-    
-    # Paystack webhook URL must be at the root.
-    path('webhooks/paystack/', paystack_webhook, name='paystack-webhook'),
 ]
 
 # -------------------------------------------------------------------
@@ -3,64 +3,68 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.utils import timezone
 from .models import (
     Classes, Term, Subject, QuestionPaper, 
-    Payment, DownloadHistory, FreeSample
+    Payment, DownloadHistory, FreeSample, SmsMessage, PaperDailyStats, PdfJobFailure,
 )
+from .entitlements import grant_payments, revoke_payments
 
 # --- 1. Admin setup for Hierarchy Models ---
-# ... (ClassesAdmin, TermAdmin, SubjectAdmin remain unchanged)
+# Paper counts come from a get_queryset() annotation: one query per page, sortable.
+
+class PaperCountMixin:
+    papers_filter = None  # changelist filter for this object's papers, e.g. 'subject__id__exact'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(paper_count=Count('papers'))
 
-@admin.register(Classes)
-class ClassesAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'get_paper_count', 'view_papers_link']
-    prepopulated_fields = {'slug': ('name',)}
-    search_fields = ['name', 'description']
-    
     def get_paper_count(self, obj):
-        return obj.papers.count()
+        return obj.paper_count
     get_paper_count.short_description = 'Papers'
-    
+    get_paper_count.admin_order_field = 'paper_count'
+
     def view_papers_link(self, obj):
-        count = obj.papers.count()
-        url = reverse('admin:shop_questionpaper_changelist') + f'?class_level__id__exact={obj.id}'
-        return format_html('<a href="{}">View {} Papers</a>', url, count)
+        url = reverse('admin:shop_questionpaper_changelist') + f'?{self.papers_filter}={obj.id}'
+        return format_html('<a href="{}">View {} Papers</a>', url, obj.paper_count)
     view_papers_link.short_description = 'Papers Link'
 
 
+@admin.register(Classes)
+class ClassesAdmin(PaperCountMixin, admin.ModelAdmin):
+    list_display = ['name', 'slug', 'get_paper_count', 'view_papers_link']
+    prepopulated_fields = {'slug': ('name',)}
+    search_fields = ['name', 'description']
+    papers_filter = 'class_level__id__exact'
+
+
 @admin.register(Term)
-class TermAdmin(admin.ModelAdmin):
+class TermAdmin(PaperCountMixin, admin.ModelAdmin):
     list_display = ['class_name', 'name', 'slug', 'get_paper_count', 'view_papers_link']
     prepopulated_fields = {'slug': ('name',)}
     list_filter = ['class_name']
     search_fields = ['name', 'class_name__name']
-    
-    def get_paper_count(self, obj):
-        return obj.papers.count()
-    get_paper_count.short_description = 'Papers'
-    
-    def view_papers_link(self, obj):
-        count = obj.papers.count()
-        url = reverse('admin:shop_questionpaper_changelist') + f'?term__id__exact={obj.id}'
-        return format_html('<a href="{}">View {} Papers</a>', url, count)
-    view_papers_link.short_description = 'Papers Link'
+    autocomplete_fields = ['class_name']
+    list_select_related = ['class_name']
+    papers_filter = 'term__id__exact'
 
 
 @admin.register(Subject)
-class SubjectAdmin(admin.ModelAdmin):
+class SubjectAdmin(PaperCountMixin, admin.ModelAdmin):
     list_display = ['name', 'slug', 'get_paper_count', 'view_papers_link']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
-    
-    def get_paper_count(self, obj):
-        return obj.papers.count()
-    get_paper_count.short_description = 'Papers'
-    
-    def view_papers_link(self, obj):
-        count = obj.papers.count()
-        url = reverse('admin:shop_questionpaper_changelist') + f'?subject__id__exact={obj.id}'
-        return format_html('<a href="{}">View {} Papers</a>', url, count)
-    view_papers_link.short_description = 'Papers Link'
+    papers_filter = 'subject__id__exact'
+
+
+class TermListFilter(admin.RelatedFieldListFilter):
+    """Term choices with their class joined in, since Term.__str__ shows the class name."""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin) or Term._meta.ordering
+        return [(term.pk, str(term)) for term in Term.objects.select_related('class_name').order_by(*ordering)]
 
 
 # --- 2. Enhanced Admin setup for QuestionPaper (REVISED: Removed Preview) ---
@@ -70,14 +74,15 @@ class QuestionPaperAdmin(admin.ModelAdmin):
     list_display = [
         'title', 'class_level', 'term', 'subject', 
         'price', 'is_paid', 'is_available', 
-        'views', 'pdf_download_link' # REMOVED: 'file_preview'
+        'views', 'download_count', 'pdf_download_link' # REMOVED: 'file_preview'
     ]
-    list_filter = ['class_level', 'term', 'subject', 'is_paid', 'is_available', 'exam_type']
+    list_filter = ['class_level', ('term', TermListFilter), 'subject', 'is_paid', 'is_available', 'exam_type']
     list_editable = ['price', 'is_paid', 'is_available']
+    autocomplete_fields = ['class_level', 'term', 'subject']
     prepopulated_fields = {'slug': ('title',)}
     search_fields = ['title', 'description', 'password']
     readonly_fields = [
-        'views', 'file_size', 'created_at', 'updated_at', 
+        'views', 'file_size', 'content_hash', 'created_at', 'updated_at', 
         'pdf_preview', 
         'file_info', 
         'download_count', 
@@ -103,7 +108,7 @@ class QuestionPaperAdmin(admin.ModelAdmin):
         }),
         ('Files', {
             # REMOVED: 'preview_image'
-            'fields': ('pdf_file', 'file_info', 'pdf_preview'), 
+            'fields': ('pdf_file', 'file_info', 'pdf_preview', 'content_hash'), 
             'classes': ('wide',)
         }),
         ('Statistics', {
@@ -162,14 +167,12 @@ class QuestionPaperAdmin(admin.ModelAdmin):
     file_info.short_description = 'File Storage Info'
     
     def download_count(self, obj):
-        return obj.downloads.count()
+        return obj.download_count
     download_count.short_description = 'Total Downloads'
+    download_count.admin_order_field = 'stats__downloads'
     
     def last_download(self, obj):
-        last = obj.downloads.order_by('-downloaded_at').first()
-        if last:
-            return last.downloaded_at
-        return "Never"
+        return obj.last_download_at or "Never"
     last_download.short_description = 'Last Downloaded'
     
     # REMOVED: _get_preview_html helper method
@@ -182,7 +185,7 @@ class QuestionPaperAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related(
-            'class_level', 'term', 'subject'
+            'class_level', 'term__class_name', 'subject', 'stats'
         )
 
 
@@ -194,12 +197,13 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = [
         'ref_short', 'question_paper_link', 'email', 
         'phone_number', 'amount_display', 'verified', 
-        'date_created', 'download_link'
+        'date_created', 'download_total', 'download_link'
     ]
     list_filter = ['verified', 'date_created', 'payment_method']
     search_fields = ['ref', 'email', 'phone_number', 'question_paper__title', 'transaction_id']
     list_editable = ['verified']
     readonly_fields = ['ref', 'date_created', 'transaction_details', 'download_info']
+    autocomplete_fields = ['question_paper']
     actions = ['mark_as_verified', 'mark_as_unverified']
     list_per_page = 25
     
@@ -265,9 +269,7 @@ class PaymentAdmin(admin.ModelAdmin):
     transaction_details.short_description = 'Transaction Details'
     
     def download_info(self, obj):
-        downloads = obj.downloads.count()
-        if downloads > 0:
-            last_download = obj.downloads.order_by('-downloaded_at').first()
+        if obj.download_total:
             return format_html("""
                 <div style="padding: 10px; background: #e8f4fd; border-radius: 5px;">
                     <strong>Total Downloads:</strong> {}<br>
@@ -275,25 +277,57 @@ class PaymentAdmin(admin.ModelAdmin):
                     <strong>By:</strong> {}
                 </div>
             """,
-                downloads,
-                last_download.downloaded_at if last_download else "Never",
-                last_download.user_email if last_download else "—"
+                obj.download_total,
+                obj.last_download_at or "Never",
+                obj.last_download_email or "—"
             )
         return "No downloads yet"
     download_info.short_description = 'Download History'
     
+    def save_model(self, request, obj, form, change):
+        # The change form and the changelist's editable column both save through here
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if 'verified' in form.changed_data:
+                if obj.verified:
+                    grant_payments([obj])
+                else:
+                    revoke_payments([obj])
+    
     def mark_as_verified(self, request, queryset):
-        updated = queryset.update(verified=True)
+        # Materialized first: a ?verified__exact=0 filter would match nothing once updated
+        pks = list(queryset.filter(verified=False).values_list('pk', flat=True))
+        payments = list(Payment.objects.filter(pk__in=pks)
+                        .only('id', 'question_paper_id', 'email', 'phone_number', 'date_created'))
+        with transaction.atomic():
+            updated = Payment.objects.filter(pk__in=pks).update(verified=True)
+            grant_payments(payments)
         self.message_user(request, f"{updated} payments marked as verified.")
     mark_as_verified.short_description = "Mark selected payments as verified"
     
     def mark_as_unverified(self, request, queryset):
-        updated = queryset.update(verified=False)
+        payments = [Payment(pk=pk) for pk in queryset.filter(verified=True).values_list('pk', flat=True)]
+        with transaction.atomic():
+            updated = Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(verified=False)
+            revoke_payments(payments)
         self.message_user(request, f"{updated} payments marked as unverified.")
     mark_as_unverified.short_description = "Mark selected payments as unverified"
     
+    def download_total(self, obj):
+        return obj.download_total
+    download_total.short_description = 'Downloads'
+    download_total.admin_order_field = 'download_total'
+    
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('question_paper')
+        downloads = DownloadHistory.objects.filter(payment=OuterRef('pk'))
+        latest = downloads.order_by('-downloaded_at')
+        return super().get_queryset(request).select_related('question_paper').annotate(
+            download_total=Subquery(
+                downloads.order_by().values('payment').annotate(n=Count('id')).values('n')
+            ),
+            last_download_at=Subquery(latest.values('downloaded_at')[:1]),
+            last_download_email=Subquery(latest.values('user_email')[:1]),
+        )
 
 
 # --- 4. Admin setup for DownloadHistory ---
@@ -305,15 +339,16 @@ class DownloadHistoryAdmin(admin.ModelAdmin):
         'paper_link', 'user_email', 'downloaded_at', 
         'ip_address_short', 'payment_link', 'user_agent_short'
     ]
-    list_filter = ['downloaded_at', 'paper__class_level', 'paper__subject']
+    list_filter = ['downloaded_at', 'browser_family', 'paper__class_level', 'paper__subject']
     search_fields = ['user_email', 'paper__title', 'ip_address', 'user_agent']
     readonly_fields = ['downloaded_at', 'all_info']
+    raw_id_fields = ['paper', 'payment']
     date_hierarchy = 'downloaded_at'
     list_per_page = 50
     
     fieldsets = (
         ('Download Information', {
-            'fields': ('paper', 'user_email', 'downloaded_at', 'ip_address', 'user_agent')
+            'fields': ('paper', 'user_email', 'downloaded_at', 'ip_address', 'user_agent', 'browser_family')
         }),
         ('Payment Information', {
             'fields': ('payment',),
@@ -336,20 +371,8 @@ class DownloadHistoryAdmin(admin.ModelAdmin):
     ip_address_short.short_description = 'IP Address'
     
     def user_agent_short(self, obj):
-        if obj.user_agent:
-            ua = obj.user_agent.lower()
-            if 'chrome' in ua:
-                return 'Chrome'
-            elif 'firefox' in ua:
-                return 'Firefox'
-            elif 'safari' in ua and 'chrome' not in ua:
-                return 'Safari'
-            elif 'edge' in ua:
-                return 'Edge'
-            elif 'opera' in ua:
-                return 'Opera'
-            return ua[:30] + "..."
-        return "Unknown"
+        return obj.browser_family or "Unknown"
+    user_agent_short.admin_order_field = 'browser_family'
     user_agent_short.short_description = 'Browser'
     
     def payment_link(self, obj):
@@ -382,7 +405,8 @@ class FreeSampleAdmin(admin.ModelAdmin):
     ]
     list_filter = ['created_at']
     search_fields = ['question_paper__title', 'description']
-    readonly_fields = ['downloads', 'created_at', 'sample_info']
+    readonly_fields = ['downloads', 'created_at', 'sample_info', 'sample_preview_field']
+    autocomplete_fields = ['question_paper']
     
     fieldsets = (
         ('Sample Information', {
@@ -446,6 +470,70 @@ class FreeSampleAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('question_paper')
 
 
+# --- 6. Admin setup for the SMS Outbox ---
+
+@admin.register(SmsMessage)
+class SmsMessageAdmin(admin.ModelAdmin):
+    list_display = ['order', 'phone_number', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['order__ref', 'phone_number', 'provider_message_id']
+    readonly_fields = ['order', 'attempts', 'claimed_by', 'claimed_at', 'provider_message_id', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+    list_per_page = 50
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=SmsMessage.STATUS_SENT).update(
+            status=SmsMessage.STATUS_PENDING, next_attempt_at=timezone.now(), claimed_by='',
+            attempts=0, last_error='',
+        )
+        self.message_user(request, f"{updated} messages queued for immediate delivery.")
+    retry_now.short_description = "Retry selected messages now"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('order')
+
+
+# --- 7. Admin setup for Daily Paper Stats (written by `manage.py rollup_stats`) ---
+
+@admin.register(PaperDailyStats)
+class PaperDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'paper', 'downloads', 'sales', 'revenue', 'last_download_at']
+    list_filter = ['date', 'paper__class_level', 'paper__subject']
+    search_fields = ['paper__title']
+    date_hierarchy = 'date'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('paper__class_level', 'paper__term', 'paper__subject')
+
+
+# --- 8. Admin setup for PDF worker failures (written by the PDF background workers) ---
+
+@admin.register(PdfJobFailure)
+class PdfJobFailureAdmin(admin.ModelAdmin):
+    list_display = ['source', 'task', 'attempts', 'retry_at', 'updated_at']
+    list_filter = ['task']
+    search_fields = ['source', 'error_hash']
+    readonly_fields = ['task', 'source', 'attempts', 'error_hash', 'last_error', 'retry_at', 'updated_at']
+    actions = ['retry_now']
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_now(self, request, queryset):
+        # Deleting the record puts the file back in its worker's queue with a clean slate
+        deleted, _ = queryset.delete()
+        self.message_user(request, f"{deleted} files queued for their next worker pass.")
+    retry_now.short_description = "Retry selected files on the next pass"
+
+
 # Optional: Custom admin site header
 admin.site.site_header = 'InsiightPrep Administration'
 admin.site.site_title = 'InsiightPrep Admin Portal'
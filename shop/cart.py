@@ -2,22 +2,49 @@ from decimal import Decimal
 from django.conf import settings
 from .models import QuestionPaper
 
+CART_REQUEST_ATTR = '_shop_cart'
+
+
+def get_cart(request):
+    """The request's Cart, built once and shared by views and the context processor."""
+    cart = getattr(request, CART_REQUEST_ATTR, None)
+    if cart is None:
+        cart = Cart(request)
+        setattr(request, CART_REQUEST_ATTR, cart)
+    return cart
+
+
 class Cart:
+    """Session cart. Nothing is read until the cart is used; papers are fetched once.
+
+    The session only ever holds {paper_id: {'quantity': int, 'price': str}};
+    Decimals and model instances live in the per-request item rows. The
+    session is only written when the cart changes.
+    """
+
     def __init__(self, request):
         """Initialize the cart."""
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self._cart = None
+        self._items = None
+        self._total = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            # An empty cart is not stored: browsing must not create or save a session
+            cart = self.session.get(settings.CART_SESSION_ID)
+            self._cart = cart if cart is not None else {}
+        return self._cart
 
     def add(self, paper, quantity=1, override_quantity=False):
         """Add a paper to the cart or update its quantity."""
+        if settings.CART_SESSION_ID not in self.session:
+            self.session[settings.CART_SESSION_ID] = self.cart
         paper_id = str(paper.id)
         if paper_id not in self.cart:
             self.cart[paper_id] = {'quantity': 0, 'price': str(paper.price)}
-        
+
         if override_quantity:
             self.cart[paper_id]['quantity'] = quantity
         else:
@@ -27,6 +54,7 @@ class Cart:
     def save(self):
         # mark the session as "modified" to make sure it gets saved
         self.session.modified = True
+        self._items = self._total = None
 
     def remove(self, paper):
         """Remove a paper from the cart."""
@@ -35,28 +63,47 @@ class Cart:
             del self.cart[paper_id]
             self.save()
 
+    def items(self):
+        """Item rows for templates and checkout, built with a single in_bulk() query."""
+        if self._items is None:
+            papers = QuestionPaper.objects.select_related('class_level', 'term', 'subject').in_bulk(
+                [int(paper_id) for paper_id in self.cart]
+            )
+            stale = [paper_id for paper_id in self.cart if int(paper_id) not in papers]
+            if stale:
+                # Papers deleted since they were added
+                for paper_id in stale:
+                    del self.cart[paper_id]
+                self.save()
+            items = []
+            for paper_id, entry in self.cart.items():
+                price = Decimal(entry['price'])
+                items.append({
+                    'paper': papers[int(paper_id)],
+                    'quantity': entry['quantity'],
+                    'price': price,
+                    'total_price': price * entry['quantity'],
+                })
+            self._items = items
+        return self._items
+
     def __iter__(self):
-        """Iterate over the items in the cart and get the papers from the database."""
-        paper_ids = self.cart.keys()
-        # get the paper objects and add them to the cart
-        papers = QuestionPaper.objects.filter(id__in=paper_ids)
-        cart = self.cart.copy()
-        for paper in papers:
-            cart[str(paper.id)]['paper'] = paper
-
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        """Iterate over the items in the cart."""
+        return iter(self.items())
 
     def __len__(self):
         """Count all items in the cart."""
         return sum(item['quantity'] for item in self.cart.values())
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        # Summed over items() so papers deleted since they were added are never charged
+        if self._total is None:
+            self._total = sum((item['total_price'] for item in self.items()), Decimal('0'))
+        return self._total
 
     def clear(self):
         # remove cart from session
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        if self.session.pop(settings.CART_SESSION_ID, None) is not None:
+            self.save()
+        self._cart = None
+        self._items = self._total = None
@@ -0,0 +1,136 @@
+# shop/catalog.py
+
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+CATALOG_SNAPSHOT_KEY = 'shop:catalog:snapshot:{version}'
+PATH_REFRESH_BATCH_SIZE = 500
+
+# QuestionPaper fields that appear in the navigation tree. Saves that only
+# touch other fields (e.g. the view counter) leave the snapshot valid.
+PAPER_TREE_FIELDS = frozenset({'title', 'slug', 'class_level', 'term', 'subject', 'is_available'})
+
+
+def get_catalog_version():
+    """Return the current catalog version, seeding it if the cache is cold."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a cold cache never resurrects an old snapshot key
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every catalog-derived cache entry by moving to a new version."""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(CATALOG_VERSION_KEY, version, None)
+        return version
+
+
+def schedule_catalog_bump():
+    """Bump the version once the current transaction commits.
+
+    Bumping earlier would let another worker rebuild the snapshot from
+    uncommitted (and therefore invisible) rows under the new version.
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+def build_catalog_snapshot():
+    """Materialize the Class -> Term -> Subject -> papers tree in four queries."""
+    from .models import Classes, Term, Subject, QuestionPaper
+
+    subjects = {s['id']: s for s in Subject.objects.values('id', 'name', 'slug')}
+
+    # Available papers grouped by (class, term) and then by subject
+    grouped = {}
+    total_papers = 0
+    papers = (QuestionPaper.objects.filter(is_available=True)
+              .order_by('title', 'id')
+              .values('id', 'slug', 'title', 'class_level_id', 'term_id', 'subject_id'))
+    for p in papers:
+        total_papers += 1
+        by_subject = grouped.setdefault((p['class_level_id'], p['term_id']), {})
+        by_subject.setdefault(p['subject_id'], []).append(
+            {'id': p['id'], 'slug': p['slug'], 'title': p['title']}
+        )
+
+    terms_by_class = {}
+    for t in Term.objects.order_by('name', 'id').values('id', 'name', 'slug', 'class_name_id'):
+        by_subject = grouped.get((t['class_name_id'], t['id']), {})
+        subject_nodes = sorted(
+            (
+                {'subject': subjects[subject_id], 'papers': items, 'paper_count': len(items)}
+                for subject_id, items in by_subject.items()
+            ),
+            key=lambda node: (node['subject']['name'], node['subject']['id']),
+        )
+        terms_by_class.setdefault(t['class_name_id'], []).append({
+            'id': t['id'],
+            'name': t['name'],
+            'slug': t['slug'],
+            'subjects': subject_nodes,
+            'paper_count': sum(node['paper_count'] for node in subject_nodes),
+        })
+
+    classes = []
+    for c in Classes.objects.order_by('name', 'id').values('id', 'name', 'slug', 'description'):
+        terms = terms_by_class.get(c['id'], [])
+        classes.append(dict(
+            c,
+            terms=terms,
+            terms_by_slug={t['slug']: t for t in terms},
+            # Papers whose term belongs to another class are unreachable in the tree
+            paper_count=sum(t['paper_count'] for t in terms),
+        ))
+
+    return {
+        'classes': classes,
+        'classes_by_slug': {c['slug']: c for c in classes},
+        'total_papers': total_papers,
+    }
+
+
+def get_catalog_snapshot():
+    """Return the cached catalog tree, rebuilding it at most once per version."""
+    key = CATALOG_SNAPSHOT_KEY.format(version=get_catalog_version())
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_catalog_snapshot()
+        cache.set(key, snapshot, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+    return snapshot
+
+
+def refresh_paper_paths(**filters):
+    """Recompute canonical_path/display_label for the matching papers after a parent changed.
+
+    Only rows whose values actually changed are written, in bulk; their
+    updated_at moves too so cached card fragments keyed on it are replaced.
+    Returns the number of papers updated.
+    """
+    from .models import QuestionPaper
+    papers = (QuestionPaper.objects.filter(**filters)
+              .select_related('class_level', 'term', 'subject')
+              .only('id', 'slug', 'title', 'canonical_path', 'display_label',
+                    'class_level__slug', 'class_level__name', 'term__slug', 'term__name',
+                    'subject__slug', 'subject__name'))
+    now = timezone.now()
+    batch, updated = [], 0
+    for paper in papers.iterator(chunk_size=PATH_REFRESH_BATCH_SIZE):
+        if paper.set_denormalized_fields():
+            paper.updated_at = now
+            batch.append(paper)
+        if len(batch) >= PATH_REFRESH_BATCH_SIZE:
+            updated += QuestionPaper.objects.bulk_update(batch, ['canonical_path', 'display_label', 'updated_at'])
+            batch = []
+    if batch:
+        updated += QuestionPaper.objects.bulk_update(batch, ['canonical_path', 'display_label', 'updated_at'])
+    return updated
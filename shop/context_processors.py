@@ -1,5 +1,6 @@
 from django.utils import timezone
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+from .cart import get_cart
 
 def current_year(request):
     return {
@@ -7,4 +8,5 @@ def current_year(request):
     }
 
 def cart(request):
-    return {'cart': Cart(request)}
+    # Pages that never mention the cart never touch the session
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
@@ -0,0 +1,122 @@
+# shop/download_events.py
+
+import atexit
+import logging
+import re
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Checked in order: Edge, Opera and Samsung Internet also announce "Chrome",
+# and Chrome announces "Safari".
+BROWSER_PATTERNS = [
+    ('Edge', re.compile(r'edg(e|a|ios)?/', re.I)),
+    ('Opera', re.compile(r'opr/|opera', re.I)),
+    ('Samsung Internet', re.compile(r'samsungbrowser', re.I)),
+    ('Chrome', re.compile(r'chrome|crios', re.I)),
+    ('Firefox', re.compile(r'firefox|fxios', re.I)),
+    ('Safari', re.compile(r'safari', re.I)),
+]
+
+
+def parse_browser_family(user_agent):
+    if not user_agent:
+        return 'Unknown'
+    for family, pattern in BROWSER_PATTERNS:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+class DownloadEventBuffer:
+    """Per-process buffer that writes DownloadHistory rows with bulk_create.
+
+    Events are flushed once ``max_size`` are queued or the oldest one is
+    ``max_age`` seconds old, and at interpreter exit. If the bulk insert
+    fails, each event is written on its own so no download goes unlogged.
+    """
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._events = []
+        self._oldest = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            if self._oldest is None:
+                self._schedule()
+                self._oldest = time.monotonic()
+            self._events.append(event)
+            due = len(self._events) >= self.max_size or time.monotonic() - self._oldest >= self.max_age
+        if due:
+            self.flush()
+
+    def _schedule(self):
+        # Flush a quiet buffer even if no further download arrives
+        self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def _take(self):
+        with self._lock:
+            events, self._events, self._oldest = self._events, [], None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return events
+
+    def flush(self):
+        """Write every queued event. Returns the number of rows written."""
+        from .models import DownloadHistory
+        events = self._take()
+        if not events:
+            return 0
+        try:
+            DownloadHistory.objects.bulk_create(events, batch_size=500)
+            return len(events)
+        except Exception:
+            logger.exception("Bulk insert of %s download events failed; writing them one by one", len(events))
+        written = 0
+        for event in events:
+            event.pk = None
+            try:
+                event.save(force_insert=True)
+                written += 1
+            except Exception:
+                logger.exception("Dropping download event for paper %s", event.paper_id)
+        return written
+
+    def __len__(self):
+        return len(self._events)
+
+
+buffer = DownloadEventBuffer(
+    max_size=getattr(settings, 'DOWNLOAD_BUFFER_SIZE', 50),
+    max_age=getattr(settings, 'DOWNLOAD_BUFFER_MAX_AGE', 5),
+)
+atexit.register(buffer.flush)
+
+
+def record(event):
+    """Queue a DownloadHistory instance, or save it straight away if buffering is off."""
+    if not getattr(settings, 'DOWNLOAD_BUFFER_ENABLED', True):
+        event.save()
+        return event
+    try:
+        buffer.add(event)
+    except Exception:
+        logger.exception("Download buffer unavailable; writing event directly")
+        event.save()
+    return event
@@ -0,0 +1,104 @@
+# shop/download_links.py
+
+import datetime
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+TOKEN_SALT = 'shop.download_links'
+STORAGE_URL_KEY = 'download-url:{paper_id}'
+
+
+class InvalidDownloadLink(Exception):
+    """The token is malformed, was not signed by us, or has expired."""
+
+
+DownloadLink = namedtuple('DownloadLink', ['order_id', 'paper_id', 'expires'])
+
+
+# ====================================================================
+# TOKENS
+# ====================================================================
+
+def _signature(payload):
+    return salted_hmac(TOKEN_SALT, payload, algorithm='sha256').hexdigest()[:32]
+
+
+def make_token(order_id, paper_id, expires):
+    """``<order>.<paper>.<expiry>.<hmac>``; everything needed to check it travels with it."""
+    payload = f'{order_id}.{paper_id}.{int(expires)}'
+    return f'{payload}.{_signature(payload)}'
+
+
+def read_token(token, now=None):
+    """Check a token without touching the database. Returns a DownloadLink or raises InvalidDownloadLink."""
+    payload, _, signature = token.rpartition('.')
+    if not payload or not constant_time_compare(signature, _signature(payload)):
+        raise InvalidDownloadLink()
+    try:
+        link = DownloadLink(*(int(part) for part in payload.split('.')))
+    except (TypeError, ValueError):
+        raise InvalidDownloadLink()
+    if link.expires < (now if now is not None else time.time()):
+        raise InvalidDownloadLink()
+    return link
+
+
+def order_download_urls(order, expires=None):
+    """{paper id: signed download URL} for a verified order's papers.
+
+    Links are issued when the order is verified and expire DOWNLOAD_LINK_TTL
+    seconds later; pass ``expires`` to issue fresh ones (the buyer's profile).
+    """
+    if not order.verified:
+        return {}
+    if expires is None:
+        verified_at = order.verified_at or order.created_at
+        expires = (verified_at + datetime.timedelta(seconds=settings.DOWNLOAD_LINK_TTL)).timestamp()
+    return {
+        item.paper_id: reverse('shop:signed_download', args=[make_token(order.pk, item.paper_id, expires)])
+        for item in order.items.all()
+    }
+
+
+# ====================================================================
+# SHORT-LIVED STORAGE URLS
+# ====================================================================
+
+def sign_storage_url(field_file, expires):
+    """A storage URL for ``field_file`` that stops working at ``expires``, or None if the storage cannot sign one."""
+    try:
+        import cloudinary.utils
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+    except ImportError:
+        return None
+    storage = field_file.storage
+    if not isinstance(storage, MediaCloudinaryStorage):
+        return None
+    return cloudinary.utils.private_download_url(
+        field_file.name, '', resource_type=storage._get_resource_type(field_file.name),
+        type='upload', expires_at=int(expires), attachment=True,
+    )
+
+
+def cached_storage_url(paper_id):
+    return cache.get(STORAGE_URL_KEY.format(paper_id=paper_id))
+
+
+def storage_url(paper_id, field_file):
+    """Signed storage URL for a paper's delivered file, reused until shortly before it expires."""
+    url = cached_storage_url(paper_id)
+    if url is None:
+        ttl = settings.DOWNLOAD_STORAGE_URL_TTL
+        url = sign_storage_url(field_file, time.time() + ttl)
+        if url is not None:
+            cache.set(STORAGE_URL_KEY.format(paper_id=paper_id), url, ttl - settings.DOWNLOAD_STORAGE_URL_MARGIN)
+    return url
+
+
+def forget_storage_urls(paper_ids):
+    """Drop cached URLs after a paper's file or password changes."""
+    cache.delete_many([STORAGE_URL_KEY.format(paper_id=paper_id) for paper_id in paper_ids])
@@ -0,0 +1,203 @@
+# shop/downloads.py
+
+import logging
+import os
+import re
+from django.conf import settings
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from . import gateways
+from .download_links import storage_url
+from .protected_pdfs import artifact_key
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class ProtectedCopyNotReady(Exception):
+    """The paper has a password but its encrypted copy has not been produced yet."""
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single byte range, or None to send the whole file.
+
+    Multi-range and malformed headers are ignored, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def paper_etag(paper):
+    return quote_etag(paper.content_hash or f"{paper.pk}-{int(paper.updated_at.timestamp())}")
+
+
+def delivered_file(paper):
+    """(file, etag) a download sends: the pre-encrypted copy for papers with a password.
+
+    Encryption only happens in `manage.py encrypt_papers`. Until it has run for
+    the current file and password the uploaded file is sent as it was before
+    encrypted copies existed, or with PROTECTED_PDF_WAIT this raises
+    ProtectedCopyNotReady.
+    """
+    if not settings.PROTECTED_PDF_DELIVERY or not paper.password:
+        return paper.pdf_file, paper_etag(paper)
+    name = paper.protected_pdf_name
+    if name is None:
+        if settings.PROTECTED_PDF_WAIT:
+            raise ProtectedCopyNotReady()
+        logger.warning("Paper %s has no encrypted copy yet; sending the uploaded file", paper.pk)
+        return paper.pdf_file, paper_etag(paper)
+    return FieldFile(paper, paper.pdf_file.field, name), quote_etag(artifact_key(paper.content_hash, paper.password))
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return if_range == http_date(last_modified.timestamp())
+
+
+def _file_chunks(path, start, length, chunk_size):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _upstream_chunks(upstream, chunk_size):
+    with upstream:
+        yield from upstream.iter_content(chunk_size)
+
+
+def _local_path(field_file):
+    try:
+        return field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        return None
+
+
+def _stream_local(request, path, etag, last_modified):
+    size = os.path.getsize(path)
+    byte_range = None
+    if _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response, None
+    start, end = byte_range or (0, size - 1)
+    length = max(end - start + 1, 0)
+    response = StreamingHttpResponse(
+        _file_chunks(path, start, length, settings.DOWNLOAD_CHUNK_SIZE),
+        status=206 if byte_range else 200,
+        content_type='application/pdf',
+    )
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response, start
+
+
+def _stream_remote(request, field_file, etag, last_modified):
+    headers = {}
+    if request.headers.get('Range') and _if_range_matches(request, etag, last_modified):
+        headers['Range'] = request.headers['Range']
+    upstream = gateways.call('storage.fetch', 'GET', field_file.url, stream=True, headers=headers)
+    if upstream.status_code == 416:
+        upstream.close()
+        response = HttpResponse(status=416)
+        if 'Content-Range' in upstream.headers:
+            response['Content-Range'] = upstream.headers['Content-Range']
+        return response, None
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        raise gateways.GatewayError(f"storage.fetch returned HTTP {upstream.status_code}")
+    response = StreamingHttpResponse(
+        _upstream_chunks(upstream, settings.DOWNLOAD_CHUNK_SIZE),
+        status=upstream.status_code,
+        content_type='application/pdf',
+    )
+    for header in ('Content-Length', 'Content-Range'):
+        if header in upstream.headers:
+            response[header] = upstream.headers[header]
+    start = 0
+    if upstream.status_code == 206:
+        match = re.match(r'bytes (\d+)-', upstream.headers.get('Content-Range', ''))
+        start = int(match.group(1)) if match else None
+    return response, start
+
+
+def serve_paper_file(request, paper):
+    """Serve a paper's PDF (see delivered_file) according to DOWNLOAD_SERVE_MODE.
+
+    Returns (response, is_new_download). Range requests that resume past
+    byte 0, 304s and HEAD requests are not new downloads.
+    """
+    field_file, etag = delivered_file(paper)
+    mode = settings.DOWNLOAD_SERVE_MODE
+    if mode == 'auto':
+        # Only bytes already on this machine are worth sending through a web worker
+        mode = 'stream' if _local_path(field_file) else 'redirect'
+    if mode == 'redirect':
+        return HttpResponseRedirect(storage_url(paper.pk, field_file) or field_file.url), request.method == 'GET'
+
+    last_modified = paper.updated_at
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
+    )
+    if not_modified is not None:
+        response, start = not_modified, None
+    else:
+        path = _local_path(field_file)
+        if path and mode in ('accel', 'sendfile'):
+            # The front-end server sends the bytes (and handles Range itself)
+            response, start = HttpResponse(content_type='application/pdf'), 0
+            if mode == 'accel':
+                response['X-Accel-Redirect'] = settings.DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + field_file.name
+            else:
+                response['X-Sendfile'] = path
+        elif path:
+            response, start = _stream_local(request, path, etag, last_modified)
+        else:
+            response, start = _stream_remote(request, field_file, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(True, paper.file_name)
+    patch_cache_control(response, private=True, max_age=settings.DOWNLOAD_CACHE_MAX_AGE)
+    if request.method == 'HEAD' and isinstance(response, StreamingHttpResponse):
+        headers = dict(response.items())
+        response.close()
+        response = HttpResponse(status=response.status_code)
+        for header, value in headers.items():
+            response[header] = value
+    return response, request.method == 'GET' and start == 0 and response.status_code in (200, 206)
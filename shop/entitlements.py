@@ -0,0 +1,200 @@
+# shop/entitlements.py
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Checkout contact details of an anonymous buyer, kept so listings can badge their purchases
+BUYER_SESSION_KEY = 'buyer'
+CACHE_KEY = 'entitlements:{digest}'
+BACKFILL_BATCH_SIZE = 500
+
+
+# ====================================================================
+# IDENTITIES
+# ====================================================================
+
+def user_identity(user_id):
+    return f'user:{user_id}'
+
+
+def email_identity(email):
+    email = (email or '').strip().lower()
+    return f'email:{email}' if email else None
+
+
+def phone_identity(phone):
+    from .fulfillment import format_ghana_phone
+    phone = format_ghana_phone((phone or '').strip())
+    return f'phone:{phone}' if phone else None
+
+
+def buyer_identities(user_id=None, email=None, phone=None):
+    identities = [user_identity(user_id) if user_id else None, email_identity(email), phone_identity(phone)]
+    return [identity for identity in identities if identity]
+
+
+def request_identities(request):
+    """Identities of whoever is browsing: the signed-in user, plus contact details from checkout."""
+    user = request.user
+    if user.is_authenticated:
+        return buyer_identities(user.pk, user.email)
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return []
+    buyer = request.session.get(BUYER_SESSION_KEY) or {}
+    return buyer_identities(email=buyer.get('email'), phone=buyer.get('phone'))
+
+
+def remember_buyer(request, email, phone):
+    if not request.user.is_authenticated:
+        request.session[BUYER_SESSION_KEY] = {'email': email, 'phone': phone}
+
+
+# ====================================================================
+# GRANTING
+# ====================================================================
+
+def _cache_key(identity):
+    return CACHE_KEY.format(digest=hashlib.md5(identity.encode(), usedforsecurity=False).hexdigest())
+
+
+def forget(identities):
+    cache.delete_many([_cache_key(identity) for identity in identities])
+
+
+def _grant(rows):
+    """bulk_create ``rows``, skipping pairs that already exist; cached sets are dropped after commit.
+
+    Returns the number of rows offered, including ones that already existed.
+    """
+    from .models import Entitlement
+    if not rows:
+        return 0
+    Entitlement.objects.bulk_create(rows, ignore_conflicts=True, batch_size=BACKFILL_BATCH_SIZE)
+    identities = {row.identity for row in rows}
+    transaction.on_commit(lambda: forget(identities))
+    return len(rows)
+
+
+def order_entitlements(order):
+    from .models import Entitlement
+    identities = buyer_identities(order.user_id, order.email, order.phone_number)
+    return [
+        Entitlement(identity=identity, paper_id=item.paper_id, order=order, granted_at=order.verified_at or order.created_at)
+        for item in order.items.all() for identity in identities
+    ]
+
+
+def payment_entitlements(payment):
+    from .models import Entitlement
+    return [
+        Entitlement(identity=identity, paper_id=payment.question_paper_id, payment=payment, granted_at=payment.date_created)
+        for identity in buyer_identities(email=payment.email, phone=payment.phone_number)
+    ]
+
+
+def grant_order(order):
+    """Entitle an order's buyer to its papers; called when the order becomes verified."""
+    return _grant(order_entitlements(order))
+
+
+def grant_payments(payments):
+    return _grant([row for payment in payments for row in payment_entitlements(payment)])
+
+
+def revoke_payments(payments):
+    """Withdraw what ``payments`` granted; called once they are no longer verified.
+
+    Rows are shared per (identity, paper), so pairs another verified payment or
+    order also covers are granted again from that purchase. Returns the number
+    of pairs withdrawn.
+    """
+    from .models import Entitlement, Order, Payment
+    granted = Entitlement.objects.filter(payment__in=[payment.pk for payment in payments])
+    pairs = set(granted.values_list('identity', 'paper_id'))
+    if not pairs:
+        return 0
+    granted.delete()
+    papers = {paper_id for _, paper_id in pairs}
+    others = (Payment.objects.filter(verified=True, question_paper_id__in=papers)
+              .only('id', 'question_paper_id', 'email', 'phone_number', 'date_created'))
+    orders = (Order.objects.filter(verified=True, items__paper_id__in=papers).distinct()
+              .only('id', 'user_id', 'email', 'phone_number', 'verified_at', 'created_at')
+              .prefetch_related('items'))
+    rows = [row for payment in others for row in payment_entitlements(payment)]
+    rows += [row for order in orders for row in order_entitlements(order)]
+    _grant([row for row in rows if (row.identity, row.paper_id) in pairs])
+    identities = {identity for identity, _ in pairs}
+    transaction.on_commit(lambda: forget(identities))
+    return len(pairs)
+
+
+def backfill_orders(batch_size=BACKFILL_BATCH_SIZE):
+    """Entitle the buyers of historical verified orders; yields (orders, rows) per batch."""
+    from .models import Order
+    last = 0
+    while True:
+        batch = list(Order.objects.filter(verified=True, pk__gt=last).order_by('pk')
+                     .only('id', 'user_id', 'email', 'phone_number', 'verified_at', 'created_at')
+                     .prefetch_related('items')[:batch_size])
+        if not batch:
+            return
+        with transaction.atomic():
+            granted = _grant([row for order in batch for row in order_entitlements(order)])
+        last = batch[-1].pk
+        yield len(batch), granted
+
+
+def backfill_payments(batch_size=BACKFILL_BATCH_SIZE):
+    """Entitle the buyers of verified legacy payments; yields (payments, rows) per batch."""
+    from .models import Payment
+    last = 0
+    while True:
+        batch = list(Payment.objects.filter(verified=True, pk__gt=last).order_by('pk')
+                     .only('id', 'question_paper_id', 'email', 'phone_number', 'date_created')[:batch_size])
+        if not batch:
+            return
+        with transaction.atomic():
+            granted = grant_payments(batch)
+        last = batch[-1].pk
+        yield len(batch), granted
+
+
+# ====================================================================
+# LOOKUPS
+# ====================================================================
+
+def owned_paper_ids(identities):
+    """Ids of the papers any of ``identities`` owns: one get_many, one query for the identities not cached."""
+    from .models import Entitlement
+    if not identities:
+        return frozenset()
+    keys = {identity: _cache_key(identity) for identity in identities}
+    cached = cache.get_many(list(keys.values()))
+    owned = set()
+    missing = []
+    for identity, key in keys.items():
+        if key in cached:
+            owned.update(cached[key])
+        else:
+            missing.append(identity)
+    if missing:
+        fresh = {identity: [] for identity in missing}
+        for identity, paper_id in Entitlement.objects.filter(identity__in=missing).values_list('identity', 'paper_id'):
+            fresh[identity].append(paper_id)
+        cache.set_many({keys[identity]: ids for identity, ids in fresh.items()}, settings.ENTITLEMENT_CACHE_TIMEOUT)
+        for ids in fresh.values():
+            owned.update(ids)
+    return frozenset(owned)
+
+
+def purchased_paper_ids(request):
+    """The browsing buyer's papers, looked up once per request."""
+    if not hasattr(request, '_purchased_paper_ids'):
+        request._purchased_paper_ids = owned_paper_ids(request_identities(request))
+    return request._purchased_paper_ids
+
+
+def has_purchased(request, paper):
+    return paper.pk in purchased_paper_ids(request)
@@ -0,0 +1,174 @@
+# shop/facets.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from .catalog import get_catalog_version
+
+FACET_CUBE_KEY = 'shop:facets:cube:{version}'
+
+# Paper fields the facet counts depend on; partial saves touching them must
+# move the catalog version (see shop.signals)
+FACET_FIELDS = frozenset({'year', 'exam_type', 'subject', 'class_level', 'is_paid', 'is_available'})
+
+
+class Facet:
+    """One browse dimension: its query parameter, the grouped column and how values are shown."""
+
+    def __init__(self, param, column, label):
+        self.param = param
+        self.column = column
+        self.label = label
+
+    def parse(self, raw, cube):
+        """Map a query-string value to a column value, or None if it names nothing."""
+        return raw if raw in cube['labels'][self.param] else None
+
+    def url_value(self, value, cube):
+        return value
+
+
+class SlugFacet(Facet):
+    """A foreign key exposed by slug (class, subject)."""
+
+    def parse(self, raw, cube):
+        return cube['slugs'][self.param].get(raw)
+
+    def url_value(self, value, cube):
+        return cube['labels'][self.param][value][1]
+
+
+class YearFacet(Facet):
+    def parse(self, raw, cube):
+        return int(raw) if raw.isdigit() and int(raw) in cube['labels'][self.param] else None
+
+
+class PriceFacet(Facet):
+    VALUES = {'free': False, 'paid': True}
+
+    def parse(self, raw, cube):
+        return self.VALUES.get(raw)
+
+    def url_value(self, value, cube):
+        return 'paid' if value else 'free'
+
+
+FACETS = (
+    SlugFacet('class', 'class_level_id', 'Class'),
+    SlugFacet('subject', 'subject_id', 'Subject'),
+    YearFacet('year', 'year', 'Year'),
+    Facet('type', 'exam_type', 'Exam Type'),
+    PriceFacet('price', 'is_paid', 'Price'),
+)
+
+
+def build_facet_cube():
+    """Count available papers per combination of every facet column, in one GROUP BY.
+
+    The result has at most one row per distinct combination, so it stays
+    small next to the paper table, and counts for any selection can be
+    summed from it without touching the database again.
+    """
+    from .models import Classes, Subject, QuestionPaper
+    columns = [facet.column for facet in FACETS]
+    rows = [
+        (tuple(row[c] for c in columns), row['n'])
+        for row in (QuestionPaper.objects.filter(is_available=True)
+                    .values(*columns).annotate(n=Count('id')).order_by())
+    ]
+    classes = {c['id']: (c['name'], c['slug']) for c in Classes.objects.values('id', 'name', 'slug')}
+    subjects = {s['id']: (s['name'], s['slug']) for s in Subject.objects.values('id', 'name', 'slug')}
+    exam_types = dict(QuestionPaper._meta.get_field('exam_type').choices)
+    labels = {
+        'class': classes,
+        'subject': subjects,
+        'year': {year: str(year) for year in {key[columns.index('year')] for key, _ in rows}},
+        'type': exam_types,
+        'price': {False: 'Free', True: 'Paid'},
+    }
+    return {
+        'rows': rows,
+        'labels': labels,
+        'slugs': {param: {slug: pk for pk, (_, slug) in labels[param].items()} for param in ('class', 'subject')},
+    }
+
+
+def get_facet_cube():
+    """The cube for the current catalog version, built at most once per version."""
+    key = FACET_CUBE_KEY.format(version=get_catalog_version())
+    cube = cache.get(key)
+    if cube is None:
+        cube = build_facet_cube()
+        cache.set(key, cube, settings.FACET_CACHE_TIMEOUT)
+    return cube
+
+
+def parse_selection(query, cube):
+    """{facet param: set of column values} for the recognised values in ``query`` (a QueryDict)."""
+    selection = {}
+    for facet in FACETS:
+        values = {facet.parse(raw, cube) for raw in query.getlist(facet.param)} - {None}
+        if values:
+            selection[facet.param] = values
+    return selection
+
+
+def selection_filters(selection):
+    """ORM filters for ``selection``: values OR within a facet, AND across facets."""
+    return {f'{facet.column}__in': selection[facet.param] for facet in FACETS if facet.param in selection}
+
+
+def facet_counts(cube, selection):
+    """{param: {value: count}}, each facet counted under the other facets' selections.
+
+    Leaving a facet's own selection out keeps its alternatives visible with
+    the count they would have if picked instead.
+    """
+    counts = {facet.param: {} for facet in FACETS}
+    chosen = [selection.get(facet.param) for facet in FACETS]
+    for key, n in cube['rows']:
+        misses = [i for i, values in enumerate(chosen) if values is not None and key[i] not in values]
+        if len(misses) > 1:
+            continue
+        for i, facet in enumerate(FACETS):
+            if not misses or misses == [i]:
+                bucket = counts[facet.param]
+                bucket[key[i]] = bucket.get(key[i], 0) + n
+    return counts
+
+
+def total_count(cube, selection):
+    chosen = [selection.get(facet.param) for facet in FACETS]
+    return sum(n for key, n in cube['rows']
+               if all(values is None or key[i] in values for i, values in enumerate(chosen)))
+
+
+def facet_options(query, cube, selection, counts):
+    """Template-ready facets: each option carries its count and the query string that toggles it."""
+    facets = []
+    for facet in FACETS:
+        labels = cube['labels'][facet.param]
+        selected = selection.get(facet.param, set())
+        options = []
+        # A selected value keeps its option (at 0) so it can still be cleared
+        values = {**dict.fromkeys(selected, 0), **counts[facet.param]}
+        for value, count in values.items():
+            label = labels[value][0] if isinstance(facet, SlugFacet) else labels.get(value, str(value))
+            toggled = query.copy()
+            toggled.pop('after', None)
+            current = [v for v in toggled.getlist(facet.param) if facet.parse(v, cube) != value]
+            if value not in selected:
+                current.append(str(facet.url_value(value, cube)))
+            toggled.setlist(facet.param, current)
+            options.append({
+                'label': label,
+                'count': count,
+                'selected': value in selected,
+                'query': toggled.urlencode(),
+            })
+        if facet.param == 'year':
+            options.sort(key=lambda o: o['label'], reverse=True)
+        else:
+            options.sort(key=lambda o: o['label'])
+        facets.append({'param': facet.param, 'label': facet.label, 'options': options})
+    return facets
@@ -0,0 +1,80 @@
+# shop/fragments.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+CARD_KEY = 'shop:card:{template}:{paper_id}:{stamp}'
+SLOT = '<!--slot:{name}-->'
+CARD_RELATIONS = ('class_level', 'term', 'subject')
+
+
+class SlotMarkers:
+    """``{{ slot.title }}`` in a card template renders a marker that is filled per request.
+
+    Lets cards with query-specific parts (search highlights) share one cached fragment.
+    """
+
+    def __getitem__(self, name):
+        return mark_safe(SLOT.format(name=name))
+
+
+class PaperCard:
+    """A paper with its rendered card; ``{{ card }}`` outputs the HTML."""
+
+    __slots__ = ('paper', 'html')
+
+    def __init__(self, paper, html):
+        self.paper = paper
+        self.html = html
+
+    def __str__(self):
+        return self.html
+
+    def __html__(self):
+        return self.html
+
+
+def card_key(template_name, paper):
+    stamp = int(paper.updated_at.timestamp() * 1_000_000)
+    return CARD_KEY.format(template=template_name, paper_id=paper.pk, stamp=stamp)
+
+
+def _relations_loaded(paper):
+    return all(paper._meta.get_field(name).is_cached(paper) for name in CARD_RELATIONS)
+
+
+def render_paper_cards(papers, template_name, slots=None):
+    """Return a PaperCard per paper, in order, with one get_many for the whole page.
+
+    ``papers`` only needs ``id`` and ``updated_at`` loaded: misses are
+    re-fetched with their class, term and subject in a single query before
+    rendering. ``slots(paper)`` returns {name: html} for the card's
+    SlotMarkers; values are escaped unless marked safe.
+    """
+    from .models import QuestionPaper
+    papers = list(papers)
+    keys = {paper.pk: card_key(template_name, paper) for paper in papers}
+    cached = cache.get_many(list(keys.values()))
+
+    missing = [paper for paper in papers if keys[paper.pk] not in cached]
+    if missing:
+        to_load = [paper.pk for paper in missing if not _relations_loaded(paper)]
+        loaded = QuestionPaper.objects.select_related(*CARD_RELATIONS).in_bulk(to_load) if to_load else {}
+        fresh = {}
+        for paper in missing:
+            source = loaded.get(paper.pk, paper)
+            fresh[keys[paper.pk]] = render_to_string(template_name, {'paper': source, 'slot': SlotMarkers()})
+        cache.set_many(fresh, settings.FRAGMENT_CACHE_TIMEOUT)
+        cached.update(fresh)
+
+    cards = []
+    for paper in papers:
+        html = cached[keys[paper.pk]]
+        if slots is not None:
+            for name, value in slots(paper).items():
+                html = html.replace(SLOT.format(name=name), conditional_escape(value))
+        cards.append(PaperCard(paper, mark_safe(html)))
+    return cards
@@ -0,0 +1,201 @@
+# shop/fulfillment.py
+
+import datetime
+import logging
+import random
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import gateways
+from .entitlements import grant_order
+from .models import Order, OrderItem, SmsMessage
+
+logger = logging.getLogger(__name__)
+
+SMS_HEADER = "InsiightPrep order #{ref} passwords:"
+SMS_UPDATE_HEADER = "InsiightPrep order #{ref} new passwords:"
+SMS_FOOTER = "Thanks for using InsiightPrep!"
+
+
+def format_ghana_phone(phone):
+    if not phone: return phone
+    clean_phone = re.sub(r'\D', '', str(phone))
+    if clean_phone.startswith('0') and len(clean_phone) == 10:
+        return f"+233{clean_phone[1:]}"
+    if clean_phone.startswith('233') and len(clean_phone) == 12:
+        return f"+{clean_phone}"
+    if len(clean_phone) >= 9 and not str(phone).startswith('+'):
+        return f"+{clean_phone}"
+    return phone
+
+
+# ====================================================================
+# ENQUEUEING
+# ====================================================================
+
+def build_password_messages(ref, lines, max_length=None, header=SMS_HEADER):
+    """Pack (title, password) pairs into as few SMS bodies as the limit allows."""
+    max_length = max_length or settings.SMS_MAX_LENGTH
+    header = header.format(ref=ref)
+    messages, current = [], []
+
+    def render(body_lines, with_footer):
+        return '\n'.join([header] + body_lines + ([SMS_FOOTER] if with_footer else []))
+
+    room = max_length - len(header) - 1
+    for title, password in lines:
+        line = f"{title}: {password}"
+        if len(line) > room:
+            # Shorten the title, never the password
+            line = f"{title[:max(room - len(password) - 2, 0)]}: {password}"[:room]
+        if current and len(render(current + [line], False)) > max_length:
+            messages.append(current)
+            current = []
+        current.append(line)
+    if current:
+        messages.append(current)
+
+    bodies = [render(body, False) for body in messages]
+    # Only append the sign-off where it still fits
+    if bodies and len(render(messages[-1], True)) <= max_length:
+        bodies[-1] = render(messages[-1], True)
+    return bodies
+
+
+def enqueue_sms_fulfillment(order):
+    """Queue the password SMS for an order; delivery happens in the outbox worker."""
+    items = order.items.select_related('paper').order_by('id')
+    lines = [(item.paper.title, item.paper.password) for item in items if item.paper.password]
+    if not lines:
+        return []
+    to_phone = format_ghana_phone(order.phone_number)
+    return SmsMessage.objects.bulk_create([
+        SmsMessage(order=order, phone_number=to_phone, content=body)
+        for body in build_password_messages(order.ref, lines)
+    ])
+
+
+def enqueue_password_updates(paper_ids):
+    """Queue the new passwords of ``paper_ids`` to every verified order that bought them.
+
+    Called after shop.protected_pdfs.rotate_passwords: downloads switch to copies
+    encrypted with the new password, which buyers only ever received by SMS.
+    """
+    items = (OrderItem.objects.filter(paper_id__in=paper_ids, order__verified=True)
+             .exclude(paper__password='').select_related('paper').order_by('order_id', 'id'))
+    lines = {}
+    for item in items:
+        lines.setdefault(item.order_id, []).append((item.paper.title, item.paper.password))
+    orders = Order.objects.filter(pk__in=lines).only('id', 'ref', 'phone_number')
+    return SmsMessage.objects.bulk_create([
+        SmsMessage(order=order, phone_number=format_ghana_phone(order.phone_number), content=body)
+        for order in orders
+        for body in build_password_messages(order.ref, lines[order.pk], header=SMS_UPDATE_HEADER)
+    ])
+
+
+def verify_and_fulfill(order, transaction_id=None):
+    """Verify an order, entitle its buyer and queue its SMS exactly once, however many callers race."""
+    with transaction.atomic():
+        won = order.mark_as_verified(transaction_id)
+        if won:
+            grant_order(order)
+            enqueue_sms_fulfillment(order)
+    return won
+
+
+# ====================================================================
+# DELIVERY
+# ====================================================================
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped at SMS_RETRY_MAX_DELAY seconds."""
+    base = settings.SMS_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+    delay = min(base, settings.SMS_RETRY_MAX_DELAY)
+    return datetime.timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def send_sms(message):
+    """Send one outbox message. Returns (ok, provider_message_id, error)."""
+    if not settings.HTTPSMS_API_KEY:
+        return False, '', 'HTTPSMS_API_KEY is not configured.'
+    try:
+        res = gateways.httpsms_send(message.content, message.phone_number, settings.HTTPSMS_FROM_NUMBER)
+    except gateways.GatewayError as exc:
+        return False, '', str(exc)
+    if res.status_code in (200, 201):
+        try:
+            provider_id = str(res.json().get('data', {}).get('id', ''))
+        except ValueError:
+            provider_id = ''
+        return True, provider_id, ''
+    return False, '', f"HTTP {res.status_code}: {res.text[:500]}"
+
+
+def release_stale_claims(lease_seconds=None):
+    """Return messages left in 'sending' by a crashed worker to the queue."""
+    lease = lease_seconds or settings.SMS_CLAIM_LEASE
+    cutoff = timezone.now() - datetime.timedelta(seconds=lease)
+    return SmsMessage.objects.filter(
+        status=SmsMessage.STATUS_SENDING, claimed_at__lt=cutoff
+    ).update(status=SmsMessage.STATUS_PENDING, claimed_by='')
+
+
+def claim_batch(batch_size):
+    """Atomically claim due messages so concurrent workers never share one."""
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    due_ids = list(
+        SmsMessage.objects.filter(status=SmsMessage.STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    if not due_ids:
+        return []
+    SmsMessage.objects.filter(id__in=due_ids, status=SmsMessage.STATUS_PENDING).update(
+        status=SmsMessage.STATUS_SENDING, claimed_by=token, claimed_at=now
+    )
+    return list(SmsMessage.objects.filter(claimed_by=token, status=SmsMessage.STATUS_SENDING))
+
+
+def record_result(message, ok, provider_id, error, max_attempts=None):
+    max_attempts = max_attempts or settings.SMS_MAX_ATTEMPTS
+    message.attempts += 1
+    message.claimed_by = ''
+    if ok:
+        message.status = SmsMessage.STATUS_SENT
+        message.sent_at = timezone.now()
+        message.provider_message_id = provider_id
+        message.last_error = ''
+    elif message.attempts >= max_attempts:
+        message.status = SmsMessage.STATUS_FAILED
+        message.last_error = error
+        logger.error("SMS %s to %s failed permanently: %s", message.pk, message.phone_number, error)
+    else:
+        message.status = SmsMessage.STATUS_PENDING
+        message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
+        message.last_error = error
+    message.save(update_fields=[
+        'status', 'attempts', 'claimed_by', 'sent_at', 'provider_message_id', 'next_attempt_at', 'last_error'
+    ])
+
+
+def drain_outbox(concurrency=None, batch_size=50, max_attempts=None):
+    """Deliver one batch of due messages. Returns the number of messages processed.
+
+    HTTP calls run in a thread pool; status writes stay on the calling thread so
+    the database only ever sees one writer per worker.
+    """
+    concurrency = concurrency or settings.SMS_WORKER_CONCURRENCY
+    release_stale_claims()
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send_sms, batch))
+    with transaction.atomic():
+        for message, (ok, provider_id, error) in zip(batch, results):
+            record_result(message, ok, provider_id, error, max_attempts=max_attempts)
+    return len(batch)
@@ -0,0 +1,250 @@
+# shop/gateways.py
+
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds per endpoint; override with GATEWAY_TIMEOUTS
+DEFAULT_TIMEOUTS = {
+    'paystack.initialize': (3.05, 10),
+    'paystack.verify': (3.05, 10),
+    'httpsms.send': (3.05, 15),
+    'storage.fetch': (3.05, 30),
+}
+
+
+class GatewayError(Exception):
+    """An outbound call failed (network error, timeout or 5xx)."""
+
+
+class CircuitOpenError(GatewayError):
+    """The service is marked as degraded; the call was not attempted."""
+
+
+# ====================================================================
+# CIRCUIT BREAKER
+# ====================================================================
+
+class CircuitBreaker:
+    """Fail fast after repeated failures, then let one probe call through."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+                raise CircuitOpenError(f"{self.name} circuit is open; failing fast.")
+            if state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("%s circuit opened after %s failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+
+# ====================================================================
+# METRICS
+# ====================================================================
+
+class GatewayMetrics:
+    """Per-endpoint call, error and latency counters for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, endpoint, latency, error=None):
+        with self._lock:
+            entry = self._data.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'short_circuited': 0,
+                'total_latency': 0.0, 'max_latency': 0.0,
+            })
+            entry['calls'] += 1
+            if error == 'circuit_open':
+                entry['short_circuited'] += 1
+            elif error:
+                entry['errors'] += 1
+            entry['total_latency'] += latency
+            entry['max_latency'] = max(entry['max_latency'], latency)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: dict(entry, avg_latency=entry['total_latency'] / entry['calls'] if entry['calls'] else 0.0)
+                for endpoint, entry in self._data.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+metrics = GatewayMetrics()
+
+
+# ====================================================================
+# POOLED SESSION
+# ====================================================================
+
+def _build_session():
+    retry = Retry(
+        total=settings.GATEWAY_MAX_RETRIES,
+        connect=settings.GATEWAY_MAX_RETRIES,
+        read=settings.GATEWAY_MAX_RETRIES,
+        status=settings.GATEWAY_MAX_RETRIES,
+        # Only idempotent requests are retried after the request was sent;
+        # connection failures are retried for every method.
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        status_forcelist=(502, 503, 504),
+        backoff_factor=0.3,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.GATEWAY_POOL_CONNECTIONS,
+        pool_maxsize=settings.GATEWAY_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+_breakers = {}
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_breaker(service):
+    breaker = _breakers.get(service)
+    if breaker is None:
+        with _session_lock:
+            breaker = _breakers.setdefault(service, CircuitBreaker(
+                service,
+                failure_threshold=settings.GATEWAY_BREAKER_THRESHOLD,
+                reset_timeout=settings.GATEWAY_BREAKER_RESET,
+            ))
+    return breaker
+
+
+def reset_gateways():
+    """Drop pooled connections, breakers and counters (used by tests)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _breakers.clear()
+    metrics.reset()
+
+
+def _timeout(endpoint):
+    return getattr(settings, 'GATEWAY_TIMEOUTS', {}).get(endpoint, DEFAULT_TIMEOUTS[endpoint])
+
+
+def call(endpoint, method, url, **kwargs):
+    """Issue a request through the shared pool, guarded by the service breaker."""
+    breaker = get_breaker(endpoint.split('.')[0])
+    started = time.monotonic()
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        metrics.record(endpoint, 0.0, error='circuit_open')
+        raise
+    try:
+        response = get_session().request(method, url, timeout=_timeout(endpoint), **kwargs)
+    except requests.RequestException as exc:
+        breaker.record_failure()
+        metrics.record(endpoint, time.monotonic() - started, error=type(exc).__name__)
+        raise GatewayError(f"{endpoint} failed: {exc}") from exc
+    except Exception as exc:
+        # Anything else (a bad argument, a bug) still has to release a half-open probe
+        breaker.record_failure()
+        metrics.record(endpoint, time.monotonic() - started, error=type(exc).__name__)
+        raise
+    latency = time.monotonic() - started
+    if response.status_code >= 500:
+        breaker.record_failure()
+        metrics.record(endpoint, latency, error=f"HTTP {response.status_code}")
+        raise GatewayError(f"{endpoint} returned HTTP {response.status_code}")
+    breaker.record_success()
+    metrics.record(endpoint, latency)
+    return response
+
+
+# ====================================================================
+# SERVICE CLIENTS
+# ====================================================================
+
+def _paystack_headers():
+    return {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}", "Content-Type": "application/json"}
+
+
+def _json(response, endpoint):
+    try:
+        return response.json()
+    except ValueError as exc:
+        raise GatewayError(f"{endpoint} returned a non-JSON body") from exc
+
+
+def paystack_initialize(data):
+    url = f"{settings.PAYSTACK_BASE_URL}/transaction/initialize"
+    return _json(call('paystack.initialize', 'POST', url, headers=_paystack_headers(), json=data), 'paystack.initialize')
+
+
+def paystack_verify(reference):
+    url = f"{settings.PAYSTACK_BASE_URL}/transaction/verify/{reference}"
+    return _json(call('paystack.verify', 'GET', url, headers=_paystack_headers()), 'paystack.verify')
+
+
+def httpsms_send(content, to, sender):
+    url = f"{settings.HTTPSMS_BASE_URL}/v1/messages/send"
+    headers = {"x-api-key": settings.HTTPSMS_API_KEY, "Content-Type": "application/json"}
+    return call('httpsms.send', 'POST', url, headers=headers, json={"content": content, "to": to, "from": sender})
@@ -0,0 +1,336 @@
+# shop/importer.py
+
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from django.core.files import File
+from django.db import transaction
+from django.utils.text import slugify
+from . import search
+from .catalog import schedule_catalog_bump
+from .models import Classes, Term, Subject, QuestionPaper
+from .pdf_metadata import format_file_size, measure_path
+
+logger = logging.getLogger(__name__)
+
+SLUG_MAX_LENGTH = QuestionPaper._meta.get_field('slug').max_length
+EXAM_TYPES = {key for key, _ in QuestionPaper._meta.get_field('exam_type').choices}
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+
+class ManifestError(Exception):
+    """A manifest row cannot be imported."""
+
+
+# ====================================================================
+# MANIFEST
+# ====================================================================
+
+def read_manifest(path):
+    """Return manifest rows as dicts. CSV needs a header row; JSON is a list of objects."""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as fh:
+            rows = json.load(fh)
+        if not isinstance(rows, list):
+            raise ManifestError("A JSON manifest must be a list of objects.")
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as fh:
+            rows = list(csv.DictReader(fh))
+    return [{key.strip().lower(): value for key, value in row.items() if key} for row in rows]
+
+
+class Hierarchy:
+    """Classes, terms and subjects loaded once, matched by slug or name.
+
+    With ``create_missing``, unknown names resolve to unsaved instances that
+    `save_new()` inserts inside the transaction of the batch that uses them,
+    so a dry run or a failed batch leaves no rows behind.
+    """
+
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self.new = []
+        self.classes = {}
+        for obj in Classes.objects.all():
+            self.classes[obj.slug] = self.classes[slugify(obj.name)] = obj
+        self.terms = {}
+        for obj in Term.objects.select_related('class_name'):
+            # Keyed by the class slug so terms of a not-yet-saved class resolve too
+            class_slug = obj.class_name.slug
+            self.terms[(class_slug, obj.slug)] = self.terms[(class_slug, slugify(obj.name))] = obj
+        self.subjects = {}
+        for obj in Subject.objects.all():
+            self.subjects[obj.slug] = self.subjects[slugify(obj.name)] = obj
+
+    def _resolve(self, lookup, key, label, value, build):
+        if key in lookup:
+            return lookup[key]
+        if not self.create_missing:
+            raise ManifestError(f"Unknown {label} '{value}'.")
+        lookup[key] = obj = build()
+        self.new.append(obj)
+        return obj
+
+    def save_new(self):
+        """Insert the instances resolved since the last call. Run it inside the batch's transaction."""
+        for obj in self.new:
+            obj.save(force_insert=True)
+        self.new = []
+
+    def resolve(self, row):
+        names = {label: (row.get(label) or '').strip() for label in ('class', 'term', 'subject')}
+        for label, value in names.items():
+            if not value or not slugify(value):
+                raise ManifestError(f"Missing {label}.")
+        class_level = self._resolve(
+            self.classes, slugify(names['class']), 'class', names['class'],
+            lambda: Classes(name=names['class'], slug=slugify(names['class'])),
+        )
+        term = self._resolve(
+            self.terms, (class_level.slug, slugify(names['term'])), 'term', names['term'],
+            lambda: Term(class_name=class_level, name=names['term'], slug=slugify(names['term'])),
+        )
+        subject = self._resolve(
+            self.subjects, slugify(names['subject']), 'subject', names['subject'],
+            lambda: Subject(name=names['subject'], slug=slugify(names['subject'])),
+        )
+        return class_level, term, subject
+
+
+class SlugAllocator:
+    """Hands out unique paper slugs from one prefetched set instead of a query per candidate."""
+
+    def __init__(self):
+        self.taken = set(QuestionPaper.objects.values_list('slug', flat=True))
+
+    def allocate(self, base):
+        base = (slugify(base) or uuid.uuid4().hex[:12])[:SLUG_MAX_LENGTH - 6].strip('-')
+        candidate, counter = base, 1
+        while candidate in self.taken:
+            candidate = f"{base}-{counter}"
+            counter += 1
+        self.taken.add(candidate)
+        return candidate
+
+
+def _flag(value, default):
+    if value in (None, ''):
+        return default
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def build_paper(row, hierarchy, slugs):
+    """Turn a manifest row into an unsaved QuestionPaper with everything save() would have set."""
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ManifestError("Missing title.")
+    class_level, term, subject = hierarchy.resolve(row)
+    try:
+        price = Decimal(str(row.get('price') or '0'))
+    except InvalidOperation:
+        raise ManifestError(f"Invalid price '{row.get('price')}'.")
+    paper = QuestionPaper(
+        title=title,
+        description=row.get('description') or '',
+        class_level=class_level,
+        term=term,
+        subject=subject,
+        price=price,
+        is_paid=_flag(row.get('is_paid'), price > 0),
+        is_available=_flag(row.get('is_available'), True),
+        password=row.get('password') or '',
+    )
+    if row.get('year'):
+        try:
+            paper.year = int(row['year'])
+        except (TypeError, ValueError):
+            raise ManifestError(f"Invalid year '{row['year']}'.")
+    if row.get('exam_type'):
+        if row['exam_type'] not in EXAM_TYPES:
+            raise ManifestError(f"Unknown exam type '{row['exam_type']}'.")
+        paper.exam_type = row['exam_type']
+    if row.get('pages'):
+        # Only used when the PDF's own page count cannot be read
+        paper.pages = int(row['pages'])
+    wanted = (row.get('slug') or '').strip()
+    if wanted and wanted in slugs.taken:
+        raise ManifestError(f"Slug '{wanted}' is already taken.")
+    paper.slug = slugs.allocate(wanted or f"{class_level.name} {term.name} {subject.name} {title}")
+    if not paper.password and paper.is_paid:
+        paper.password = QuestionPaper.generate_password()
+    # bulk_create skips save(), so the denormalized path and label are filled in here
+    paper.set_denormalized_fields()
+    return paper
+
+
+# ====================================================================
+# PROGRESS (resume after interruption)
+# ====================================================================
+
+class Progress:
+    """Manifest rows already imported, keyed by their file column.
+
+    A batch's slugs are written as 'pending' before its transaction and moved
+    to 'done' after it commits. If the process dies in between, the next run
+    checks whether those slugs reached the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done, self.pending = {}, {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as fh:
+                data = json.load(fh)
+            self.done, self.pending = data.get('done', {}), data.get('pending', {})
+        if self.pending:
+            committed = set(QuestionPaper.objects.filter(slug__in=self.pending.values()).values_list('slug', flat=True))
+            self.done.update({key: slug for key, slug in self.pending.items() if slug in committed})
+            self.pending = {}
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump({'done': self.done, 'pending': self.pending}, fh)
+        os.replace(tmp, self.path)
+
+    def begin(self, entries):
+        self.pending = dict(entries)
+        self.save()
+
+    def commit(self):
+        self.done.update(self.pending)
+        self.pending = {}
+        self.save()
+
+
+# ====================================================================
+# IMPORT
+# ====================================================================
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.imported = self.skipped = self.failed = 0
+        self.bytes_uploaded = 0
+        self.upload_seconds = self.insert_seconds = 0.0
+        self.errors = []
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            f"Imported {self.imported} papers ({self.skipped} already done, {self.failed} failed) "
+            f"in {elapsed:.1f}s: {self.imported / elapsed:.1f} papers/s, "
+            f"{self.bytes_uploaded / elapsed / 1024 / 1024:.2f} MB/s uploaded "
+            f"(upload {self.upload_seconds:.1f}s, insert {self.insert_seconds:.1f}s)."
+        )
+
+
+def upload_pdf(storage, field, path):
+    """Store one PDF and return (stored_name, metadata) measured from the local copy."""
+    metadata = measure_path(path)
+    with open(path, 'rb') as fh:
+        name = storage.save(field.generate_filename(None, os.path.basename(path)), File(fh))
+    return name, metadata
+
+
+def import_papers(manifest_path, pdf_dir, batch_size=100, workers=8, progress_path=None,
+                  create_missing=False, dry_run=False, on_batch=None):
+    """Import every manifest row not already recorded in ``progress_path``. Returns ImportStats."""
+    stats = ImportStats()
+    rows = read_manifest(manifest_path)
+    progress = Progress(progress_path)
+    field = QuestionPaper._meta.get_field('pdf_file')
+    hierarchy = Hierarchy(create_missing=create_missing)
+    slugs = SlugAllocator()
+
+    todo, seen = [], set()
+    for number, row in enumerate(rows, start=1):
+        key = (row.get('file') or '').strip()
+        if not key:
+            stats.failed += 1
+            stats.errors.append((number, "Missing file."))
+        elif key in seen:
+            stats.failed += 1
+            stats.errors.append((number, f"Duplicate file '{key}'."))
+        elif key in progress.done:
+            seen.add(key)
+            stats.skipped += 1
+        else:
+            seen.add(key)
+            todo.append((number, key, row))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(todo), batch_size):
+            prepared = []
+            for number, key, row in todo[start:start + batch_size]:
+                path = os.path.join(pdf_dir, key)
+                try:
+                    if not os.path.isfile(path):
+                        raise ManifestError(f"File not found: {path}")
+                    prepared.append((number, key, path, build_paper(row, hierarchy, slugs)))
+                except (ManifestError, ValueError) as exc:
+                    stats.failed += 1
+                    stats.errors.append((number, str(exc)))
+            if dry_run or not prepared:
+                stats.imported += len(prepared) if dry_run else 0
+                continue
+
+            began = time.monotonic()
+            uploads = [pool.submit(upload_pdf, field.storage, field, path) for _, _, path, _ in prepared]
+            papers, entries = [], {}
+            for (number, key, _, paper), future in zip(prepared, uploads):
+                try:
+                    paper.pdf_file.name, metadata = future.result()
+                except Exception as exc:
+                    logger.exception("Upload of %s failed", key)
+                    stats.failed += 1
+                    stats.errors.append((number, f"Upload failed: {exc}"))
+                    continue
+                # bulk_create skips the extraction receiver, so fill the metadata from the local file
+                paper.file_size = format_file_size(metadata['size'])
+                paper.content_hash = metadata['content_hash']
+                paper.metadata_source = paper.pdf_file.name
+                if metadata['pages']:
+                    paper.pages = metadata['pages']
+                stats.bytes_uploaded += metadata['size']
+                papers.append(paper)
+                entries[key] = paper.slug
+            stats.upload_seconds += time.monotonic() - began
+            if not papers:
+                continue
+
+            began = time.monotonic()
+            progress.begin(entries)
+            try:
+                with transaction.atomic():
+                    hierarchy.save_new()
+                    created = QuestionPaper.objects.bulk_create(papers)
+                    # bulk_create skips the post_save receivers, so sync search and the catalog here
+                    ids = [paper.pk for paper in created]
+                    if None in ids:
+                        ids = list(QuestionPaper.objects.filter(slug__in=entries.values()).values_list('id', flat=True))
+                    search.index_papers(ids)
+                    schedule_catalog_bump()
+            except Exception:
+                # Nothing of this batch reached the database, so its uploads would only be orphans
+                for paper in papers:
+                    field.storage.delete(paper.pdf_file.name)
+                raise
+            progress.commit()
+            stats.insert_seconds += time.monotonic() - began
+            stats.imported += len(created)
+            if on_batch:
+                on_batch(stats)
+    return stats
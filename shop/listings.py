@@ -0,0 +1,104 @@
+# shop/listings.py
+
+import base64
+import json
+from django.db.models import Q
+
+LISTING_PAGE_SIZE = 24
+
+# Everything the listing cards show; description (unbounded text) is left out
+LISTING_FIELDS = (
+    'id', 'title', 'slug', 'year', 'exam_type', 'price', 'is_paid', 'pages', 'file_size', 'views',
+    'canonical_path', 'created_at', 'updated_at', 'content_hash', 'thumbnail_hash', 'thumbnail_names',
+    'class_level__name', 'class_level__slug', 'term__name', 'term__slug',
+    'subject__name', 'subject__slug',
+)
+LISTING_RELATIONS = ('class_level', 'term', 'subject')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """One page of a keyset listing; ``next_cursor`` is None on the last page."""
+
+    __slots__ = ('object_list', 'next_cursor', 'is_first')
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or not self.is_first
+
+
+def listing_queryset(**filters):
+    """Available papers with only the card columns and their class/term/subject joined in."""
+    from .models import QuestionPaper
+    return (QuestionPaper.objects.filter(is_available=True, **filters)
+            .select_related(*LISTING_RELATIONS)
+            .only(*LISTING_FIELDS))
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """Turn a cursor back into typed values for ``fields``; raises InvalidCursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except Exception as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def keyset_page(queryset, ordering, cursor=None, per_page=None):
+    """Return the page of ``queryset`` that follows ``cursor`` in ``ordering``.
+
+    ``ordering`` names descending columns ending in a unique one (e.g.
+    ``('created_at', 'id')``). The page is a range seek on those columns,
+    so it costs the same however deep the cursor is, as long as an index
+    covers the filter plus the ordering.
+    """
+    per_page = per_page or LISTING_PAGE_SIZE
+    model_fields = [queryset.model._meta.get_field(name) for name in ordering]
+    qs = queryset.order_by(*(f'-{name}' for name in ordering))
+    if cursor:
+        values = decode_cursor(cursor, model_fields)
+        # (a, b, c) < (va, vb, vc) spelled out, since not every backend has row comparisons
+        after = Q()
+        for i, name in enumerate(ordering):
+            ties = dict(zip(ordering[:i], values[:i]))
+            after |= Q(**ties, **{f'{name}__lt': values[i]})
+        qs = qs.filter(after)
+    rows = list(qs[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([field.value_from_object(rows[-1]) for field in model_fields])
+    return KeysetPage(rows, next_cursor, is_first=not cursor)
+
+
+def get_listing_page(request, queryset, ordering):
+    """The page named by ``?after=``; like Paginator.get_page, a bad cursor gives the first page."""
+    try:
+        return keyset_page(queryset, ordering, request.GET.get('after'))
+    except InvalidCursor:
+        return keyset_page(queryset, ordering)
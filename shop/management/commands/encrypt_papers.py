@@ -0,0 +1,102 @@
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.models import QuestionPaper
+from shop.pdf_jobs import PROTECT, SKIPPED, finish, process_pdfs, ready
+from shop.protected_pdfs import encrypt_pdf, mark_papers, pending_papers, rotate_passwords, store_artifact, stored_name
+
+
+class Command(BaseCommand):
+    help = ("Produce the password-protected copy of every paper whose file or password changed. "
+            "Copies are stored by (content hash, password), so each pair is encrypted once. "
+            "With --rotate-passwords, selected papers get new passwords first and are re-encrypted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PROTECTED_PDF_WORKERS,
+                            help="Processes encrypting PDFs in parallel.")
+        parser.add_argument('--downloads', type=int, default=4,
+                            help="PDFs read from storage in parallel.")
+        parser.add_argument('--limit', type=int, help="Stop after this many papers.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling for changed papers instead of exiting when none are pending.")
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help="Seconds to sleep between polls when nothing is pending.")
+        parser.add_argument('--rotate-passwords', action='store_true',
+                            help="Assign new passwords to the selected papers, and text them to their buyers, before encrypting.")
+        parser.add_argument('--paper', action='append', dest='papers', metavar='SLUG',
+                            help="Limit --rotate-passwords to this paper (repeatable).")
+        parser.add_argument('--subject', help="Limit --rotate-passwords to a subject slug.")
+        parser.add_argument('--class', dest='class_level', help="Limit --rotate-passwords to a class slug.")
+
+    def handle(self, *args, **options):
+        if options['rotate_passwords']:
+            papers = QuestionPaper.objects.exclude(password='')
+            if options['papers']:
+                papers = papers.filter(slug__in=options['papers'])
+            if options['subject']:
+                papers = papers.filter(subject__slug=options['subject'])
+            if options['class_level']:
+                papers = papers.filter(class_level__slug=options['class_level'])
+            self.stdout.write(f"Rotated the passwords of {rotate_passwords(papers)} papers.")
+        while True:
+            encrypted = self.encrypt(options)
+            if not options['loop']:
+                break
+            if not encrypted:
+                time.sleep(options['interval'])
+
+    def encrypt(self, options):
+        papers = list(ready(pending_papers(), PROTECT, 'pdf_file').order_by('id')
+                      .only('id', 'pdf_file', 'content_hash', 'password')[:options['limit']])
+        reused = 0
+        jobs = []
+        # Papers carry their hash, so pairs that already have a stored copy need no download at all
+        for (content_hash, password), paper in {(p.content_hash, p.password): p for p in papers}.items():
+            name = stored_name(content_hash, password)
+            if name:
+                mark_papers(content_hash, password, name)
+                reused += 1
+            else:
+                jobs.append((paper, paper.pdf_file))
+        if not jobs:
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Every protected paper has its encrypted copy ({reused} reused stored copies)."
+                ))
+            return 0
+
+        def prepare(paper, path, content_hash):
+            if content_hash != paper.content_hash:
+                # Replaced since it was measured; shop.pdf_metadata will queue it again
+                return None
+            return encrypt_pdf, path, paper.password
+
+        def store(paper, out_path):
+            try:
+                name = store_artifact(paper.content_hash, paper.password, out_path)
+                mark_papers(paper.content_hash, paper.password, name)
+            finally:
+                os.remove(out_path)
+
+        started = time.monotonic()
+        total, encrypted, failed, done = len(jobs), 0, 0, 0
+        for outcome in process_pdfs(jobs, prepare, downloads=options['downloads'], workers=options['workers']):
+            paper = outcome.job
+            done += 1
+            if outcome.status == SKIPPED:
+                continue
+            error = finish(PROTECT, paper.pdf_file.name, outcome, lambda out_path: store(paper, out_path))
+            if error is None:
+                encrypted += 1
+            else:
+                failed += 1
+                self.stderr.write(f"{paper.pdf_file.name}: {error}")
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"[{done}/{total}] {done / elapsed:.1f} PDFs/s, {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Encrypted {encrypted} PDFs ({reused} reused stored copies, {failed} failed) "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+        return encrypted
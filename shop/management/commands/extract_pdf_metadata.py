@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.catalog import bump_catalog_version
+from shop.models import QuestionPaper
+from shop.pdf_metadata import measure_stored, pending_papers, store_metadata
+
+
+class Command(BaseCommand):
+    help = "Fill file_size, pages and content_hash for papers whose PDF has not been measured yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.PDF_METADATA_WORKERS, 4),
+                            help="PDFs read from storage in parallel.")
+        parser.add_argument('--all', action='store_true',
+                            help="Re-measure every paper, not just the pending ones.")
+        parser.add_argument('--limit', type=int, help="Stop after this many papers.")
+
+    def handle(self, *args, **options):
+        papers = QuestionPaper.objects.exclude(pdf_file='') if options['all'] else pending_papers()
+        papers = list(papers.order_by('id').only('id', 'pdf_file')[:options['limit']])
+        total = len(papers)
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Every paper already has its PDF metadata."))
+            return
+
+        started = time.monotonic()
+        done = stored = failed = 0
+        read_bytes = 0
+        step = max(total // 20, 1)
+        # Storage reads run in the pool; the database is only written from this thread
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(measure_stored, paper.pdf_file): paper for paper in papers}
+            for future in as_completed(futures):
+                paper = futures[future]
+                done += 1
+                try:
+                    metadata = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"Paper {paper.pk} ({paper.pdf_file.name}): {exc}")
+                else:
+                    read_bytes += metadata['size']
+                    stored += store_metadata(paper.pk, paper.pdf_file.name, metadata)
+                if done % step == 0 or done == total:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"[{done}/{total}] {done / elapsed:.1f} papers/s, "
+                        f"{read_bytes / elapsed / 1024 / 1024:.2f} MB/s, {failed} failed"
+                    )
+        if stored:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored metadata for {stored} of {total} papers ({failed} failed) "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
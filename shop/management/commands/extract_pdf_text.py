@@ -0,0 +1,82 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.pdf_jobs import SKIPPED, TEXT, finish, process_pdfs, ready
+from shop.pdf_text import (
+    extract_page_texts, known_hashes, mark_sample, pending_papers, pending_samples, store_document,
+)
+
+
+class Command(BaseCommand):
+    help = ("Index the text of paper and free sample PDFs for content search. "
+            "Only PDFs whose content hash has no stored text are parsed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PDF_TEXT_WORKERS,
+                            help="Processes parsing PDFs in parallel.")
+        parser.add_argument('--downloads', type=int, default=4,
+                            help="PDFs read from storage in parallel.")
+        parser.add_argument('--limit', type=int, help="Stop after this many papers plus samples.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling for new PDFs instead of exiting when none are pending.")
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help="Seconds to sleep between polls when nothing is pending.")
+
+    def handle(self, *args, **options):
+        while True:
+            parsed = self.extract(options)
+            if not options['loop']:
+                break
+            if not parsed:
+                time.sleep(options['interval'])
+
+    def extract(self, options):
+        papers = list(ready(pending_papers(), TEXT, 'pdf_file').order_by('id')
+                      .only('id', 'pdf_file', 'content_hash')[:options['limit']])
+        samples = list(ready(pending_samples(), TEXT, 'sample_pdf').order_by('id')
+                       .only('id', 'sample_pdf')[:options['limit']])
+        # Papers already carry their hash: identical files are parsed once
+        by_hash = {}
+        for paper in papers:
+            by_hash.setdefault(paper.content_hash, paper)
+        jobs = [((paper.pdf_file, None), paper.pdf_file) for paper in by_hash.values()]
+        jobs += [((sample.sample_pdf, sample), sample.sample_pdf) for sample in samples]
+        if not jobs:
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS("Every PDF already has its text indexed."))
+            return 0
+
+        seen = set()
+
+        def prepare(job, path, content_hash):
+            field_file, sample = job
+            if sample is not None:
+                mark_sample(sample.pk, field_file.name, content_hash)
+            if content_hash in seen or known_hashes([content_hash]):
+                return None
+            seen.add(content_hash)
+            return extract_page_texts, path
+
+        started = time.monotonic()
+        total, parsed, skipped, failed, done = len(jobs), 0, 0, 0, 0
+        for outcome in process_pdfs(jobs, prepare, downloads=options['downloads'], workers=options['workers']):
+            field_file, _ = outcome.job
+            done += 1
+            if outcome.status == SKIPPED:
+                skipped += 1
+                continue
+            error = finish(TEXT, field_file.name, outcome,
+                           lambda page_texts: store_document(outcome.content_hash, page_texts))
+            if error is None:
+                parsed += 1
+            else:
+                failed += 1
+                self.stderr.write(f"{field_file.name}: {error}")
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"[{done}/{total}] {done / elapsed:.1f} PDFs/s, {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {parsed} new PDFs ({skipped} unchanged, {failed} failed) "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+        return parsed
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.view_counter import flush_all
+
+
+class Command(BaseCommand):
+    help = "Write pending paper view counts from the counter cache to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Papers checked per cache round trip.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep flushing instead of exiting after one pass.")
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help="Seconds to sleep between passes.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            written = flush_all(chunk_size=options['chunk_size'])
+            total += written
+            if written:
+                self.stdout.write(f"Flushed {written} views ({total} total).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"View counts flushed: {total} views written."))
@@ -0,0 +1,51 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from shop.importer import ManifestError, import_papers
+
+
+class Command(BaseCommand):
+    help = (
+        "Import question papers from a CSV/JSON manifest and a directory of PDFs. "
+        "Manifest columns: file, title, class, term, subject, price and optionally "
+        "description, year, exam_type, pages, is_paid, is_available, password, slug."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help="Path to the .csv or .json manifest.")
+        parser.add_argument('pdf_dir', help="Directory the manifest's file column is relative to.")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Papers inserted per transaction.")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Parallel storage uploads.")
+        parser.add_argument('--progress-file',
+                            help="Where finished rows are recorded for resuming (default: <manifest>.progress.json).")
+        parser.add_argument('--create-missing', action='store_true',
+                            help="Create classes, terms and subjects the manifest names but the database lacks.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate the manifest without uploading or inserting anything.")
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['manifest']):
+            raise CommandError(f"Manifest not found: {options['manifest']}")
+        if not os.path.isdir(options['pdf_dir']):
+            raise CommandError(f"PDF directory not found: {options['pdf_dir']}")
+        progress = None if options['dry_run'] else (
+            options['progress_file'] or f"{options['manifest']}.progress.json"
+        )
+
+        def report(stats):
+            self.stdout.write(f"{stats.imported} imported, {stats.failed} failed, "
+                              f"{stats.imported / max(stats.elapsed, 1e-9):.1f} papers/s")
+
+        try:
+            stats = import_papers(
+                options['manifest'], options['pdf_dir'],
+                batch_size=options['batch_size'], workers=options['workers'],
+                progress_path=progress, create_missing=options['create_missing'],
+                dry_run=options['dry_run'], on_batch=report,
+            )
+        except ManifestError as exc:
+            raise CommandError(str(exc))
+        for number, error in stats.errors:
+            self.stderr.write(f"Row {number}: {error}")
+        self.stdout.write(self.style.SUCCESS(stats.summary()))
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from shop import search
+from shop.models import QuestionPaper
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all available question papers."
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError(f"Full-text search is not supported on the '{connection.vendor}' backend.")
+        started = time.monotonic()
+        search.create_search_schema(connection)
+        search.rebuild_index()
+        indexed = QuestionPaper.objects.filter(is_available=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} papers in {time.monotonic() - started:.2f}s."
+        ))
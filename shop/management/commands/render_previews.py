@@ -0,0 +1,98 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.pdf_jobs import PREVIEWS, SKIPPED, finish, process_pdfs, ready
+from shop.previews import (
+    RENDERERS, mark_papers, mark_sample, pending_papers, pending_samples, save_images, stored_names,
+)
+
+
+class Command(BaseCommand):
+    help = ("Render first-page WebP thumbnails for papers and watermarked previews for free samples. "
+            "Images are stored by content hash, so a PDF is only rendered once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PREVIEW_WORKERS,
+                            help="Processes rendering PDFs in parallel.")
+        parser.add_argument('--downloads', type=int, default=4,
+                            help="PDFs read from storage in parallel.")
+        parser.add_argument('--limit', type=int, help="Stop after this many papers plus samples.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling for new PDFs instead of exiting when none are pending.")
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help="Seconds to sleep between polls when nothing is pending.")
+
+    def handle(self, *args, **options):
+        while True:
+            rendered = self.render(options)
+            if not options['loop']:
+                break
+            if not rendered:
+                time.sleep(options['interval'])
+
+    def render(self, options):
+        papers = list(ready(pending_papers(), PREVIEWS, 'pdf_file').order_by('id')
+                      .only('id', 'pdf_file', 'content_hash')[:options['limit']])
+        samples = list(ready(pending_samples(), PREVIEWS, 'sample_pdf').order_by('id')
+                       .only('id', 'sample_pdf')[:options['limit']])
+        reused = 0
+        jobs = []
+        # Papers carry their hash, so already rendered files need no download at all
+        for content_hash, paper in {p.content_hash: p for p in papers}.items():
+            names = stored_names('paper', content_hash)
+            if names:
+                mark_papers(content_hash, names)
+                reused += 1
+            else:
+                jobs.append((('paper', paper.pdf_file, None), paper.pdf_file))
+        jobs += [(('sample', sample.sample_pdf, sample), sample.sample_pdf) for sample in samples]
+        if not jobs:
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Every PDF already has its previews ({reused} papers reused stored thumbnails)."
+                ))
+            return 0
+
+        def prepare(job, path, content_hash):
+            kind, field_file, sample = job
+            names = stored_names(kind, content_hash)
+            if names:
+                self.mark(kind, field_file, sample, content_hash, names)
+                return None
+            return RENDERERS[kind], path
+
+        def store(job, content_hash, images):
+            kind, field_file, sample = job
+            if not images:
+                raise ValueError("no pages could be rendered")
+            self.mark(kind, field_file, sample, content_hash, save_images(kind, content_hash, images))
+
+        started = time.monotonic()
+        total, rendered, failed, done = len(jobs), 0, 0, 0
+        for outcome in process_pdfs(jobs, prepare, downloads=options['downloads'], workers=options['workers']):
+            _, field_file, _ = outcome.job
+            done += 1
+            if outcome.status == SKIPPED:
+                reused += 1
+                continue
+            error = finish(PREVIEWS, field_file.name, outcome,
+                           lambda images: store(outcome.job, outcome.content_hash, images))
+            if error is None:
+                rendered += 1
+            else:
+                failed += 1
+                self.stderr.write(f"{field_file.name}: {error}")
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"[{done}/{total}] {done / elapsed:.1f} PDFs/s, {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} PDFs ({reused} reused stored images, {failed} failed) "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+        return rendered
+
+    def mark(self, kind, field_file, sample, content_hash, names):
+        if kind == 'sample':
+            mark_sample(sample.pk, field_file.name, content_hash, names)
+        else:
+            mark_papers(content_hash, names)
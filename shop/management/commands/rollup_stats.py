@@ -0,0 +1,31 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.rollups import run_rollups
+
+
+class Command(BaseCommand):
+    help = ("Fold new download history and verified order items into the per-paper rollup tables. "
+            "Rollups are append-only: rows already counted are not revised.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Download history rows processed per transaction.")
+        parser.add_argument('--settle', type=int, default=settings.ROLLUP_SETTLE_SECONDS,
+                            help="Seconds to wait before counting a new download or newly verified order.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep rolling up instead of exiting after one pass.")
+        parser.add_argument('--interval', type=float, default=300.0,
+                            help="Seconds to sleep between passes.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            counts = run_rollups(batch_size=options['batch_size'], settle_seconds=options['settle'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Rolled up {counts['downloads']} downloads and {counts['revenue']} order items "
+                f"in {time.monotonic() - started:.2f}s."
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.fulfillment import drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued password SMS messages from the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.SMS_WORKER_CONCURRENCY,
+                            help="Number of messages sent in parallel.")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Messages claimed per batch.")
+        parser.add_argument('--max-attempts', type=int, default=settings.SMS_MAX_ATTEMPTS,
+                            help="Attempts before a message is marked as failed.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling the outbox instead of exiting when it is empty.")
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to sleep between polls when the outbox is empty.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = drain_outbox(
+                concurrency=options['concurrency'],
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+            )
+            total += processed
+            if processed:
+                self.stdout.write(f"Processed {processed} messages ({total} total).")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Outbox drained: {total} messages processed."))
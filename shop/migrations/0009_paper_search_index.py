@@ -0,0 +1,92 @@
+# Full-text search index for QuestionPaper (FTS5 on SQLite, tsvector/GIN on PostgreSQL)
+#
+# The SQL is kept here rather than imported from shop.search so later changes to
+# that module or to the model can never break a fresh `migrate`.
+
+from django.db import migrations
+
+SQLITE_TABLE = 'shop_paper_fts'
+POSTGRES_TABLE = 'shop_paper_search'
+COLUMNS = ('title', 'description', 'subject', 'class_level', 'term', 'exam_type')
+POSTGRES_WEIGHTS = {'title': 'A', 'subject': 'B', 'class_level': 'B', 'term': 'C', 'exam_type': 'C', 'description': 'D'}
+
+
+def source_sql(choices):
+    """One index document per available paper; exam types are indexed by code and label."""
+    whens = ' '.join("WHEN %s THEN %s" for _ in choices)
+    params = []
+    for code, label in choices:
+        params.extend([code, f"{code} {label}"])
+    sql = (
+        f"SELECT p.id, p.class_level_id, p.title, p.description, s.name, c.name, t.name, "
+        f"CASE p.exam_type {whens} ELSE p.exam_type END "
+        f"FROM shop_questionpaper p "
+        f"JOIN shop_subject s ON s.id = p.subject_id "
+        f"JOIN shop_classes c ON c.id = p.class_level_id "
+        f"JOIN shop_term t ON t.id = p.term_id "
+        f"WHERE p.is_available = %s"
+    )
+    return sql, params + [True]
+
+
+def create_index(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor not in ('sqlite', 'postgresql'):
+        return
+    QuestionPaper = apps.get_model('shop', 'QuestionPaper')
+    source, params = source_sql(QuestionPaper._meta.get_field('exam_type').choices)
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+                f"{', '.join(COLUMNS)}, class_level_id UNINDEXED, "
+                f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, class_level_id, title, description, subject, class_level, term, exam_type) "
+                f"{source}", params
+            )
+        else:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+                f"paper_id bigint PRIMARY KEY REFERENCES shop_questionpaper (id) ON DELETE CASCADE, "
+                f"class_level_id bigint NOT NULL, "
+                f"title text NOT NULL, description text NOT NULL, "
+                f"document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+                f"ON {POSTGRES_TABLE} USING gin (document)"
+            )
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', coalesce(src.{col}, '')), '{POSTGRES_WEIGHTS[col]}')"
+                for col in COLUMNS
+            )
+            cursor.execute(f"DELETE FROM {POSTGRES_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {POSTGRES_TABLE} (paper_id, class_level_id, title, description, document) "
+                f"SELECT src.id, src.class_level_id, src.title, src.description, {document} "
+                f"FROM ({source}) AS src (id, class_level_id, title, description, subject, class_level, term, exam_type)",
+                params,
+            )
+
+
+def drop_index(apps, schema_editor):
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_order_user_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-16 10:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_verified_at(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.filter(verified=True, verified_at__isnull=True).update(verified_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_smsmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_verified_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-16 20:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_browser_family(apps, schema_editor):
+    from shop.download_events import parse_browser_family
+    DownloadHistory = apps.get_model('shop', 'DownloadHistory')
+    batch = []
+    for row in DownloadHistory.objects.only('id', 'user_agent').iterator(chunk_size=2000):
+        row.browser_family = parse_browser_family(row.user_agent)
+        batch.append(row)
+        if len(batch) >= 2000:
+            DownloadHistory.objects.bulk_update(batch, ['browser_family'])
+            batch = []
+    if batch:
+        DownloadHistory.objects.bulk_update(batch, ['browser_family'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_order_verified_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadhistory',
+            name='browser_family',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='downloaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill_browser_family, migrations.RunPython.noop),
+    ]
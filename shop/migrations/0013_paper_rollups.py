@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-16 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_downloadhistory_browser_family'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaperStats',
+            fields=[
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='shop.questionpaper')),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('last_download_at', models.DateTimeField(blank=True, null=True)),
+                ('sales', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Paper Stats',
+                'verbose_name_plural': 'Paper Stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_time', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaperDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('last_download_at', models.DateTimeField(blank=True, null=True)),
+                ('sales', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='shop.questionpaper')),
+            ],
+            options={
+                'verbose_name': 'Daily Paper Stats',
+                'verbose_name_plural': 'Daily Paper Stats',
+                'ordering': ('-date',),
+                'indexes': [models.Index(fields=['date'], name='shop_paperd_date_b9f68b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('paper', 'date'), name='unique_paper_daily_stats')],
+            },
+        ),
+    ]
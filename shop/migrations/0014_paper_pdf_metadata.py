@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-16 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_paper_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionpaper',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='metadata_source',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+    ]
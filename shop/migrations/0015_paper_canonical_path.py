@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-16 22:40
+
+from django.db import migrations, models
+from django.urls import reverse
+
+
+def backfill_paper_paths(apps, schema_editor):
+    QuestionPaper = apps.get_model('shop', 'QuestionPaper')
+    papers = QuestionPaper.objects.select_related('class_level', 'term', 'subject')
+    batch = []
+    for paper in papers.iterator(chunk_size=500):
+        paper.canonical_path = reverse('shop:paper_detail', args=[
+            paper.class_level.slug, paper.term.slug, paper.subject.slug, paper.slug,
+        ])
+        paper.display_label = f"{paper.class_level.name} - {paper.term.name} - {paper.subject.name} ({paper.title})"
+        batch.append(paper)
+        if len(batch) >= 500:
+            QuestionPaper.objects.bulk_update(batch, ['canonical_path', 'display_label'])
+            batch = []
+    if batch:
+        QuestionPaper.objects.bulk_update(batch, ['canonical_path', 'display_label'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_paper_pdf_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionpaper',
+            name='canonical_path',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='display_label',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(backfill_paper_paths, migrations.RunPython.noop),
+    ]
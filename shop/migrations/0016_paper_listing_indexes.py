@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_paper_canonical_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='questionpaper',
+            index=models.Index(fields=['is_available', 'created_at', 'id'], name='paper_listing_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionpaper',
+            index=models.Index(fields=['is_available', 'year', 'id'], name='paper_listing_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionpaper',
+            index=models.Index(fields=['is_available', 'exam_type', 'id'], name='paper_listing_type_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-16 22:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_text_index(apps, schema_editor):
+    from shop import pdf_text
+    pdf_text.create_text_schema(schema_editor.connection)
+
+
+def drop_text_index(apps, schema_editor):
+    from shop import pdf_text
+    pdf_text.drop_text_schema(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_paper_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('pages', models.PositiveIntegerField(default=0)),
+                ('extracted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'PDF Document Text',
+                'verbose_name_plural': 'PDF Document Texts',
+            },
+        ),
+        migrations.AddField(
+            model_name='freesample',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='freesample',
+            name='text_source',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.CreateModel(
+            name='PdfPageText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='page_texts', to='shop.pdfdocument')),
+            ],
+            options={
+                'ordering': ('document', 'page_number'),
+                'constraints': [models.UniqueConstraint(fields=('document', 'page_number'), name='unique_pdf_page')],
+            },
+        ),
+        migrations.RunPython(create_text_index, drop_text_index),
+    ]
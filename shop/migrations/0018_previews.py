@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-16 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_pdf_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='freesample',
+            name='preview_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='freesample',
+            name='preview_pages',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='freesample',
+            name='preview_source',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='thumbnail_pages',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
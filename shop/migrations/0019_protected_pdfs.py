@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-16 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionpaper',
+            name='protected_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='protected_password',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-16 22:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_protected_pdfs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Entitlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identity', models.CharField(max_length=255)),
+                ('granted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entitlements', to='shop.order')),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', to='shop.questionpaper')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entitlements', to='shop.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['paper', 'identity'], name='entitlement_paper_idx')],
+                'constraints': [models.UniqueConstraint(fields=('identity', 'paper'), name='unique_entitlement')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-16 22:49
+
+import shop.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_entitlements'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='questionpaper',
+            name='year',
+            field=models.IntegerField(default=shop.models.get_current_year),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-16 22:58
+
+from django.db import migrations, models
+
+
+def queue_rerender(apps, schema_editor):
+    # Only the page counts were recorded, not the names storage chose, so render again
+    apps.get_model('shop', 'QuestionPaper').objects.exclude(thumbnail_hash='').update(thumbnail_hash='')
+    apps.get_model('shop', 'FreeSample').objects.exclude(preview_source='').update(preview_hash='', preview_source='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_questionpaper_year_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='freesample',
+            name='preview_names',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='thumbnail_names',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(queue_rerender, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='freesample',
+            name='preview_pages',
+        ),
+        migrations.RemoveField(
+            model_name='questionpaper',
+            name='thumbnail_pages',
+        ),
+    ]
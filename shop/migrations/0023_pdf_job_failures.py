@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-16 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_preview_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfJobFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=20)),
+                ('source', models.CharField(max_length=500)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error_hash', models.CharField(blank=True, max_length=64)),
+                ('last_error', models.TextField(blank=True)),
+                ('retry_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'PDF Worker Failure',
+                'verbose_name_plural': 'PDF Worker Failures',
+                'constraints': [models.UniqueConstraint(fields=('task', 'source'), name='unique_pdf_job_failure')],
+            },
+        ),
+    ]
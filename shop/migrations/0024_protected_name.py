@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-16 23:20
+
+from django.db import migrations, models
+
+
+def queue_reencrypt(apps, schema_editor):
+    # The names storage chose were never recorded, so produce the copies again
+    apps.get_model('shop', 'QuestionPaper').objects.exclude(protected_hash='').update(protected_hash='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_pdf_job_failures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionpaper',
+            name='protected_name',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(queue_reencrypt, migrations.RunPython.noop),
+    ]
@@ -81,6 +81,12 @@ class Subject(models.Model):
 
 
 # --- 5. QuestionPaper Model ---
+# Fields that feed QuestionPaper.canonical_path / display_label
+DENORMALIZED_SOURCE_FIELDS = frozenset({
+    'title', 'slug', 'class_level', 'term', 'subject', 'class_level_id', 'term_id', 'subject_id',
+})
+
+
 class QuestionPaper(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -88,7 +94,7 @@ class QuestionPaper(models.Model):
     term = models.ForeignKey(Term, related_name='papers', on_delete=models.PROTECT)
     subject = models.ForeignKey(Subject, related_name='papers', on_delete=models.PROTECT)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
-    year = models.IntegerField(default=timezone.now().year)
+    year = models.IntegerField(default=get_current_year)
     exam_type = models.CharField(
         max_length=50,
         choices=[
@@ -109,6 +115,19 @@ class QuestionPaper(models.Model):
     is_available = models.BooleanField(default=True)
     file_size = models.CharField(max_length=20, blank=True, editable=False)
     pages = models.IntegerField(default=1)
+    # Filled in the background by shop.pdf_metadata
+    content_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+    metadata_source = models.CharField(max_length=500, blank=True, editable=False)
+    # Denormalized from class_level/term/subject so URLs and labels need no joins
+    canonical_path = models.CharField(max_length=500, blank=True, editable=False)
+    display_label = models.CharField(max_length=500, blank=True, editable=False)
+    # Set by `manage.py render_previews` to the content hash its thumbnails were rendered from
+    thumbnail_hash = models.CharField(max_length=64, blank=True, editable=False)
+    thumbnail_names = models.JSONField(default=list, blank=True, editable=False)
+    # Set by `manage.py encrypt_papers` to the content hash, password and storage name of the encrypted copy
+    protected_hash = models.CharField(max_length=64, blank=True, editable=False)
+    protected_password = models.CharField(max_length=50, blank=True, editable=False)
+    protected_name = models.CharField(max_length=500, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     views = models.IntegerField(default=0)
@@ -117,10 +136,29 @@ class QuestionPaper(models.Model):
         ordering = ('class_level', 'term', 'subject', 'title')
         verbose_name = 'Question Paper'
         verbose_name_plural = 'Question Papers'
+        # Listing filters followed by their keyset ordering (see shop.listings)
+        indexes = [
+            models.Index(fields=['is_available', 'created_at', 'id'], name='paper_listing_recent_idx'),
+            models.Index(fields=['is_available', 'year', 'id'], name='paper_listing_year_idx'),
+            models.Index(fields=['is_available', 'exam_type', 'id'], name='paper_listing_type_idx'),
+        ]
 
     def __str__(self):
+        return self.display_label or self.build_display_label()
+
+    def build_canonical_path(self):
+        return reverse('shop:paper_detail', args=[self.class_level.slug, self.term.slug, self.subject.slug, self.slug])
+
+    def build_display_label(self):
         return f"{self.class_level.name} - {self.term.name} - {self.subject.name} ({self.title})"
 
+    def set_denormalized_fields(self):
+        """Recompute canonical_path and display_label; returns True if either changed."""
+        path, label = self.build_canonical_path(), self.build_display_label()
+        changed = (path, label) != (self.canonical_path, self.display_label)
+        self.canonical_path, self.display_label = path, label
+        return changed
+
     def delete(self, *args, **kwargs):
         if self.pdf_file:
             self.pdf_file.delete(save=False)
@@ -140,19 +178,51 @@ class QuestionPaper(models.Model):
             self.slug = candidate
 
         if not self.password and self.is_paid:
-            self.password = f"INSIGHT_{uuid.uuid4().hex[:8].upper()}"
+            self.password = self.generate_password()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.set_denormalized_fields()
+        elif DENORMALIZED_SOURCE_FIELDS.intersection(update_fields):
+            self.set_denormalized_fields()
+            kwargs['update_fields'] = {*update_fields, 'canonical_path', 'display_label'}
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def generate_password():
+        return f"INSIGHT_{uuid.uuid4().hex[:8].upper()}"
+
     def get_absolute_url(self):
-        return reverse('shop:paper_detail', args=[self.class_level.slug, self.term.slug, self.subject.slug, self.slug])
+        return self.canonical_path or self.build_canonical_path()
 
     def increment_views(self):
-        self.views += 1
-        self.save(update_fields=['views'])
+        """Count a view; pending views are written in batches by shop.view_counter."""
+        from .view_counter import record_view
+        record_view(self.pk)
 
     def get_pdf_url(self):
         return self.pdf_file.url if self.pdf_file else None
+
+    @property
+    def thumbnail_urls(self):
+        """Thumbnail URLs of the first pages, or [] until the current file has been rendered."""
+        if not self.thumbnail_hash or self.thumbnail_hash != self.content_hash:
+            return []
+        from .previews import preview_urls
+        return preview_urls('paper', self.thumbnail_hash, self.thumbnail_names)
+
+    @property
+    def thumbnail_url(self):
+        urls = self.thumbnail_urls
+        return urls[0] if urls else None
     
+    @property
+    def protected_pdf_name(self):
+        """Storage name of the encrypted copy of the current file and password, or None until it is ready."""
+        if not self.protected_name or (self.protected_hash, self.protected_password) != (self.content_hash, self.password):
+            return None
+        return self.protected_name
+
     def get_secure_pdf_url(self):
         return self.get_pdf_url()
     
@@ -164,6 +234,22 @@ class QuestionPaper(models.Model):
     def is_free(self):
         return self.price == 0 or not self.is_paid
 
+    @property
+    def rollup(self):
+        """This paper's PaperStats row, or None before the first rollup covers it."""
+        try:
+            return self.stats
+        except PaperStats.DoesNotExist:
+            return None
+
+    @property
+    def download_count(self):
+        return self.rollup.downloads if self.rollup else 0
+
+    @property
+    def last_download_at(self):
+        return self.rollup.last_download_at if self.rollup else None
+
 
 # --- 6. Order Model ---
 class Order(models.Model):
@@ -173,12 +259,31 @@ class Order(models.Model):
     phone_number = models.CharField(max_length=20)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     verified = models.BooleanField(default=False)
+    verified_at = models.DateTimeField(null=True, blank=True)
     transaction_id = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Order #{self.ref} - {self.email}"
 
+    def mark_as_verified(self, transaction_id=None):
+        """Flip verified False -> True with one conditional UPDATE.
+
+        Returns True only for the caller whose UPDATE won the transition, so
+        concurrent webhook/callback requests can never both fulfill an order.
+        """
+        now = timezone.now()
+        fields = {'verified': True, 'verified_at': now}
+        if transaction_id:
+            fields['transaction_id'] = str(transaction_id)
+        won = Order.objects.filter(pk=self.pk, verified=False).update(**fields) == 1
+        if won:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        else:
+            self.refresh_from_db(fields=['verified', 'verified_at', 'transaction_id'])
+        return won
+
     def save(self, *args, **kwargs):
         if not self.ref:
             self.ref = uuid.uuid4().hex[:12].upper()
@@ -237,10 +342,16 @@ class DownloadHistory(models.Model):
     user_email = models.EmailField(blank=True, null=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    downloaded_at = models.DateTimeField(auto_now_add=True)
+    browser_family = models.CharField(max_length=20, blank=True, db_index=True)
+    downloaded_at = models.DateTimeField(default=timezone.now, editable=False)
 
     @classmethod
-    def log_download(cls, paper, email=None, request=None, payment=None, order=None):
+    def log_download(cls, paper=None, email=None, request=None, payment=None, order=None, paper_id=None, order_id=None):
+        """Queue a download event; rows are written in batches by shop.download_events.
+
+        Ids may be passed instead of instances where the caller has not loaded them.
+        """
+        from .download_events import parse_browser_family, record
         ip = None
         ua = None
         if request is not None:
@@ -248,14 +359,16 @@ class DownloadHistory(models.Model):
             ip = xff.split(',')[0].strip() if xff else request.META.get('REMOTE_ADDR')
             ua = request.META.get('HTTP_USER_AGENT', '')
 
-        return cls.objects.create(
-            paper=paper,
+        return record(cls(
+            paper_id=paper.pk if paper is not None else paper_id,
             payment=payment,
-            order=order,
+            order_id=order.pk if order is not None else order_id,
             user_email=email,
             ip_address=ip,
-            user_agent=ua or ''
-        )
+            user_agent=ua or '',
+            browser_family=parse_browser_family(ua),
+            downloaded_at=timezone.now(),
+        ))
 
 
 # --- 9. FREE SAMPLE Model ---
@@ -264,12 +377,181 @@ class FreeSample(models.Model):
     description = models.TextField(blank=True)
     sample_pdf = models.FileField(upload_to='free_samples/', blank=True, null=True)
     downloads = models.IntegerField(default=0)
+    # Filled by shop.pdf_text when the sample's text is indexed
+    content_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+    text_source = models.CharField(max_length=500, blank=True, editable=False)
+    # Watermarked previews rendered by `manage.py render_previews`
+    preview_hash = models.CharField(max_length=64, blank=True, editable=False)
+    preview_source = models.CharField(max_length=500, blank=True, editable=False)
+    preview_names = models.JSONField(default=list, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def delete(self, *args, **kwargs):
         if self.sample_pdf:
             self.sample_pdf.delete(save=False)
         super().delete(*args, **kwargs)
+
+    @property
+    def preview_urls(self):
+        if not self.sample_pdf or self.preview_source != self.sample_pdf.name:
+            return []
+        from .previews import preview_urls
+        return preview_urls('sample', self.preview_hash, self.preview_names)
     
     class Meta:
         ordering = ('-created_at',)
+
+
+# --- 10. SMS Outbox ---
+class SmsMessage(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='sms_messages', on_delete=models.CASCADE)
+    phone_number = models.CharField(max_length=20)
+    content = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    provider_message_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('created_at',)
+        verbose_name = 'SMS Message'
+        verbose_name_plural = 'SMS Outbox'
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} for Order #{self.order.ref} ({self.status})"
+
+
+# --- 11. Download & Revenue Rollups (maintained by `manage.py rollup_stats`) ---
+class PaperDailyStats(models.Model):
+    paper = models.ForeignKey(QuestionPaper, related_name='daily_stats', on_delete=models.CASCADE)
+    date = models.DateField()
+    downloads = models.PositiveIntegerField(default=0)
+    last_download_at = models.DateTimeField(null=True, blank=True)
+    sales = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ('-date',)
+        verbose_name = 'Daily Paper Stats'
+        verbose_name_plural = 'Daily Paper Stats'
+        constraints = [models.UniqueConstraint(fields=['paper', 'date'], name='unique_paper_daily_stats')]
+        indexes = [models.Index(fields=['date'])]
+
+    def __str__(self):
+        return f"{self.paper.title} on {self.date}"
+
+
+class PaperStats(models.Model):
+    """Running totals per paper, so pages read one row instead of counting history."""
+    paper = models.OneToOneField(QuestionPaper, related_name='stats', on_delete=models.CASCADE, primary_key=True)
+    downloads = models.PositiveIntegerField(default=0)
+    last_download_at = models.DateTimeField(null=True, blank=True)
+    sales = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Paper Stats'
+        verbose_name_plural = 'Paper Stats'
+
+    def __str__(self):
+        return f"Stats for {self.paper.title}"
+
+
+class RollupWatermark(models.Model):
+    """How far each rollup has read its source table."""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_time = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+# --- 12. Extracted PDF Text (maintained by `manage.py extract_pdf_text`) ---
+class PdfDocument(models.Model):
+    """Text of one PDF, shared by every paper or sample whose file has this content hash."""
+    content_hash = models.CharField(max_length=64, unique=True)
+    pages = models.PositiveIntegerField(default=0)
+    extracted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'PDF Document Text'
+        verbose_name_plural = 'PDF Document Texts'
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.pages} pages)"
+
+
+class PdfPageText(models.Model):
+    document = models.ForeignKey(PdfDocument, related_name='page_texts', on_delete=models.CASCADE)
+    page_number = models.PositiveIntegerField()
+    text = models.TextField()
+
+    class Meta:
+        ordering = ('document', 'page_number')
+        constraints = [models.UniqueConstraint(fields=['document', 'page_number'], name='unique_pdf_page')]
+
+    def __str__(self):
+        return f"Page {self.page_number} of {self.document}"
+
+
+# --- 13. Entitlements (written on verification, backfilled by `manage.py backfill_entitlements`) ---
+class Entitlement(models.Model):
+    """One buyer identity owning one paper, so "has X bought this?" is a single index probe.
+
+    ``identity`` is ``user:<id>``, ``email:<address>`` or ``phone:<+233...>`` (see shop.entitlements);
+    an order grants the paper to each identity it carries.
+    """
+    identity = models.CharField(max_length=255)
+    paper = models.ForeignKey(QuestionPaper, related_name='entitlements', on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, related_name='entitlements', on_delete=models.SET_NULL, null=True, blank=True)
+    payment = models.ForeignKey(Payment, related_name='entitlements', on_delete=models.SET_NULL, null=True, blank=True)
+    granted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # (identity, paper) answers both "owns this paper?" and "which papers?" from the index alone;
+        # (paper, identity) serves per-paper lookups
+        constraints = [models.UniqueConstraint(fields=['identity', 'paper'], name='unique_entitlement')]
+        indexes = [models.Index(fields=['paper', 'identity'], name='entitlement_paper_idx')]
+
+    def __str__(self):
+        return f"{self.identity} owns {self.paper_id}"
+
+
+# --- 14. PDF Worker Failures (written by the extract_pdf_text, render_previews and encrypt_papers workers) ---
+class PdfJobFailure(models.Model):
+    """A stored file a PDF worker could not process, held back until ``retry_at`` (see shop.pdf_jobs)."""
+    task = models.CharField(max_length=20)
+    source = models.CharField(max_length=500)
+    attempts = models.PositiveIntegerField(default=0)
+    error_hash = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    retry_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'PDF Worker Failure'
+        verbose_name_plural = 'PDF Worker Failures'
+        constraints = [models.UniqueConstraint(fields=['task', 'source'], name='unique_pdf_job_failure')]
+
+    def __str__(self):
+        return f"{self.task}: {self.source} ({self.attempts} attempts)"
@@ -0,0 +1,145 @@
+# shop/page_cache.py
+
+import hashlib
+import re
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_vary_headers
+from .catalog import get_catalog_version
+
+PAGE_KEY = 'shop:page:{version}:{view}:{digest}'
+STATS_KEY = 'shop:page:stats:{view}:{event}'
+EVENTS = ('hit', 'miss', 'bypass')
+CSRF_PLACEHOLDER = '__SHOP_CSRF_TOKEN__'
+CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+# Set by the middleware after the view returns; never part of a cached page
+SKIPPED_HEADERS = {'set-cookie', 'vary'}
+
+_registered_views = set()
+
+
+# ====================================================================
+# COUNTERS
+# ====================================================================
+
+def _count(view, event):
+    counters = caches[getattr(settings, 'VIEW_COUNTER_CACHE', 'default')]
+    key = STATS_KEY.format(view=view, event=event)
+    counters.add(key, 0, timeout=None)
+    try:
+        counters.incr(key)
+    except ValueError:
+        pass
+
+
+def stats():
+    """{view: {'hit': n, 'miss': n, 'bypass': n, 'hit_rate': float}} for this cache."""
+    counters = caches[getattr(settings, 'VIEW_COUNTER_CACHE', 'default')]
+    keys = {STATS_KEY.format(view=view, event=event): (view, event)
+            for view in _registered_views for event in EVENTS}
+    values = counters.get_many(list(keys))
+    result = {view: dict.fromkeys(EVENTS, 0) for view in sorted(_registered_views)}
+    for key, (view, event) in keys.items():
+        result[view][event] = values.get(key, 0)
+    for entry in result.values():
+        served = entry['hit'] + entry['miss']
+        entry['hit_rate'] = round(entry['hit'] / served, 3) if served else 0.0
+    return result
+
+
+# ====================================================================
+# CACHE
+# ====================================================================
+
+def is_cacheable_request(request):
+    """Anonymous GET/HEAD with nothing personal to show: no login, no cart items, no purchases, no flash messages."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if 'messages' in request.COOKIES:
+        return False
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        # No session: nothing below can be personal (and nothing needs loading)
+        return True
+    if request.user.is_authenticated:
+        return False
+    from .cart import get_cart
+    from .entitlements import BUYER_SESSION_KEY
+    if len(get_cart(request)) or BUYER_SESSION_KEY in request.session:
+        return False
+    return '_messages' not in request.session
+
+
+def page_key(request, view_name):
+    digest = hashlib.md5(request.build_absolute_uri().encode(), usedforsecurity=False).hexdigest()
+    return PAGE_KEY.format(version=get_catalog_version(), view=view_name, digest=digest)
+
+
+def _freeze(request, response):
+    """Return the cache entry for ``response``, or None if it must not be shared."""
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return None
+    if response.has_header('Cache-Control') and 'private' in response['Cache-Control']:
+        return None
+    content = response.content.decode(response.charset)
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        # The page embeds this visitor's CSRF token; store a placeholder instead
+        match = CSRF_INPUT_RE.search(content)
+        if match is None:
+            return None
+        content = content.replace(match.group(1), CSRF_PLACEHOLDER)
+    headers = [(name, value) for name, value in response.items() if name.lower() not in SKIPPED_HEADERS]
+    return {'content': content, 'headers': headers, 'meta': getattr(response, 'page_cache_meta', None)}
+
+
+def _thaw(request, entry):
+    content = entry['content']
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content)
+    for name, value in entry['headers']:
+        response[name] = value
+    return response
+
+
+def cache_anonymous_page(view_name, timeout=None, on_hit=None):
+    """Serve the view from cache for anonymous, empty-cart visitors.
+
+    Keys embed the catalog version, so catalog saves (see shop.signals) retire
+    every cached page at once. ``on_hit(request, meta)`` runs on cache hits
+    with whatever the view left in ``response.page_cache_meta``, for side
+    effects such as view counting that must not be skipped.
+    """
+    _registered_views.add(view_name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_ENABLED or not is_cacheable_request(request):
+                _count(view_name, 'bypass')
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, ('Cookie',))
+                return response
+
+            key = page_key(request, view_name)
+            entry = cache.get(key)
+            if entry is not None:
+                _count(view_name, 'hit')
+                if on_hit is not None:
+                    on_hit(request, entry['meta'])
+                response = _thaw(request, entry)
+                response['X-Page-Cache'] = 'hit'
+            else:
+                _count(view_name, 'miss')
+                response = view(request, *args, **kwargs)
+                entry = _freeze(request, response)
+                if entry is not None:
+                    cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout)
+                response['X-Page-Cache'] = 'miss'
+            # Logging in or filling the cart changes the Cookie header and bypasses the cache
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
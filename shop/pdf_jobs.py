@@ -0,0 +1,120 @@
+# shop/pdf_jobs.py
+
+import datetime
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .pdf_text import download
+
+# Worker tasks, as recorded on PdfJobFailure
+TEXT = 'text'
+PREVIEWS = 'previews'
+PROTECT = 'protect'
+
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+# ``value`` is the worker's result when DONE and the exception when FAILED
+Outcome = namedtuple('Outcome', 'job status content_hash value')
+
+
+# ====================================================================
+# PIPELINE
+# ====================================================================
+
+def process_pdfs(jobs, prepare, downloads=4, workers=2):
+    """Download stored PDFs in threads and process them in worker processes; yields an Outcome per job.
+
+    ``jobs`` is a list of (job, field_file). Once a file is copied to a temp
+    path, ``prepare(job, path, content_hash)`` returns ``(function, *args)`` to
+    run in a worker process, or None to skip the file. ``prepare`` and the
+    caller's loop run in this thread, so they are the only database users.
+    Temp copies are removed as soon as their worker is done with them.
+    """
+    with ThreadPoolExecutor(max_workers=downloads) as download_pool, \
+            ProcessPoolExecutor(max_workers=workers) as process_pool:
+        pending = {download_pool.submit(download, field_file): (job, None, None) for job, field_file in jobs}
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, path, content_hash = pending.pop(future)
+                if path is None:
+                    try:
+                        path, content_hash = future.result()
+                        task = prepare(job, path, content_hash)
+                    except Exception as exc:
+                        if path is not None:
+                            os.remove(path)
+                        yield Outcome(job, FAILED, content_hash, exc)
+                        continue
+                    if task is None:
+                        os.remove(path)
+                        yield Outcome(job, SKIPPED, content_hash, None)
+                        continue
+                    function, *args = task
+                    pending[process_pool.submit(function, *args)] = (job, path, content_hash)
+                    continue
+
+                try:
+                    outcome = Outcome(job, DONE, content_hash, future.result())
+                except Exception as exc:
+                    outcome = Outcome(job, FAILED, content_hash, exc)
+                finally:
+                    os.remove(path)
+                yield outcome
+
+
+# ====================================================================
+# FAILURES
+# ====================================================================
+
+def ready(queryset, task, field):
+    """``queryset`` without rows whose ``field`` file is backing off after failing ``task``."""
+    from .models import PdfJobFailure
+    backing_off = PdfJobFailure.objects.filter(task=task, source=OuterRef(field), retry_at__gt=timezone.now())
+    return queryset.filter(~Exists(backing_off))
+
+
+def record_failure(task, source, error):
+    """Hold ``source`` back from ``task``; each further failure doubles the wait, up to a cap.
+
+    ``error_hash`` tells a file that keeps failing the same way from one hitting different errors.
+    """
+    from .models import PdfJobFailure
+    message = f"{type(error).__name__}: {error}"
+    failure, _ = PdfJobFailure.objects.get_or_create(task=task, source=source, defaults={'retry_at': timezone.now()})
+    failure.attempts += 1
+    failure.error_hash = hashlib.sha256(message.encode()).hexdigest()
+    failure.last_error = message
+    delay = min(settings.PDF_JOB_RETRY_DELAY * 2 ** (failure.attempts - 1), settings.PDF_JOB_MAX_RETRY_DELAY)
+    failure.retry_at = timezone.now() + datetime.timedelta(seconds=delay)
+    failure.save()
+    return failure
+
+
+def clear_failure(task, source):
+    from .models import PdfJobFailure
+    PdfJobFailure.objects.filter(task=task, source=source).delete()
+
+
+def finish(task, source, outcome, store):
+    """Pass a DONE outcome's result to ``store`` and keep the failure record current.
+
+    Returns the exception from the download, the worker or ``store``, or None.
+    """
+    error = outcome.value if outcome.status == FAILED else None
+    if error is None:
+        try:
+            store(outcome.value)
+        except Exception as exc:
+            error = exc
+    if error is None:
+        clear_failure(task, source)
+    else:
+        record_failure(task, source, error)
+    return error
@@ -0,0 +1,166 @@
+# shop/pdf_metadata.py
+
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+from . import gateways
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # larger PDFs spill to a temp file instead of staying in memory
+
+
+def format_file_size(size):
+    """1536 -> '1.5 KB'; fits QuestionPaper.file_size."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+# ====================================================================
+# EXTRACTION
+# ====================================================================
+
+def count_pages(fileobj):
+    """Page count, or None if the PDF cannot be parsed."""
+    try:
+        reader = PdfReader(fileobj)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        return len(reader.pages)
+    except (PdfReadError, ValueError, KeyError, TypeError) as exc:
+        logger.warning("Could not count PDF pages: %s", exc)
+        return None
+
+
+def measure(chunks):
+    """Spool ``chunks`` to a temp file while hashing. Returns a dict of size, hash and pages."""
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+        pages = count_pages(spool)
+    return {'size': size, 'content_hash': digest.hexdigest(), 'pages': pages}
+
+
+def measure_path(path):
+    with open(path, 'rb') as fh:
+        return measure(iter(lambda: fh.read(CHUNK_SIZE), b''))
+
+
+def stored_chunks(storage, name):
+    """Yield the stored file in chunks without holding it all in memory."""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path:
+        with open(path, 'rb') as fh:
+            yield from iter(lambda: fh.read(CHUNK_SIZE), b'')
+        return
+    try:
+        url = storage.url(name)
+    except NotImplementedError:
+        url = None
+    if url and url.startswith(('http://', 'https://')):
+        # Remote storages (Cloudinary) buffer the whole file in open(); stream the URL instead
+        response = gateways.call('storage.fetch', 'GET', url, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise gateways.GatewayError(f"storage.fetch returned HTTP {response.status_code}")
+            yield from response.iter_content(CHUNK_SIZE)
+        return
+    with storage.open(name, 'rb') as fh:
+        yield from fh.chunks(CHUNK_SIZE)
+
+
+def measure_stored(field_file):
+    return measure(stored_chunks(field_file.storage, field_file.name))
+
+
+def store_metadata(paper_id, source_name, metadata):
+    """Save extracted metadata with a conditional UPDATE (no post_save, no save() loop).
+
+    Skipped if the paper's file was replaced while we were reading the old one.
+    """
+    from .models import QuestionPaper
+    fields = {
+        'file_size': format_file_size(metadata['size']),
+        'content_hash': metadata['content_hash'],
+        'metadata_source': source_name,
+        'updated_at': timezone.now(),
+    }
+    if metadata['pages']:
+        fields['pages'] = metadata['pages']
+    return QuestionPaper.objects.filter(pk=paper_id, pdf_file=source_name).update(**fields) == 1
+
+
+def extract_paper(paper_id):
+    """Read one paper's PDF from storage and store its size, page count and hash."""
+    from .models import QuestionPaper
+    paper = QuestionPaper.objects.filter(pk=paper_id).only('id', 'pdf_file').first()
+    if paper is None or not paper.pdf_file:
+        return False
+    return store_metadata(paper.pk, paper.pdf_file.name, measure_stored(paper.pdf_file))
+
+
+def pending_papers():
+    """Papers whose metadata was never extracted or belongs to a previous file."""
+    from .models import QuestionPaper
+    return QuestionPaper.objects.exclude(pdf_file='').exclude(metadata_source=F('pdf_file'))
+
+
+# ====================================================================
+# BACKGROUND POOL
+# ====================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PDF_METADATA_WORKERS, thread_name_prefix='pdf-metadata'
+                )
+    return _executor
+
+
+def _run(paper_id):
+    try:
+        extract_paper(paper_id)
+    except Exception:
+        logger.exception("PDF metadata extraction failed for paper %s", paper_id)
+    finally:
+        connection.close()
+
+
+def schedule_extraction(paper_id):
+    """Extract metadata in the background pool; the caller's request does not wait for it."""
+    return _get_executor().submit(_run, paper_id)
+
+
+def shutdown(wait=True):
+    """Stop the background pool, by default after the extractions already scheduled; the next schedule starts another."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
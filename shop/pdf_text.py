@@ -0,0 +1,257 @@
+# shop/pdf_text.py
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+from .pdf_metadata import stored_chunks
+from .search import MARK_END, MARK_START, highlight, query_tokens
+
+logger = logging.getLogger(__name__)
+
+# SQLite: FTS5 table whose rowid is the PdfPageText id.
+SQLITE_TABLE = 'shop_pdf_text_fts'
+# PostgreSQL: GIN expression index over the page text itself.
+POSTGRES_INDEX = 'shop_pdfpagetext_text_gin'
+
+MAX_PAGE_CHARS = 20000
+SNIPPET_WORDS = 16
+# Page hits read per query before they are grouped into papers
+MAX_PAGE_HITS = 200
+_SPACE_RE = re.compile(r'\s+')
+
+
+def is_supported(conn=None):
+    return (conn or connection).vendor in ('sqlite', 'postgresql')
+
+
+# ====================================================================
+# SCHEMA
+# ====================================================================
+
+def create_text_schema(conn):
+    """Create the vendor-specific index structures (used by the migration)."""
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+                f"text, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_INDEX} "
+                f"ON shop_pdfpagetext USING gin (to_tsvector('simple', text))"
+            )
+
+
+def drop_text_schema(conn):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(f"DROP INDEX IF EXISTS {POSTGRES_INDEX}")
+
+
+# ====================================================================
+# EXTRACTION (runs in worker processes; no database access)
+# ====================================================================
+
+def extract_page_texts(path):
+    """Text of every page of the PDF at ``path``, whitespace-collapsed and capped per page."""
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        texts = []
+        for page in reader.pages:
+            try:
+                text = page.extract_text() or ''
+            except Exception as exc:  # one malformed page should not lose the rest
+                logger.warning("Could not extract text from a page of %s: %s", path, exc)
+                text = ''
+            texts.append(_SPACE_RE.sub(' ', text).strip()[:MAX_PAGE_CHARS])
+        return texts
+    except (PdfReadError, ValueError, KeyError, TypeError) as exc:
+        logger.warning("Could not read PDF text from %s: %s", path, exc)
+        return []
+
+
+def download(field_file):
+    """Copy a stored file to a local temp file while hashing it. Returns (path, content_hash).
+
+    The caller removes the file once the worker process has read it.
+    """
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix='.pdf', prefix='pdf-text-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in stored_chunks(field_file.storage, field_file.name):
+                digest.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+# ====================================================================
+# STORAGE
+# ====================================================================
+
+def known_hashes(hashes):
+    from .models import PdfDocument
+    return set(PdfDocument.objects.filter(content_hash__in=set(hashes)).values_list('content_hash', flat=True))
+
+
+def store_document(content_hash, page_texts):
+    """Save one PDF's pages and index them. A hash that is already stored is left alone."""
+    from .models import PdfDocument, PdfPageText
+    with transaction.atomic():
+        document, created = PdfDocument.objects.get_or_create(
+            content_hash=content_hash, defaults={'pages': len(page_texts)},
+        )
+        if not created:
+            return False
+        PdfPageText.objects.bulk_create([
+            PdfPageText(document=document, page_number=number, text=text)
+            for number, text in enumerate(page_texts, start=1) if text
+        ])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {SQLITE_TABLE} (rowid, text) "
+                    f"SELECT id, text FROM shop_pdfpagetext WHERE document_id = %s",
+                    [document.pk],
+                )
+    return True
+
+
+def mark_sample(sample_id, source_name, content_hash):
+    """Point a sample at its text; skipped if the file was replaced meanwhile."""
+    from .models import FreeSample
+    return FreeSample.objects.filter(pk=sample_id, sample_pdf=source_name).update(
+        content_hash=content_hash, text_source=source_name,
+    ) == 1
+
+
+def pending_papers():
+    """Papers whose current file is measured (see shop.pdf_metadata) but has no text yet."""
+    from django.db.models import F
+    from .models import PdfDocument, QuestionPaper
+    return (QuestionPaper.objects.exclude(pdf_file='').exclude(content_hash='')
+            .filter(metadata_source=F('pdf_file'))
+            .filter(~Exists(PdfDocument.objects.filter(content_hash=OuterRef('content_hash')))))
+
+
+def pending_samples():
+    """Samples whose file changed since it was indexed, or whose text is missing."""
+    from django.db.models import F
+    from .models import FreeSample, PdfDocument
+    return (FreeSample.objects.exclude(sample_pdf='').exclude(sample_pdf__isnull=True)
+            .filter(~Q(text_source=F('sample_pdf'))
+                    | ~Exists(PdfDocument.objects.filter(content_hash=OuterRef('content_hash')))))
+
+
+# ====================================================================
+# QUERYING
+# ====================================================================
+
+class ContentHit:
+    """A paper whose PDF (or free sample) mentions the query, with its best page.
+
+    ``snippet`` is empty for hits in a paid paper's own PDF: its text is what
+    the buyer pays for, so only the page number is shown.
+    """
+
+    __slots__ = ('paper', 'page_number', 'snippet', 'in_sample')
+
+    def __init__(self, paper, page_number, snippet, in_sample):
+        self.paper = paper
+        self.page_number = page_number
+        self.snippet = snippet
+        self.in_sample = in_sample
+
+
+def _page_hits(tokens, limit):
+    """[(page id, snippet with markers)] best first."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"SELECT rowid, snippet({SQLITE_TABLE}, 0, %s, %s, '…', {SNIPPET_WORDS}) "
+                f"FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s "
+                f"ORDER BY bm25({SQLITE_TABLE}), rowid LIMIT %s",
+                [MARK_START, MARK_END, ' '.join(f'"{t}"*' for t in tokens), limit],
+            )
+        else:
+            tsquery = ' & '.join(f"{t}:*" for t in tokens)
+            options = f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=6"
+            cursor.execute(
+                "SELECT t.id, ts_headline('simple', t.text, q, %s) "
+                "FROM shop_pdfpagetext t, to_tsquery('simple', %s) q "
+                "WHERE to_tsvector('simple', t.text) @@ q "
+                "ORDER BY ts_rank_cd(to_tsvector('simple', t.text), q) DESC, t.id LIMIT %s",
+                [options, tsquery, limit],
+            )
+        return cursor.fetchall()
+
+
+def _fallback_page_hits(tokens, limit):
+    from .models import PdfPageText
+    condition = Q()
+    for token in tokens:
+        condition &= Q(text__icontains=token)
+    hits = []
+    for page_id, text in PdfPageText.objects.filter(condition).order_by('id').values_list('id', 'text')[:limit]:
+        at = text.lower().find(tokens[0])
+        if at < 0:
+            hits.append((page_id, text[:120] + '…'))
+            continue
+        start, end = max(at - 60, 0), at + len(tokens[0])
+        excerpt = text[start:at] + MARK_START + text[at:end] + MARK_END + text[end:end + 60]
+        hits.append((page_id, ('…' if start else '') + excerpt + '…'))
+    return hits
+
+
+def search_content(query, limit=10):
+    """Available papers whose PDF or free sample contains every query word, best page first."""
+    from .models import FreeSample, PdfPageText, QuestionPaper
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    hits = _page_hits(tokens, MAX_PAGE_HITS) if is_supported() else _fallback_page_hits(tokens, MAX_PAGE_HITS)
+    if not hits:
+        return []
+    pages = {
+        page['id']: page for page in PdfPageText.objects.filter(pk__in=[h[0] for h in hits])
+        .values('id', 'page_number', 'document__content_hash')
+    }
+    hashes = {page['document__content_hash'] for page in pages.values()}
+    papers_by_hash, samples_by_hash = {}, {}
+    for paper in (QuestionPaper.objects.filter(content_hash__in=hashes, is_available=True)
+                  .select_related('class_level', 'term', 'subject').order_by('id')):
+        papers_by_hash.setdefault(paper.content_hash, []).append(paper)
+    for sample in (FreeSample.objects.filter(content_hash__in=hashes, question_paper__is_available=True)
+                   .select_related('question_paper__class_level', 'question_paper__term', 'question_paper__subject')):
+        samples_by_hash.setdefault(sample.content_hash, []).append(sample.question_paper)
+
+    results, seen = [], set()
+    for page_id, snippet in hits:
+        page = pages.get(page_id)
+        if page is None:
+            continue
+        content_hash = page['document__content_hash']
+        for paper, in_sample in ([(p, False) for p in papers_by_hash.get(content_hash, [])]
+                                 + [(p, True) for p in samples_by_hash.get(content_hash, [])]):
+            if paper.pk in seen:
+                continue
+            seen.add(paper.pk)
+            shown = highlight(snippet) if in_sample or not paper.is_paid else ''
+            results.append(ContentHit(paper, page['page_number'], shown, in_sample))
+            if len(results) == limit:
+                return results
+    return results
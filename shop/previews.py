@@ -0,0 +1,161 @@
+# shop/previews.py
+
+import io
+import logging
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Rendered images are named after the PDF bytes. Storages may still pick another name
+# (Cloudinary adds a suffix), so the names save() returns are what gets recorded.
+PAPER_THUMBNAIL_NAME = 'question_papers/thumbnails/{content_hash}-{page}.webp'
+SAMPLE_PREVIEW_NAME = 'free_samples/previews/{content_hash}-{page}.webp'
+KINDS = {'paper': PAPER_THUMBNAIL_NAME, 'sample': SAMPLE_PREVIEW_NAME}
+
+PREVIEW_PAGES = 2
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_QUALITY = 70
+SAMPLE_PREVIEW_WIDTH = 480
+SAMPLE_PREVIEW_QUALITY = 45
+WATERMARK_TEXT = 'InsiightPrep SAMPLE'
+# Every name is tied to one content hash, so an image never changes once stored
+PREVIEW_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def preview_name(kind, content_hash, page):
+    return KINDS[kind].format(content_hash=content_hash, page=page)
+
+
+def local_path(name):
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def preview_urls(kind, content_hash, names):
+    """URLs of recorded images.
+
+    Remote storage (CDN) URLs are fetched without going through Django, with
+    whatever caching headers the storage sends. Images on local disk go through
+    shop.views.preview_image, which marks them immutable.
+    """
+    if names and local_path(names[0]):
+        return [reverse('shop:preview_image', args=[kind, content_hash, page])
+                for page in range(1, len(names) + 1)]
+    return [default_storage.url(name) for name in names]
+
+
+# ====================================================================
+# RENDERING (runs in worker processes; no database access)
+# ====================================================================
+
+def _render(path, width, pages=PREVIEW_PAGES):
+    """Yield the first ``pages`` pages of the PDF at ``path`` as RGB PIL images ``width`` pixels wide."""
+    import pypdfium2 as pdfium
+    document = pdfium.PdfDocument(path)
+    try:
+        for index in range(min(pages, len(document))):
+            page = document[index]
+            try:
+                scale = width / page.get_width()
+                image = page.render(scale=scale).to_pil().convert('RGB')
+            finally:
+                page.close()
+            yield image
+    finally:
+        document.close()
+
+
+def _webp(image, quality):
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=quality, method=6)
+    return out.getvalue()
+
+
+def _watermark(image):
+    """Tile a faint diagonal label over ``image``."""
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.load_default(size=max(image.width // 14, 10))
+    left, top, right, bottom = font.getbbox(WATERMARK_TEXT)
+    label = Image.new('L', (right - left + 20, bottom - top + 10), 0)
+    ImageDraw.Draw(label).text((10 - left, 5 - top), WATERMARK_TEXT, fill=90, font=font)
+    label = label.rotate(30, expand=True)
+    overlay = Image.new('L', image.size, 0)
+    for row, y in enumerate(range(0, image.height, label.height + 20)):
+        # Alternate rows start half a label in, so the pattern has no clean column to crop along
+        for x in range(-(row % 2) * label.width // 2, image.width, label.width + 20):
+            overlay.paste(label, (x, y), label)
+    grey = Image.new('RGB', image.size, (120, 120, 120))
+    return Image.composite(grey, image, overlay)
+
+
+def render_thumbnails(path):
+    """WebP thumbnails of a paper's first pages."""
+    return [_webp(image, THUMBNAIL_QUALITY) for image in _render(path, THUMBNAIL_WIDTH)]
+
+
+def render_sample_previews(path):
+    """Low-resolution, watermarked WebP previews of a free sample's first pages."""
+    return [_webp(_watermark(image), SAMPLE_PREVIEW_QUALITY) for image in _render(path, SAMPLE_PREVIEW_WIDTH)]
+
+
+RENDERERS = {'paper': render_thumbnails, 'sample': render_sample_previews}
+
+
+# ====================================================================
+# STORAGE
+# ====================================================================
+
+def stored_names(kind, content_hash):
+    """Names of the images already recorded for ``content_hash`` by any paper or sample, or []."""
+    from .models import FreeSample, QuestionPaper
+    if kind == 'paper':
+        rows = QuestionPaper.objects.filter(thumbnail_hash=content_hash).values_list('thumbnail_names', flat=True)
+    else:
+        rows = FreeSample.objects.filter(preview_hash=content_hash).values_list('preview_names', flat=True)
+    return rows.first() or []
+
+
+def save_images(kind, content_hash, images):
+    """Store rendered pages; returns the names the storage saved them under."""
+    return [
+        default_storage.save(preview_name(kind, content_hash, page), ContentFile(data))
+        for page, data in enumerate(images, start=1)
+    ]
+
+
+def mark_papers(content_hash, names):
+    """Record rendered thumbnails on every paper whose current file has ``content_hash``.
+
+    updated_at moves so cached cards pick up the image.
+    """
+    from .models import QuestionPaper
+    return (QuestionPaper.objects.filter(content_hash=content_hash).exclude(thumbnail_hash=content_hash)
+            .update(thumbnail_hash=content_hash, thumbnail_names=names, updated_at=timezone.now()))
+
+
+def mark_sample(sample_id, source_name, content_hash, names):
+    from .models import FreeSample
+    return FreeSample.objects.filter(pk=sample_id, sample_pdf=source_name).update(
+        preview_hash=content_hash, preview_source=source_name, preview_names=names,
+    ) == 1
+
+
+def pending_papers():
+    """Papers whose measured file (see shop.pdf_metadata) has no thumbnails recorded."""
+    from django.db.models import F
+    from .models import QuestionPaper
+    return (QuestionPaper.objects.exclude(pdf_file='').exclude(content_hash='')
+            .filter(metadata_source=F('pdf_file')).exclude(thumbnail_hash=F('content_hash')))
+
+
+def pending_samples():
+    """Samples whose current file has no preview recorded."""
+    from django.db.models import F
+    from .models import FreeSample
+    return (FreeSample.objects.exclude(sample_pdf='').exclude(sample_pdf__isnull=True)
+            .exclude(preview_source=F('sample_pdf')))
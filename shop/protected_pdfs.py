@@ -0,0 +1,111 @@
+# shop/protected_pdfs.py
+
+import hashlib
+import logging
+import os
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from pypdf import PdfReader, PdfWriter
+from .download_links import forget_storage_urls
+
+logger = logging.getLogger(__name__)
+
+# Encrypted copies are keyed by (content hash, password); the password itself never appears in the name.
+# Storages may still pick another name (Cloudinary adds a suffix), so save()'s result is what gets recorded.
+PROTECTED_PDF_NAME = 'question_papers/protected/{key}.pdf'
+
+
+def artifact_key(content_hash, password):
+    return hashlib.sha256(f'{content_hash}:{password}'.encode()).hexdigest()
+
+
+def artifact_name(content_hash, password):
+    return PROTECTED_PDF_NAME.format(key=artifact_key(content_hash, password))
+
+
+# ====================================================================
+# ENCRYPTION (runs in worker processes; no database access)
+# ====================================================================
+
+def encrypt_pdf(path, password):
+    """Write a copy of the PDF at ``path`` that opens only with ``password``; returns its path.
+
+    The caller removes both files once the copy is stored.
+    """
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt('')
+    writer = PdfWriter(clone_from=reader)
+    # No owner password: pypdf derives a random one, so the restrictions cannot be lifted either
+    writer.encrypt(user_password=password, algorithm=settings.PROTECTED_PDF_ALGORITHM)
+    fd, out_path = tempfile.mkstemp(suffix='.pdf', prefix='pdf-protected-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            writer.write(fh)
+    except BaseException:
+        os.remove(out_path)
+        raise
+    return out_path
+
+
+# ====================================================================
+# STORAGE
+# ====================================================================
+
+def stored_name(content_hash, password):
+    """Storage name of an encrypted copy another paper already recorded for this pair, or None."""
+    from .models import QuestionPaper
+    return (QuestionPaper.objects.filter(protected_hash=content_hash, protected_password=password)
+            .exclude(protected_name='').values_list('protected_name', flat=True).first())
+
+
+def store_artifact(content_hash, password, path):
+    """Save an encrypted copy; returns the name the storage saved it under."""
+    with open(path, 'rb') as fh:
+        return default_storage.save(artifact_name(content_hash, password), File(fh))
+
+
+def mark_papers(content_hash, password, name):
+    """Point every paper with this file and password at the stored copy ``name``.
+
+    The filter is the whole check: a paper whose file or password changed
+    meanwhile no longer matches and stays pending.
+    """
+    from .models import QuestionPaper
+    papers = QuestionPaper.objects.filter(content_hash=content_hash, password=password)
+    updated = (papers.exclude(protected_hash=content_hash, protected_password=password)
+               .update(protected_hash=content_hash, protected_password=password, protected_name=name))
+    if updated:
+        # Signed URLs cached while the uploaded file was being sent must not outlive it
+        forget_storage_urls(papers.values_list('id', flat=True))
+    return updated
+
+
+def pending_papers():
+    """Password-protected papers whose measured file (see shop.pdf_metadata) or password has no encrypted copy."""
+    from django.db.models import F, Q
+    from .models import QuestionPaper
+    return (QuestionPaper.objects.exclude(pdf_file='').exclude(content_hash='').exclude(password='')
+            .filter(metadata_source=F('pdf_file'))
+            .filter(~Q(protected_hash=F('content_hash')) | ~Q(protected_password=F('password'))))
+
+
+def rotate_passwords(queryset):
+    """Give every paper in ``queryset`` a fresh password; their encrypted copies become pending.
+
+    Buyers are sent the new passwords through the SMS outbox, since their
+    downloads switch to copies that the old ones no longer open.
+    """
+    from .fulfillment import enqueue_password_updates
+    from .models import QuestionPaper
+    papers = list(queryset.only('id', 'password'))
+    for paper in papers:
+        paper.password = QuestionPaper.generate_password()
+    with transaction.atomic():
+        QuestionPaper.objects.bulk_update(papers, ['password'], batch_size=500)
+        enqueue_password_updates([paper.pk for paper in papers])
+    forget_storage_urls([paper.pk for paper in papers])
+    return len(papers)
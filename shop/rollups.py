@@ -0,0 +1,153 @@
+# shop/rollups.py
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import DownloadHistory, OrderItem, PaperDailyStats, PaperStats, RollupWatermark
+
+# Rollups are append-only: each source row is counted once, when the watermark passes it,
+# and later changes to it (an order or payment no longer verified, a deleted download) are
+# not taken back out. History tables stay the record to audit against.
+DOWNLOADS = 'downloads'
+REVENUE = 'revenue'
+STAT_FIELDS = ('downloads', 'last_download_at', 'sales', 'revenue')
+
+
+def _watermark(name):
+    RollupWatermark.objects.get_or_create(name=name)
+    # Row lock: two rollup runs never read the same source rows
+    return RollupWatermark.objects.select_for_update().get(name=name)
+
+
+def _add(target, delta):
+    target.downloads += delta.get('downloads', 0)
+    target.sales += delta.get('sales', 0)
+    target.revenue += delta.get('revenue', Decimal('0'))
+    last = delta.get('last_download_at')
+    if last and (target.last_download_at is None or last > target.last_download_at):
+        target.last_download_at = last
+
+
+def _merge(model, deltas, key_fields):
+    """Add ``deltas`` ({key: {field: value}}) onto rows of ``model``, creating missing ones."""
+    filters = {'paper_id__in': {key[0] for key in deltas}}
+    if 'date' in key_fields:
+        filters['date__in'] = {key[1] for key in deltas}
+    existing = {
+        tuple(getattr(obj, f) for f in key_fields): obj
+        for obj in model.objects.filter(**filters)
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    for key, delta in deltas.items():
+        obj = existing.get(key)
+        if obj is None:
+            obj = model(**dict(zip(key_fields, key)))
+            to_create.append(obj)
+        else:
+            to_update.append(obj)
+        _add(obj, delta)
+        # bulk_update() skips auto_now
+        if hasattr(obj, 'updated_at'):
+            obj.updated_at = now
+    model.objects.bulk_create(to_create, batch_size=500)
+    fields = list(STAT_FIELDS) + (['updated_at'] if hasattr(model, 'updated_at') else [])
+    model.objects.bulk_update(to_update, fields, batch_size=500)
+
+
+def apply_deltas(daily):
+    """Fold per-(paper_id, date) deltas into the daily and total rollup tables."""
+    if not daily:
+        return
+    totals = defaultdict(lambda: defaultdict(int))
+    for (paper_id, _), delta in daily.items():
+        total = totals[(paper_id,)]
+        for field, value in delta.items():
+            if field == 'last_download_at':
+                total[field] = max(total.get(field) or value, value)
+            else:
+                total[field] += value
+    _merge(PaperDailyStats, daily, ('paper_id', 'date'))
+    _merge(PaperStats, totals, ('paper_id',))
+
+
+def rollup_downloads(batch_size=5000, settle_seconds=None):
+    """Roll up DownloadHistory rows added since the last run. Returns rows processed.
+
+    The id watermark only moves past rows older than ``settle_seconds``: a
+    buffered insert still committing may hold a lower id than rows already
+    visible, and must not be skipped.
+    """
+    settle = settings.ROLLUP_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+    upto = timezone.now() - datetime.timedelta(seconds=settle)
+    processed = 0
+    while True:
+        with transaction.atomic():
+            mark = _watermark(DOWNLOADS)
+            candidates = (
+                DownloadHistory.objects.filter(id__gt=mark.last_id)
+                .order_by('id').values_list('id', 'downloaded_at')[:batch_size]
+            )
+            ids = []
+            for pk, downloaded_at in candidates:
+                if downloaded_at > upto:
+                    break
+                ids.append(pk)
+            if not ids:
+                return processed
+            rows = (
+                DownloadHistory.objects.filter(id__gt=mark.last_id, id__lte=ids[-1])
+                .annotate(day=TruncDate('downloaded_at'))
+                .values('paper_id', 'day')
+                .annotate(n=Count('id'), last=Max('downloaded_at'))
+            )
+            apply_deltas({
+                (row['paper_id'], row['day']): {'downloads': row['n'], 'last_download_at': row['last']}
+                for row in rows
+            })
+            mark.last_id = ids[-1]
+            mark.save(update_fields=['last_id', 'updated_at'])
+        processed += len(ids)
+
+
+def rollup_revenue(settle_seconds=None):
+    """Roll up OrderItems of orders verified since the last run. Returns items processed.
+
+    Orders verified within the last ``settle_seconds`` are left for the next run
+    so a verification still committing is never skipped by the watermark.
+    Sales are counted from verified_at only: legacy Payments (which the admin
+    can unverify) are not rolled up, and an order is never subtracted again.
+    """
+    settle = settings.ROLLUP_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+    upto = timezone.now() - datetime.timedelta(seconds=settle)
+    with transaction.atomic():
+        mark = _watermark(REVENUE)
+        items = OrderItem.objects.filter(order__verified=True, order__verified_at__lte=upto)
+        if mark.last_time is not None:
+            if mark.last_time >= upto:
+                return 0
+            items = items.filter(order__verified_at__gt=mark.last_time)
+        rows = list(
+            items.annotate(day=TruncDate('order__verified_at'))
+            .values('paper_id', 'day')
+            .annotate(n=Count('id'), total=Sum('price'))
+        )
+        apply_deltas({
+            (row['paper_id'], row['day']): {'sales': row['n'], 'revenue': row['total'] or Decimal('0')}
+            for row in rows
+        })
+        mark.last_time = upto
+        mark.save(update_fields=['last_time', 'updated_at'])
+    return sum(row['n'] for row in rows)
+
+
+def run_rollups(batch_size=5000, settle_seconds=None):
+    return {
+        DOWNLOADS: rollup_downloads(batch_size=batch_size, settle_seconds=settle_seconds),
+        REVENUE: rollup_revenue(settle_seconds=settle_seconds),
+    }
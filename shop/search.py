@@ -0,0 +1,298 @@
+# shop/search.py
+
+import re
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# SQLite: FTS5 virtual table whose rowid is the paper id.
+SQLITE_TABLE = 'shop_paper_fts'
+# PostgreSQL: side table with a weighted tsvector and a GIN index.
+POSTGRES_TABLE = 'shop_paper_search'
+
+# Indexed columns in FTS5 order, with their BM25 weights (title matters most)
+COLUMNS = ('title', 'description', 'subject', 'class_level', 'term', 'exam_type')
+BM25_WEIGHTS = (10.0, 2.0, 6.0, 4.0, 3.0, 3.0)
+POSTGRES_WEIGHTS = {'title': 'A', 'subject': 'B', 'class_level': 'B', 'term': 'C', 'exam_type': 'C', 'description': 'D'}
+
+# Highlight markers are control characters so the text can be escaped safely
+# before they are swapped for <mark> tags.
+MARK_START, MARK_END = '\x02', '\x03'
+SYNC_CHUNK_SIZE = 500
+
+# QuestionPaper fields that feed the index; partial saves of others are ignored
+PAPER_INDEX_FIELDS = frozenset({'title', 'description', 'class_level', 'term', 'subject', 'exam_type', 'is_available'})
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(conn=None):
+    return (conn or connection).vendor in ('sqlite', 'postgresql')
+
+
+# ====================================================================
+# SCHEMA
+# ====================================================================
+
+def create_search_schema(conn):
+    """Create the vendor-specific index structures if missing (see `manage.py rebuild_search_index`)."""
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+                f"{', '.join(COLUMNS)}, class_level_id UNINDEXED, "
+                f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+                f"paper_id bigint PRIMARY KEY REFERENCES shop_questionpaper (id) ON DELETE CASCADE, "
+                f"class_level_id bigint NOT NULL, "
+                f"title text NOT NULL, description text NOT NULL, "
+                f"document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+                f"ON {POSTGRES_TABLE} USING gin (document)"
+            )
+
+
+def drop_search_schema(conn):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+# ====================================================================
+# INDEX MAINTENANCE
+# ====================================================================
+
+def _exam_type_sql():
+    """CASE expression indexing both the exam type code and its label."""
+    from .models import QuestionPaper
+    choices = QuestionPaper._meta.get_field('exam_type').choices
+    whens = ' '.join("WHEN %s THEN %s" for _ in choices)
+    params = []
+    for code, label in choices:
+        params.extend([code, f"{code} {label}"])
+    return f"CASE p.exam_type {whens} ELSE p.exam_type END", params
+
+
+def _source_sql(where):
+    """SELECT producing one index document per available paper."""
+    exam_type, params = _exam_type_sql()
+    sql = (
+        f"SELECT p.id, p.class_level_id, p.title, p.description, s.name, c.name, t.name, {exam_type} "
+        f"FROM shop_questionpaper p "
+        f"JOIN shop_subject s ON s.id = p.subject_id "
+        f"JOIN shop_classes c ON c.id = p.class_level_id "
+        f"JOIN shop_term t ON t.id = p.term_id "
+        f"WHERE p.is_available = %s"
+    )
+    params.append(True)
+    if where:
+        sql += f" AND {where[0]}"
+        params.extend(where[1])
+    return sql, params
+
+
+def _delete_sql(where):
+    if connection.vendor == 'sqlite':
+        if where is None:
+            return f"DELETE FROM {SQLITE_TABLE}", []
+        return f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN (SELECT p.id FROM shop_questionpaper p WHERE {where[0]})", list(where[1])
+    if where is None:
+        return f"DELETE FROM {POSTGRES_TABLE}", []
+    return f"DELETE FROM {POSTGRES_TABLE} WHERE paper_id IN (SELECT p.id FROM shop_questionpaper p WHERE {where[0]})", list(where[1])
+
+
+def _insert_sql(where):
+    source, params = _source_sql(where)
+    if connection.vendor == 'sqlite':
+        return (
+            f"INSERT INTO {SQLITE_TABLE} (rowid, class_level_id, title, description, subject, class_level, term, exam_type) "
+            f"{source}"
+        ), params
+    document = ' || '.join(
+        f"setweight(to_tsvector('simple', coalesce(src.{col}, '')), '{POSTGRES_WEIGHTS[col]}')"
+        for col in COLUMNS
+    )
+    return (
+        f"INSERT INTO {POSTGRES_TABLE} (paper_id, class_level_id, title, description, document) "
+        f"SELECT src.id, src.class_level_id, src.title, src.description, {document} "
+        f"FROM ({source}) AS src (id, class_level_id, title, description, subject, class_level, term, exam_type)"
+    ), params
+
+
+def _sync(where=None):
+    if not is_supported():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(*_delete_sql(where))
+        cursor.execute(*_insert_sql(where))
+
+
+def rebuild_index():
+    """Rebuild the whole index with one bulk INSERT ... SELECT."""
+    _sync()
+
+
+def index_papers(paper_ids):
+    """Re-index (or drop, if no longer available) the given papers."""
+    paper_ids = list(paper_ids)
+    for start in range(0, len(paper_ids), SYNC_CHUNK_SIZE):
+        chunk = paper_ids[start:start + SYNC_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        _sync((f"p.id IN ({placeholders})", chunk))
+
+
+def index_papers_for(field, value):
+    """Re-index every paper hanging off a renamed class, term or subject."""
+    _sync((f"p.{field}_id = %s", [value]))
+
+
+def remove_papers(paper_ids):
+    if not is_supported():
+        return
+    paper_ids = list(paper_ids)
+    table, key = (SQLITE_TABLE, 'rowid') if connection.vendor == 'sqlite' else (POSTGRES_TABLE, 'paper_id')
+    with connection.cursor() as cursor:
+        for start in range(0, len(paper_ids), SYNC_CHUNK_SIZE):
+            chunk = paper_ids[start:start + SYNC_CHUNK_SIZE]
+            cursor.execute(f"DELETE FROM {table} WHERE {key} IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+# ====================================================================
+# QUERYING
+# ====================================================================
+
+def query_tokens(query):
+    """The lowercased words of a query, at most 12."""
+    return _TOKEN_RE.findall(query.lower())[:12]
+
+
+def highlight(text):
+    """Escape ``text`` and turn the MARK_START/MARK_END markers into <mark> tags."""
+    if not text:
+        return ''
+    return mark_safe(escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+class SearchResults:
+    """Lazily evaluated, ranked search hits usable as a Paginator object_list.
+
+    ``count()`` and slicing each issue a single indexed query, so only the
+    requested page of papers is ever loaded.
+    """
+
+    def __init__(self, query, class_level_id=None):
+        self.query = query
+        self.class_level_id = class_level_id
+        self.tokens = query_tokens(query)
+        self._count = None
+
+    # --- backend specific SQL ---
+
+    def _filters(self):
+        if connection.vendor == 'sqlite':
+            # Every token is a prefix query; FTS5 ANDs them together
+            where, params = f"{SQLITE_TABLE} MATCH %s", [' '.join(f'"{t}"*' for t in self.tokens)]
+        else:
+            where = "document @@ to_tsquery('simple', %s)"
+            params = [' & '.join(f"{t}:*" for t in self.tokens)]
+        if self.class_level_id:
+            where += " AND class_level_id = %s"
+            params.append(self.class_level_id)
+        return where, params
+
+    def _count_sql(self):
+        where, params = self._filters()
+        table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+        return f"SELECT COUNT(*) FROM {table} WHERE {where}", params
+
+    def _page_sql(self, limit, offset):
+        where, params = self._filters()
+        if connection.vendor == 'sqlite':
+            weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+            sql = (
+                f"SELECT rowid, "
+                f"highlight({SQLITE_TABLE}, 0, %s, %s), "
+                f"snippet({SQLITE_TABLE}, 1, %s, %s, '…', 24) "
+                f"FROM {SQLITE_TABLE} WHERE {where} "
+                f"ORDER BY bm25({SQLITE_TABLE}, {weights}), rowid LIMIT %s OFFSET %s"
+            )
+            return sql, [MARK_START, MARK_END, MARK_START, MARK_END] + params + [limit, offset]
+        tsquery = ' & '.join(f"{t}:*" for t in self.tokens)
+        options = f"StartSel={MARK_START}, StopSel={MARK_END}"
+        sql = (
+            f"SELECT paper_id, "
+            f"ts_headline('simple', title, to_tsquery('simple', %s), %s), "
+            f"ts_headline('simple', description, to_tsquery('simple', %s), %s) "
+            f"FROM {POSTGRES_TABLE} WHERE {where} "
+            f"ORDER BY ts_rank_cd(document, to_tsquery('simple', %s)) DESC, paper_id LIMIT %s OFFSET %s"
+        )
+        opts = options + ', MaxWords=24, MinWords=8'
+        return sql, [tsquery, options + ', HighlightAll=true', tsquery, opts] + params + [tsquery, limit, offset]
+
+    # --- Paginator protocol ---
+
+    def count(self):
+        if self._count is None:
+            if not self.tokens:
+                self._count = 0
+            elif not is_supported():
+                self._count = self._fallback_queryset().count()
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(*self._count_sql())
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('SearchResults only supports slicing.')
+        offset = key.start or 0
+        limit = (key.stop - offset) if key.stop is not None else self.count() - offset
+        return self._fetch(limit, offset) if self.tokens and limit > 0 else []
+
+    def _fetch(self, limit, offset):
+        from .models import QuestionPaper
+        if not is_supported():
+            return list(self._fallback_queryset()[offset:offset + limit])
+        with connection.cursor() as cursor:
+            cursor.execute(*self._page_sql(limit, offset))
+            hits = cursor.fetchall()
+        papers = QuestionPaper.objects.select_related('class_level', 'term', 'subject').in_bulk([h[0] for h in hits])
+        results = []
+        for paper_id, title, snippet in hits:
+            paper = papers.get(paper_id)
+            if paper is None:
+                continue
+            paper.highlighted_title = highlight(title) or paper.title
+            paper.highlighted_snippet = highlight(snippet) if MARK_START in (snippet or '') else ''
+            results.append(paper)
+        return results
+
+    def _fallback_queryset(self):
+        from django.db.models import Q
+        from .models import QuestionPaper
+        condition = Q()
+        for token in self.tokens:
+            condition &= (
+                Q(title__icontains=token) | Q(description__icontains=token) |
+                Q(subject__name__icontains=token) | Q(class_level__name__icontains=token) |
+                Q(term__name__icontains=token) | Q(exam_type__icontains=token)
+            )
+        qs = QuestionPaper.objects.filter(condition, is_available=True)
+        if self.class_level_id:
+            qs = qs.filter(class_level_id=self.class_level_id)
+        return qs.select_related('class_level', 'term', 'subject').order_by('title', 'id')
+
+
+def search(query, class_level_id=None):
+    return SearchResults(query, class_level_id=class_level_id)
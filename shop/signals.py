@@ -0,0 +1,90 @@
+# shop/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.conf import settings
+from . import download_links, pdf_metadata, search
+from .models import Classes, Term, Subject, QuestionPaper
+from .facets import FACET_FIELDS
+from .catalog import PAPER_TREE_FIELDS, refresh_paper_paths, schedule_catalog_bump
+
+
+# --- Catalog snapshot invalidation ---
+
+@receiver(post_save, sender=Classes)
+@receiver(post_save, sender=Term)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Classes)
+@receiver(post_delete, sender=Term)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=QuestionPaper)
+def invalidate_catalog(sender, **kwargs):
+    schedule_catalog_bump()
+
+
+@receiver(post_save, sender=QuestionPaper)
+def invalidate_catalog_for_paper(sender, instance, update_fields=None, **kwargs):
+    # Partial saves of non-tree, non-facet fields (views, file metadata...) keep the snapshot valid
+    if update_fields is not None and not (PAPER_TREE_FIELDS | FACET_FIELDS).intersection(update_fields):
+        return
+    schedule_catalog_bump()
+
+
+# --- Denormalized paper paths ---
+
+@receiver(post_save, sender=Classes)
+@receiver(post_save, sender=Term)
+@receiver(post_save, sender=Subject)
+def refresh_parent_paper_paths(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    field = {Classes: 'class_level', Term: 'term', Subject: 'subject'}[sender]
+    refresh_paper_paths(**{field: instance.pk})
+
+
+# --- Search index sync ---
+
+@receiver(post_save, sender=QuestionPaper)
+def index_paper(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not search.PAPER_INDEX_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(lambda: search.index_papers([instance.pk]))
+
+
+@receiver(post_delete, sender=QuestionPaper)
+def unindex_paper(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search.remove_papers([instance.pk]))
+
+
+@receiver(post_save, sender=Classes)
+@receiver(post_save, sender=Term)
+@receiver(post_save, sender=Subject)
+def reindex_parent_papers(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    field = {Classes: 'class_level', Term: 'term', Subject: 'subject'}[sender]
+    transaction.on_commit(lambda: search.index_papers_for(field, instance.pk))
+
+
+# --- PDF metadata extraction ---
+
+@receiver(post_save, sender=QuestionPaper)
+def extract_pdf_metadata(sender, instance, update_fields=None, **kwargs):
+    if not settings.PDF_METADATA_ON_SAVE or not instance.pdf_file:
+        return
+    if update_fields is not None and 'pdf_file' not in update_fields:
+        return
+    if instance.metadata_source == instance.pdf_file.name:
+        return
+    transaction.on_commit(lambda: pdf_metadata.schedule_extraction(instance.pk))
+
+
+# --- Cached storage URLs ---
+
+@receiver(post_save, sender=QuestionPaper)
+@receiver(post_delete, sender=QuestionPaper)
+def forget_download_url(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'pdf_file', 'password'}.intersection(update_fields):
+        return
+    transaction.on_commit(lambda: download_links.forget_storage_urls([instance.pk]))
@@ -1,3 +1,1603 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.contrib.auth.models import User
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.text import slugify
+from . import download_events, download_links, entitlements, fulfillment, gateways, page_cache, pdf_metadata, pdf_text, previews, protected_pdfs, rollups, search, view_counter
+from .cart import Cart
+from .catalog import bump_catalog_version, get_catalog_snapshot
+from .models import (
+    Classes, Term, Subject, QuestionPaper, Order, OrderItem, SmsMessage,
+    Payment, DownloadHistory, FreeSample, PaperDailyStats, PaperStats, PdfDocument, Entitlement,
+    PdfJobFailure, RollupWatermark,
+)
 
-# Create your tests here.
+
+def make_pdf(pages=1, texts=()):
+    """A PDF with ``pages`` blank pages, or one page per string in ``texts``."""
+    writer = PdfWriter()
+    for _ in range(pages if not texts else 0):
+        writer.add_blank_page(width=200, height=200)
+    if texts:
+        font = writer._add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        }))
+    for text in texts:
+        page = writer.add_blank_page(width=600, height=200)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 10 Tf 10 100 Td ({text}) Tj ET".encode())
+        page[NameObject('/Contents')] = writer._add_object(content)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class RenamingStorage(FileSystemStorage):
+    """Adds a random suffix to every saved name, as Cloudinary does."""
+
+    def get_available_name(self, name, max_length=None):
+        root, ext = os.path.splitext(name)
+        return super().get_available_name(f'{root}_{get_random_string(7)}{ext}', max_length)
+
+
+def use_temp_storage(test_case, backend='django.core.files.storage.FileSystemStorage'):
+    """Point default storage at a temp dir for the test; returns the directory."""
+    tmp = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp.cleanup)
+    storages = override_settings(STORAGES={
+        'default': {'BACKEND': backend, 'OPTIONS': {'location': tmp.name}},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    storages.enable()
+    test_case.addCleanup(storages.disable)
+    return tmp.name
+
+
+def create_paper(title='Paper', **kwargs):
+    """Create a paper (and any missing hierarchy) without touching file storage."""
+    class_level = kwargs.pop('class_level', None) or Classes.objects.get_or_create(name='JHS 1', slug='jhs-1')[0]
+    term = kwargs.pop('term', None) or Term.objects.get_or_create(class_name=class_level, name='Term 1', slug='term-1')[0]
+    subject = kwargs.pop('subject', None) or Subject.objects.get_or_create(name='Mathematics', slug='mathematics')[0]
+    kwargs.setdefault('price', 5)
+    kwargs.setdefault('pdf_file', 'question_papers/paper.pdf')
+    return QuestionPaper.objects.create(title=title, class_level=class_level, term=term, subject=subject, **kwargs)
+
+
+def create_verified_order(*papers, **kwargs):
+    kwargs.setdefault('email', 'buyer@example.com')
+    kwargs.setdefault('phone_number', '0241234567')
+    order = Order.objects.create(total_amount=sum(paper.price for paper in papers), **kwargs)
+    OrderItem.objects.bulk_create([OrderItem(order=order, paper=paper, price=paper.price) for paper in papers])
+    order.mark_as_verified()
+    return order
+
+
+# ====================================================================
+# GATEWAYS
+# ====================================================================
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers with whatever (status, body) the test queued for the path."""
+
+    def _respond(self):
+        status, body = self.server.responses.get(self.path, (404, {}))
+        self.server.hits.append((self.command, self.path))
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class GatewayTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.responses, cls.server.hits = {}, []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.settings_override = override_settings(
+            PAYSTACK_BASE_URL=base, HTTPSMS_BASE_URL=base,
+            GATEWAY_MAX_RETRIES=0, GATEWAY_BREAKER_THRESHOLD=2, GATEWAY_BREAKER_RESET=60,
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        gateways.reset_gateways()
+        self.server.responses.clear()
+        self.server.hits.clear()
+
+    def test_paystack_verify_round_trip_records_metrics(self):
+        self.server.responses['/transaction/verify/ABC'] = (200, {'status': True, 'data': {'status': 'success'}})
+        res = gateways.paystack_verify('ABC')
+        self.assertEqual(res['data']['status'], 'success')
+        stats = gateways.metrics.snapshot()['paystack.verify']
+        self.assertEqual((stats['calls'], stats['errors']), (1, 0))
+
+    def test_breaker_opens_after_repeated_server_errors(self):
+        self.server.responses['/transaction/initialize'] = (503, {})
+        with self.assertLogs('shop.gateways', 'WARNING') as logs:
+            for _ in range(2):
+                with self.assertRaises(gateways.GatewayError):
+                    gateways.paystack_initialize({'reference': 'X'})
+        self.assertEqual(logs.output, ['WARNING:shop.gateways:paystack circuit opened after 2 failures'])
+        with self.assertRaises(gateways.CircuitOpenError):
+            gateways.paystack_initialize({'reference': 'X'})
+        # The open circuit never reached the stub server
+        self.assertEqual(len(self.server.hits), 2)
+        self.assertEqual(gateways.metrics.snapshot()['paystack.initialize']['short_circuited'], 1)
+
+    def test_breakers_are_per_service(self):
+        self.server.responses['/transaction/verify/X'] = (500, {})
+        self.server.responses['/v1/messages/send'] = (200, {'data': {'id': 'm1'}})
+        with self.assertLogs('shop.gateways', 'WARNING'):
+            for _ in range(2):
+                with self.assertRaises(gateways.GatewayError):
+                    gateways.paystack_verify('X')
+        self.assertEqual(gateways.httpsms_send('hi', '+233200000000', '+233200000001').status_code, 200)
+
+    def test_unexpected_probe_errors_release_the_half_open_breaker(self):
+        self.server.responses['/transaction/verify/X'] = (200, {'status': True})
+        breaker = gateways.get_breaker('paystack')
+        breaker.failures, breaker.opened_at = 2, time.monotonic() - 61
+        self.assertEqual(breaker.state, gateways.CircuitBreaker.HALF_OPEN)
+        with mock.patch.object(gateways.get_session(), 'request', side_effect=ValueError('bad header')):
+            with self.assertRaises(ValueError):
+                gateways.paystack_verify('X')
+        # The failed probe re-opened the circuit instead of leaving it stuck mid-probe
+        breaker.opened_at = time.monotonic() - 61
+        self.assertTrue(gateways.paystack_verify('X')['status'])
+        self.assertEqual(breaker.state, gateways.CircuitBreaker.CLOSED)
+
+    def test_client_errors_do_not_trip_the_breaker(self):
+        self.server.responses['/transaction/verify/missing'] = (400, {'status': False})
+        for _ in range(3):
+            self.assertFalse(gateways.paystack_verify('missing')['status'])
+        self.assertEqual(gateways.get_breaker('paystack').state, gateways.CircuitBreaker.CLOSED)
+
+
+# ====================================================================
+# ORDER VERIFICATION
+# ====================================================================
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_secret')
+class OrderVerificationRaceTests(TransactionTestCase):
+    def setUp(self):
+        self.order = Order.objects.create(email='buyer@example.com', phone_number='0241234567', total_amount=10)
+        for i in range(3):
+            OrderItem.objects.create(order=self.order, paper=create_paper(f'Paper {i}'), price=5)
+
+    def webhook(self, client):
+        body = json.dumps({'event': 'charge.success', 'data': {'reference': self.order.ref, 'id': 42}}).encode()
+        signature = hmac.new(b'sk_test_secret', body, hashlib.sha512).hexdigest()
+        return client.post(reverse('paystack-webhook'), body, content_type='application/json',
+                           HTTP_X_PAYSTACK_SIGNATURE=signature)
+
+    def callback(self, client):
+        return client.get(reverse('shop:order_callback'), {'reference': self.order.ref})
+
+    def test_webhook_and_callback_racing_fulfill_once(self):
+        verified = {'status': True, 'data': {'status': 'success', 'id': 42}}
+        for _ in range(5):
+            Order.objects.filter(pk=self.order.pk).update(verified=False, verified_at=None)
+            SmsMessage.objects.all().delete()
+            barrier = threading.Barrier(4)
+            errors = []
+
+            def fire(path):
+                try:
+                    barrier.wait()
+                    response = path(Client())
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+                except Exception as exc:
+                    errors.append(exc)
+                finally:
+                    connection.close()
+
+            with mock.patch('shop.gateways.paystack_verify', return_value=verified):
+                threads = [threading.Thread(target=fire, args=(path,))
+                           for path in (self.webhook, self.callback, self.webhook, self.callback)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(errors, [])
+            self.order.refresh_from_db()
+            self.assertTrue(self.order.verified)
+            self.assertEqual(self.order.transaction_id, '42')
+            self.assertEqual(SmsMessage.objects.filter(order=self.order).count(), 1)
+
+    def test_webhook_rejects_bad_signature(self):
+        body = json.dumps({'event': 'charge.success', 'data': {'reference': self.order.ref}})
+        response = self.client.post(reverse('paystack-webhook'), body, content_type='application/json',
+                                    HTTP_X_PAYSTACK_SIGNATURE='0' * 128)
+        self.assertEqual(response.status_code, 401)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.verified)
+
+
+# ====================================================================
+# SMS OUTBOX
+# ====================================================================
+
+@override_settings(SMS_MAX_ATTEMPTS=3, SMS_RETRY_BASE_DELAY=30, SMS_RETRY_MAX_DELAY=100, SMS_CLAIM_LEASE=60)
+class SmsOutboxTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(email='buyer@example.com', phone_number='0241234567', total_amount=5)
+
+    def message(self, **kwargs):
+        return SmsMessage.objects.create(order=self.order, phone_number='+233241234567', content='hi', **kwargs)
+
+    def test_claims_only_due_messages_and_never_twice(self):
+        due = self.message()
+        self.message(next_attempt_at=timezone.now() + datetime.timedelta(minutes=5))
+        self.message(status=SmsMessage.STATUS_SENT)
+        self.assertEqual([m.pk for m in fulfillment.claim_batch(10)], [due.pk])
+        self.assertEqual(fulfillment.claim_batch(10), [])
+        due.refresh_from_db()
+        self.assertEqual(due.status, SmsMessage.STATUS_SENDING)
+        self.assertTrue(due.claimed_by)
+
+    def test_expired_leases_return_to_the_queue(self):
+        stale = self.message(status=SmsMessage.STATUS_SENDING, claimed_by='dead',
+                             claimed_at=timezone.now() - datetime.timedelta(seconds=61))
+        live = self.message(status=SmsMessage.STATUS_SENDING, claimed_by='alive', claimed_at=timezone.now())
+        self.assertEqual(fulfillment.release_stale_claims(), 1)
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stale.status, stale.claimed_by), (SmsMessage.STATUS_PENDING, ''))
+        self.assertEqual(live.status, SmsMessage.STATUS_SENDING)
+
+    def test_failures_back_off_until_the_attempt_limit(self):
+        for attempts in (1, 2, 3, 10):
+            delay = fulfillment.retry_delay(attempts).total_seconds()
+            base = min(30 * 2 ** (attempts - 1), 100)
+            self.assertTrue(base * 0.8 <= delay <= base * 1.2, (attempts, delay))
+
+        message = self.message()
+        for attempt in (1, 2):
+            before = timezone.now()
+            fulfillment.record_result(message, False, '', 'HTTP 500')
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), (SmsMessage.STATUS_PENDING, attempt))
+            self.assertGreater(message.next_attempt_at, before + datetime.timedelta(seconds=20))
+        with self.assertLogs('shop.fulfillment', 'ERROR') as logs:
+            fulfillment.record_result(message, False, '', 'HTTP 500')
+        self.assertIn(f'SMS {message.pk} to {message.phone_number} failed permanently: HTTP 500', logs.output[0])
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.last_error), (SmsMessage.STATUS_FAILED, 'HTTP 500'))
+
+    def test_drain_records_each_result(self):
+        ok, failing = self.message(), self.message()
+        results = {ok.pk: (True, 'provider-1', ''), failing.pk: (False, '', 'HTTP 500')}
+        with mock.patch.object(fulfillment, 'send_sms', side_effect=lambda m: results[m.pk]):
+            self.assertEqual(fulfillment.drain_outbox(concurrency=2), 2)
+        ok.refresh_from_db()
+        failing.refresh_from_db()
+        self.assertEqual((ok.status, ok.provider_message_id), (SmsMessage.STATUS_SENT, 'provider-1'))
+        self.assertEqual((failing.status, failing.attempts), (SmsMessage.STATUS_PENDING, 1))
+        self.assertEqual(fulfillment.drain_outbox(), 0)
+
+    def test_admin_retry_gives_failed_messages_a_fresh_budget(self):
+        failed = self.message(status=SmsMessage.STATUS_FAILED, attempts=3, last_error='HTTP 500')
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        client.post(reverse('admin:shop_smsmessage_changelist'),
+                    {'action': 'retry_now', '_selected_action': [failed.pk]})
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.attempts, failed.last_error), (SmsMessage.STATUS_PENDING, 0, ''))
+
+
+# ====================================================================
+# VIEW COUNTER
+# ====================================================================
+
+class ViewCounterTests(TransactionTestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.papers = [create_paper(f'Paper {i}') for i in range(3)]
+
+    def tearDown(self):
+        view_counter.flush()
+
+    def test_parallel_views_and_flushes_lose_no_increments(self):
+        workers, views_each = 6, 30
+        barrier = threading.Barrier(workers + 1)
+        done = threading.Event()
+        errors = []
+
+        def browse(worker):
+            try:
+                client = Client()
+                barrier.wait()
+                for i in range(views_each):
+                    paper = self.papers[(worker + i) % len(self.papers)]
+                    if client.get(paper.get_absolute_url()).status_code != 200:
+                        errors.append(paper.pk)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        def flusher():
+            try:
+                barrier.wait()
+                while not done.is_set():
+                    view_counter.flush()
+                    view_counter.flush_all()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=browse, args=(w,)) for w in range(workers)]
+        flush_thread = threading.Thread(target=flusher)
+        flush_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        flush_thread.join()
+        view_counter.flush_all()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(QuestionPaper.objects.values_list('views', flat=True)), workers * views_each)
+        self.assertFalse(any(view_counter.pending_views(p.pk) for p in self.papers))
+
+    def test_views_are_batched_until_flush(self):
+        paper = self.papers[0]
+        for _ in range(5):
+            paper.increment_views()
+        paper.refresh_from_db()
+        self.assertEqual(paper.views, 0)
+        self.assertEqual(view_counter.pending_views(paper.pk), 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(view_counter.flush(), 5)
+        paper.refresh_from_db()
+        self.assertEqual(paper.views, 5)
+
+
+# ====================================================================
+# ADMIN
+# ====================================================================
+
+class AdminChangelistQueryTests(TestCase):
+    changelists = [
+        'classes', 'term', 'subject', 'questionpaper', 'payment',
+        'downloadhistory', 'freesample', 'smsmessage', 'paperdailystats',
+    ]
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            i = self.rows = self.rows + 1
+            class_level = Classes.objects.create(name=f'Class {i}', slug=f'class-{i}')
+            term = Term.objects.create(class_name=class_level, name='Term 1', slug='term-1')
+            subject = Subject.objects.create(name=f'Subject {i}', slug=f'subject-{i}')
+            paper = create_paper(f'Paper {i}', class_level=class_level, term=term, subject=subject)
+            payment = Payment.objects.create(question_paper=paper, email=f'{i}@example.com', verified=True)
+            for _ in range(2):
+                DownloadHistory.objects.create(paper=paper, payment=payment, user_email=payment.email)
+            FreeSample.objects.create(question_paper=paper)
+            order = Order.objects.create(email=payment.email, phone_number='0241234567', total_amount=5)
+            SmsMessage.objects.create(order=order, phone_number='+233241234567', content='hi')
+            PaperDailyStats.objects.create(paper=paper, date=datetime.date(2024, 1, i), downloads=2)
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f'admin:shop_{model}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_changelists_render_in_constant_queries(self):
+        self.add_rows(2)
+        baseline = {model: self.changelist_queries(model) for model in self.changelists}
+        self.add_rows(5)
+        for model in self.changelists:
+            with self.subTest(model=model):
+                self.assertEqual(self.changelist_queries(model), baseline[model])
+
+    def test_paper_counts_are_annotated_and_sortable(self):
+        self.add_rows(1)
+        create_paper('Extra', class_level=Classes.objects.get(slug='class-1'),
+                     term=Term.objects.get(class_name__slug='class-1'), subject=Subject.objects.get(slug='subject-1'))
+        response = self.client.get(reverse('admin:shop_classes_changelist'), {'o': '-3'})
+        self.assertContains(response, 'View 2 Papers')
+
+
+# ====================================================================
+# BULK IMPORT
+# ====================================================================
+
+class ImportPapersTests(TransactionTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.pdf_dir = os.path.join(tmp.name, 'pdfs')
+        os.makedirs(self.pdf_dir)
+        self.manifest = os.path.join(tmp.name, 'papers.csv')
+        self.media = use_temp_storage(self)
+        create_paper('Algebra')  # occupies the slug the first manifest row would get
+        search.rebuild_index()  # the index table is not flushed between TransactionTestCases
+
+    def write_manifest(self, rows):
+        with open(self.manifest, 'w', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=['file', 'title', 'class', 'term', 'subject', 'price', 'year'])
+            writer.writeheader()
+            for row in rows:
+                with open(os.path.join(self.pdf_dir, row['file']), 'wb') as pdf:
+                    pdf.write(make_pdf(pages=2))
+                writer.writerow(row)
+
+    def run_import(self):
+        out = io.StringIO()
+        call_command('import_papers', self.manifest, self.pdf_dir, '--batch-size', '2', '--workers', '3',
+                     stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_import_allocates_slugs_uploads_and_resumes(self):
+        rows = [{'file': f'p{i}.pdf', 'title': 'Algebra', 'class': 'JHS 1', 'term': 'Term 1',
+                 'subject': 'Mathematics', 'price': '5', 'year': '2023'} for i in range(5)]
+        rows.append({'file': 'bad.pdf', 'title': 'Orphan', 'class': 'JHS 9', 'term': 'Term 1',
+                     'subject': 'Mathematics', 'price': '5', 'year': '2023'})
+        self.write_manifest(rows)
+
+        output = self.run_import()
+        self.assertIn('Imported 5 papers (0 already done, 1 failed)', output)
+        papers = QuestionPaper.objects.exclude(pdf_file='question_papers/paper.pdf')
+        self.assertEqual(papers.count(), 5)
+        slugs = set(QuestionPaper.objects.values_list('slug', flat=True))
+        self.assertEqual(len(slugs), 6)
+        for paper in papers:
+            self.assertTrue(os.path.exists(os.path.join(self.media, paper.pdf_file.name)))
+            self.assertTrue(paper.password.startswith('INSIGHT_'))
+            self.assertEqual((paper.pages, paper.metadata_source), (2, paper.pdf_file.name))
+            self.assertEqual((paper.canonical_path, paper.display_label),
+                             (paper.build_canonical_path(), paper.build_display_label()))
+            self.assertTrue(paper.canonical_path)
+        if search.is_supported():
+            self.assertEqual(search.search('algebra').count(), 6)
+
+        # A second run skips everything already imported
+        self.assertIn('Imported 0 papers (5 already done, 1 failed)', self.run_import())
+        self.assertEqual(QuestionPaper.objects.count(), 6)
+
+    def new_hierarchy_rows(self):
+        return [{'file': f'n{i}.pdf', 'title': f'Biology {i}', 'class': 'SHS 1', 'term': 'Term 2',
+                 'subject': 'Biology', 'price': '5', 'year': '2023'} for i in range(3)]
+
+    def test_dry_run_creates_nothing(self):
+        self.write_manifest(self.new_hierarchy_rows())
+        counts = (Classes.objects.count(), Term.objects.count(), Subject.objects.count())
+        out = io.StringIO()
+        call_command('import_papers', self.manifest, self.pdf_dir, '--dry-run', '--create-missing',
+                     stdout=out, stderr=io.StringIO())
+        self.assertIn('Imported 3 papers', out.getvalue())
+        self.assertEqual((Classes.objects.count(), Term.objects.count(), Subject.objects.count()), counts)
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'question_papers')))
+
+    def test_failed_batch_leaves_no_hierarchy_rows_or_uploads(self):
+        self.write_manifest(self.new_hierarchy_rows())
+        with mock.patch('shop.importer.search.index_papers', side_effect=DatabaseError('boom')):
+            with self.assertRaises(DatabaseError):
+                call_command('import_papers', self.manifest, self.pdf_dir, '--create-missing',
+                             stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(Classes.objects.filter(slug='shs-1').exists())
+        self.assertFalse(Subject.objects.filter(slug='biology').exists())
+        uploaded = os.path.join(self.media, 'question_papers')
+        self.assertEqual(os.listdir(uploaded) if os.path.isdir(uploaded) else [], [])
+
+        call_command('import_papers', self.manifest, self.pdf_dir, '--create-missing',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        term = Term.objects.get(class_name__slug='shs-1', slug='term-2')
+        self.assertEqual(QuestionPaper.objects.filter(term=term, subject__slug='biology').count(), 3)
+        paper = QuestionPaper.objects.get(title='Biology 0')
+        self.assertEqual(paper.display_label, 'SHS 1 - Term 2 - Biology (Biology 0)')
+        self.assertEqual(paper.canonical_path, paper.build_canonical_path())
+
+
+# ====================================================================
+# PDF METADATA
+# ====================================================================
+
+class PdfMetadataTests(TransactionTestCase):
+    def setUp(self):
+        use_temp_storage(self)
+
+    def create_pdf_paper(self, title, pages):
+        paper = create_paper(title, pdf_file='')
+        paper.pdf_file.save(f'{title}.pdf', ContentFile(make_pdf(pages)))
+        return paper
+
+    @override_settings(PDF_METADATA_ON_SAVE=True)
+    def test_upload_schedules_background_extraction(self):
+        with mock.patch('shop.pdf_metadata.schedule_extraction') as schedule:
+            paper = self.create_pdf_paper('Upload', 2)
+        schedule.assert_called_once_with(paper.pk)
+        # Writing the metadata back is a plain UPDATE and does not schedule again
+        with mock.patch('shop.pdf_metadata.schedule_extraction') as schedule:
+            self.assertTrue(pdf_metadata.extract_paper(paper.pk))
+        schedule.assert_not_called()
+        paper.refresh_from_db()
+        self.assertEqual(paper.pages, 2)
+        self.assertEqual(paper.metadata_source, paper.pdf_file.name)
+        with paper.pdf_file.open('rb') as fh:
+            self.assertEqual(paper.content_hash, hashlib.sha256(fh.read()).hexdigest())
+        self.assertTrue(paper.file_size.endswith(('B', 'KB')))
+
+    @override_settings(PDF_METADATA_ON_SAVE=True)
+    def test_background_pool_measures_uploads(self):
+        self.addCleanup(pdf_metadata.shutdown)
+        paper = self.create_pdf_paper('Pooled', 3)
+        pdf_metadata.shutdown()
+        paper.refresh_from_db()
+        self.assertEqual((paper.pages, paper.metadata_source), (3, paper.pdf_file.name))
+
+    def test_backfill_command_measures_pending_papers(self):
+        papers = [self.create_pdf_paper(f'Paper {i}', i + 1) for i in range(4)]
+        out = io.StringIO()
+        call_command('extract_pdf_metadata', '--workers', '3', stdout=out, stderr=io.StringIO())
+        self.assertIn('Stored metadata for 4 of 4 papers', out.getvalue())
+        self.assertEqual(
+            {paper.pk: i + 1 for i, paper in enumerate(papers)},
+            dict(QuestionPaper.objects.values_list('id', 'pages')),
+        )
+        self.assertFalse(pdf_metadata.pending_papers().exists())
+
+
+# ====================================================================
+# DOWNLOADS
+# ====================================================================
+
+@override_settings(DOWNLOAD_SERVE_MODE='stream', DOWNLOAD_CHUNK_SIZE=1000, DOWNLOAD_BUFFER_ENABLED=False)
+class DownloadServingTests(TestCase):
+    def setUp(self):
+        use_temp_storage(self)
+        self.body = make_pdf(pages=3)
+        self.paper = create_paper('Download', pdf_file='', is_paid=False, price=0)
+        self.paper.pdf_file.save('download.pdf', ContentFile(self.body))
+        self.url = reverse('shop:download_file', args=[self.paper.slug])
+
+    def test_full_download_streams_in_chunks_and_is_logged(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertEqual(self.paper.downloads.count(), 1)
+
+    def test_range_request_resumes_without_logging_again(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.body[100:])
+        self.assertEqual(response['Content-Range'], f'bytes 100-{len(self.body) - 1}/{len(self.body)}')
+        self.assertEqual(self.paper.downloads.count(), 0)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.body[-10:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.body)}-').status_code, 416)
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.paper.downloads.count(), 1)
+
+    @override_settings(DOWNLOAD_SERVE_MODE='auto')
+    def test_auto_mode_streams_local_files_and_redirects_remote_ones(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+
+        with mock.patch('shop.downloads._local_path', return_value=None):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], self.paper.pdf_file.url)
+        self.assertEqual(self.paper.downloads.count(), 2)
+
+    @override_settings(DOWNLOAD_SERVE_MODE='accel')
+    def test_accel_mode_hands_off_to_front_end(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.paper.pdf_file.name}')
+        self.assertEqual(response.content, b'')
+
+
+# ====================================================================
+# DOWNLOAD EVENT BUFFER
+# ====================================================================
+
+class DownloadEventBufferTests(TestCase):
+    def setUp(self):
+        self.paper = create_paper('Buffered')
+
+    def event(self):
+        return DownloadHistory(paper=self.paper, user_agent='test')
+
+    def test_flushes_when_full(self):
+        buffer = download_events.DownloadEventBuffer(max_size=3, max_age=60)
+        buffer.add(self.event())
+        buffer.add(self.event())
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(self.paper.downloads.count(), 0)
+
+        with self.assertNumQueries(1):
+            buffer.add(self.event())
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.paper.downloads.count(), 3)
+        self.assertIsNone(buffer._timer)
+
+    def test_flushes_when_oldest_event_is_too_old(self):
+        buffer = download_events.DownloadEventBuffer(max_size=100, max_age=5)
+        with mock.patch('shop.download_events.time.monotonic', return_value=1000.0):
+            buffer.add(self.event())
+        self.assertEqual(self.paper.downloads.count(), 0)
+        with mock.patch('shop.download_events.time.monotonic', return_value=1005.0):
+            buffer.add(self.event())
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.paper.downloads.count(), 2)
+
+    def test_failed_bulk_insert_falls_back_to_single_rows(self):
+        buffer = download_events.DownloadEventBuffer(max_size=100, max_age=60)
+        buffer.add(self.event())
+        buffer.add(self.event())
+        with mock.patch.object(DownloadHistory.objects, 'bulk_create', side_effect=DatabaseError('boom')):
+            with self.assertLogs('shop.download_events', 'ERROR'):
+                self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.paper.downloads.count(), 2)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_browser_family(self):
+        cases = {
+            'Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 Chrome/120.0 Safari/537.36 Edg/120.0': 'Edge',
+            'Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 Chrome/120.0 Safari/537.36 OPR/105.0': 'Opera',
+            'Mozilla/5.0 (Linux; Android 13) SamsungBrowser/23.0 Chrome/115.0 Mobile Safari/537.36': 'Samsung Internet',
+            'Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36': 'Chrome',
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0) AppleWebKit/605.1.15 CriOS/120.0 Mobile Safari/604.1': 'Chrome',
+            'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0': 'Firefox',
+            'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0) AppleWebKit/605.1.15 Version/17.0 Safari/605.1.15': 'Safari',
+            'curl/8.4.0': 'Other',
+            '': 'Unknown',
+            None: 'Unknown',
+        }
+        for user_agent, family in cases.items():
+            with self.subTest(user_agent=user_agent):
+                self.assertEqual(download_events.parse_browser_family(user_agent), family)
+
+
+# ====================================================================
+# ROLLUPS
+# ====================================================================
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.paper = create_paper('Rolled up')
+        self.old = timezone.now() - datetime.timedelta(minutes=10)
+
+    def download(self, at):
+        return DownloadHistory.objects.create(paper=self.paper, downloaded_at=at)
+
+    def test_downloads_roll_up_once_in_batches(self):
+        rows = [self.download(self.old) for _ in range(3)]
+        self.assertEqual(rollups.rollup_downloads(batch_size=2, settle_seconds=60), 3)
+        self.assertEqual(RollupWatermark.objects.get(name=rollups.DOWNLOADS).last_id, rows[-1].pk)
+
+        self.assertEqual(rollups.rollup_downloads(settle_seconds=60), 0)
+        stats = PaperStats.objects.get(paper=self.paper)
+        self.assertEqual(stats.downloads, 3)
+        self.assertEqual(stats.last_download_at, self.old)
+        self.assertEqual(PaperDailyStats.objects.get(paper=self.paper).downloads, 3)
+
+    def test_watermark_waits_for_unsettled_downloads(self):
+        recent = self.download(timezone.now())
+        later = self.download(self.old)
+        # A lower id that is still settling holds back every row after it
+        self.assertEqual(rollups.rollup_downloads(settle_seconds=60), 0)
+        self.assertEqual(RollupWatermark.objects.get(name=rollups.DOWNLOADS).last_id, 0)
+
+        DownloadHistory.objects.filter(pk=recent.pk).update(downloaded_at=self.old)
+        self.assertEqual(rollups.rollup_downloads(settle_seconds=60), 2)
+        self.assertEqual(RollupWatermark.objects.get(name=rollups.DOWNLOADS).last_id, later.pk)
+        self.assertEqual(PaperStats.objects.get(paper=self.paper).downloads, 2)
+
+    def test_revenue_rolls_up_settled_orders_once(self):
+        settled = create_verified_order(self.paper)
+        Order.objects.filter(pk=settled.pk).update(verified_at=self.old)
+        create_verified_order(self.paper)
+        self.assertEqual(rollups.rollup_revenue(settle_seconds=60), 1)
+        self.assertEqual(rollups.rollup_revenue(settle_seconds=60), 0)
+        stats = PaperStats.objects.get(paper=self.paper)
+        self.assertEqual((stats.sales, stats.revenue), (1, self.paper.price))
+
+        self.assertEqual(rollups.rollup_revenue(settle_seconds=0), 1)
+        self.assertEqual(PaperStats.objects.get(paper=self.paper).sales, 2)
+
+
+# ====================================================================
+# CART
+# ====================================================================
+
+class CartTests(TestCase):
+    def add_papers(self, count):
+        for i in range(count):
+            paper = create_paper(f'Cart Paper {QuestionPaper.objects.count()}')
+            self.client.post(reverse('shop:cart_add', args=[paper.pk]), {'quantity': 1, 'override': False})
+
+    def page_queries(self, name):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_cart_pages_fetch_papers_once(self):
+        self.add_papers(1)
+        baseline = {name: self.page_queries(name) for name in ('shop:cart_detail', 'shop:checkout')}
+        self.add_papers(4)
+        for name, queries in baseline.items():
+            self.assertEqual(self.page_queries(name), queries, name)
+
+    def test_session_keeps_only_serializable_values(self):
+        self.add_papers(2)
+        self.client.get(reverse('shop:checkout'))
+        stored = self.client.session[settings.CART_SESSION_ID]
+        json.dumps(stored)
+        self.assertEqual({tuple(entry) for entry in stored.values()}, {('quantity', 'price')})
+
+    def test_deleted_papers_drop_out_of_the_cart(self):
+        self.add_papers(2)
+        paper = QuestionPaper.objects.first()
+        QuestionPaper.objects.filter(pk=paper.pk).delete()
+        response = self.client.get(reverse('shop:cart_detail'))
+        self.assertEqual(len(response.context['cart'].items()), 1)
+        self.assertNotIn(str(paper.pk), self.client.session[settings.CART_SESSION_ID])
+
+    def test_total_leaves_out_deleted_papers(self):
+        self.add_papers(2)
+        QuestionPaper.objects.filter(pk=QuestionPaper.objects.first().pk).delete()
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        cart = Cart(request)
+        self.assertEqual(cart.get_total_price(), Decimal('5'))
+        self.assertEqual(len(cart.items()), 1)
+
+
+# ====================================================================
+# SESSION WRITES
+# ====================================================================
+
+class SessionWriteTests(TestCase):
+    """Counts database writes for an anonymous visitor under each session engine."""
+
+    engines = [
+        'django.contrib.sessions.backends.db',
+        'django.contrib.sessions.backends.cached_db',
+        'django.contrib.sessions.backends.signed_cookies',
+    ]
+    browse = ['shop:class_list', 'shop:faq', 'shop:about', 'shop:cart_detail', 'shop:search_papers']
+
+    def setUp(self):
+        self.paper = create_paper('Session Paper')
+
+    def writes(self, request):
+        with CaptureQueriesContext(connection) as ctx:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return sum(1 for query in ctx.captured_queries
+                   if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')))
+
+    def test_browsing_writes_nothing_and_only_cart_changes_write(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine), override_settings(SESSION_ENGINE=engine):
+                client = Client()
+                browsing = sum(self.writes(lambda: client.get(reverse(name))) for name in self.browse)
+                self.assertEqual(browsing, 0)
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, client.cookies)
+
+                added = self.writes(lambda: client.post(reverse('shop:cart_add', args=[self.paper.pk]),
+                                                        {'quantity': 1, 'override': False}))
+                expected = 0 if engine.endswith('signed_cookies') else 1
+                self.assertEqual(added, expected)
+                # Browsing with a non-empty cart reads the session but never saves it
+                self.assertEqual(sum(self.writes(lambda: client.get(reverse(name))) for name in self.browse), 0)
+
+
+# ====================================================================
+# PAGE CACHE
+# ====================================================================
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['counters'].clear()
+        self.paper = create_paper('Cached Paper')
+        self.url = self.paper.get_absolute_url()
+
+    def get(self, client, url=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        first, _ = self.get(Client())
+        second, queries = self.get(Client())
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('miss', 'hit'))
+        self.assertEqual(queries, 0)
+        self.assertIn('Cookie', second['Vary'])
+        self.assertEqual(page_cache.stats()['paper_detail']['hit'], 1)
+        # Hits still count as views
+        view_counter.flush()
+        self.paper.refresh_from_db()
+        self.assertEqual(self.paper.views, 2)
+
+    def test_catalog_bump_retires_cached_pages(self):
+        self.get(Client(), reverse('shop:class_list'))
+        bump_catalog_version()
+        response, _ = self.get(Client(), reverse('shop:class_list'))
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+
+    def test_cached_page_carries_a_working_csrf_token(self):
+        self.get(Client())
+        client = Client(enforce_csrf_checks=True)
+        response, _ = self.get(client)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        token = page_cache.CSRF_INPUT_RE.search(response.content.decode()).group(1)
+        self.assertNotEqual(token, page_cache.CSRF_PLACEHOLDER)
+        response = client.post(reverse('shop:cart_add', args=[self.paper.pk]),
+                               {'quantity': 1, 'override': False, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_cart_contents_and_logins_bypass_the_cache(self):
+        self.get(Client())
+        shopper = Client()
+        shopper.post(reverse('shop:cart_add', args=[self.paper.pk]), {'quantity': 1, 'override': False})
+        self.assertNotIn('X-Page-Cache', self.get(shopper)[0])
+
+        staff = Client()
+        staff.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        self.assertNotIn('X-Page-Cache', self.get(staff)[0])
+        counts = staff.get(reverse('shop:page_cache_stats')).json()['views']['paper_detail']
+        self.assertEqual((counts['miss'], counts['hit'], counts['bypass']), (1, 0, 2))
+
+
+# ====================================================================
+# PAPER CARD FRAGMENTS
+# ====================================================================
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.papers = [create_paper(f'Algebra {i}', slug=f'algebra-{i}') for i in range(4)]
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(ctx.captured_queries)
+
+    def test_listings_render_cards_once(self):
+        get_catalog_snapshot()
+        # all_papers joins the card fields into its page query; subject_papers_list loads misses in one extra query
+        for name, args, misses in (('all_papers', [], 0), ('subject_papers_list', ['jhs-1', 'term-1', 'mathematics'], 1)):
+            url = reverse(f'shop:{name}', args=args)
+            first, cold = self.get(url)
+            second, warm = self.get(url)
+            self.assertEqual(first, second)
+            self.assertEqual(warm, 1)
+            self.assertEqual(cold, 1 + misses)
+            self.assertEqual(second.count(self.papers[0].get_absolute_url()), 1)
+
+    def test_saving_a_paper_replaces_its_card(self):
+        url = reverse('shop:all_papers')
+        self.get(url)
+        self.papers[0].title = 'Geometry'
+        self.papers[0].save()
+        content, _ = self.get(url)
+        self.assertIn('Geometry', content)
+
+    def test_search_cards_share_fragments_but_not_highlights(self):
+        search.rebuild_index()
+        first, _ = self.get(reverse('shop:search_papers') + '?q=algebra')
+        self.assertIn('<mark>Algebra</mark>', first)
+        second, _ = self.get(reverse('shop:search_papers') + '?q=alg')
+        self.assertIn('<mark>Algebra</mark>', second)
+        self.assertNotIn('<!--slot:', second)
+
+
+# ====================================================================
+# CANONICAL PAPER PATHS
+# ====================================================================
+
+class CanonicalPathTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.paper = create_paper('Algebra', slug='algebra')
+
+    def test_path_and_label_are_stored_on_save(self):
+        self.assertEqual(self.paper.canonical_path, '/jhs-1/term-1/mathematics/algebra/')
+        self.assertEqual(self.paper.display_label, 'JHS 1 - Term 1 - Mathematics (Algebra)')
+        papers = list(QuestionPaper.objects.only('canonical_path', 'display_label'))
+        with self.assertNumQueries(0):
+            self.assertEqual([(p.get_absolute_url(), str(p)) for p in papers],
+                             [(self.paper.canonical_path, self.paper.display_label)])
+
+    def test_renaming_a_parent_recomputes_paths_in_bulk(self):
+        create_paper('Geometry', slug='geometry')
+        subject = Subject.objects.get(slug='mathematics')
+        subject.name, subject.slug = 'Maths', 'maths'
+        subject.save()
+        paths = set(QuestionPaper.objects.values_list('canonical_path', flat=True))
+        self.assertEqual(paths, {'/jhs-1/term-1/maths/algebra/', '/jhs-1/term-1/maths/geometry/'})
+        self.assertEqual(QuestionPaper.objects.get(slug='algebra').display_label, 'JHS 1 - Term 1 - Maths (Algebra)')
+
+    def test_stale_hierarchy_redirects_permanently(self):
+        response = Client().get('/jhs-1/term-1/old-subject/algebra/')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], self.paper.canonical_path)
+        self.assertEqual(Client().get(self.paper.canonical_path).status_code, 200)
+
+
+# ====================================================================
+# KEYSET LISTINGS
+# ====================================================================
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class KeysetListingTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.papers = [
+            create_paper(f'Paper {i}', slug=f'paper-{i}', year=2020 + i % 2, exam_type='mock' if i % 3 else 'cat',
+                         description='long text ' * 500)
+            for i in range(7)
+        ]
+        get_catalog_snapshot()
+
+    def walk(self, url):
+        """Follow the Next links; returns the papers seen and the queries each page ran."""
+        seen, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = Client().get(url)
+            self.assertEqual(response.status_code, 200)
+            queries.append(ctx.captured_queries)
+            page = response.context['page']
+            seen.extend(p.pk for p in page)
+            url = f"{response.request['PATH_INFO']}?after={page.next_cursor}" if page.has_next else None
+        return seen, queries
+
+    @mock.patch('shop.listings.LISTING_PAGE_SIZE', 2)
+    def test_pages_cover_every_paper_once_with_constant_queries(self):
+        for name, args, expected in (
+            ('all_papers', [], [p.pk for p in reversed(self.papers)]),
+            ('papers_by_year', [2021], [p.pk for p in reversed(self.papers) if p.year == 2021]),
+            ('papers_by_type', ['mock'], [p.pk for p in reversed(self.papers) if p.exam_type == 'mock']),
+        ):
+            with self.subTest(name):
+                seen, queries = self.walk(reverse(f'shop:{name}', args=args))
+                self.assertEqual(seen, expected)
+                self.assertGreater(len(queries), 1)
+                self.assertEqual(len({len(q) for q in queries}), 1)
+                listing_sql = [q['sql'] for page in queries for q in page if '"shop_questionpaper"."title"' in q['sql']]
+                self.assertTrue(listing_sql)
+                self.assertTrue(all('"description"' not in sql and 'INNER JOIN' in sql for sql in listing_sql))
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        response = Client().get(reverse('shop:all_papers') + '?after=not-a-cursor')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['page'].is_first)
+
+    def test_unknown_exam_type_is_404(self):
+        self.assertEqual(Client().get(reverse('shop:papers_by_type', args=['essay'])).status_code, 404)
+
+    def test_year_stats_count_the_whole_listing(self):
+        response = Client().get(reverse('shop:papers_by_year', args=[2020]))
+        self.assertEqual(response.context['total_count'], 4)
+        self.assertEqual(response.context['other_years'], [2021])
+
+
+# ====================================================================
+# FACETED BROWSING
+# ====================================================================
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class FacetedBrowseTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        science = Subject.objects.create(name='Science', slug='science')
+        for i in range(12):
+            create_paper(f'Paper {i}', slug=f'paper-{i}', year=2020 + i % 3, exam_type=('mock', 'cat')[i % 2],
+                         subject=science if i % 4 == 0 else None, is_paid=i % 5 != 0)
+        get_catalog_snapshot()
+
+    def browse(self, query=''):
+        with CaptureQueriesContext(connection) as ctx:
+            response = Client().get(reverse('shop:browse_papers') + query)
+        self.assertEqual(response.status_code, 200)
+        facets = {f['param']: {o['label']: o['count'] for o in f['options']} for f in response.context['facets']}
+        return response, facets, len(ctx.captured_queries)
+
+    def test_counts_match_per_value_queries(self):
+        self.browse()
+        response, facets, queries = self.browse('?year=2021&type=mock&price=paid')
+        # The cube is cached, so only the listing itself hits the database
+        self.assertEqual(queries, 1)
+        base = QuestionPaper.objects.filter(is_available=True)
+        self.assertEqual(response.context['total_count'], base.filter(year=2021, exam_type='mock', is_paid=True).count())
+        # Each facet is counted under the other facets' filters only
+        self.assertEqual(facets['year'], {
+            str(y): base.filter(year=y, exam_type='mock', is_paid=True).count()
+            for y in (2020, 2021, 2022) if base.filter(year=y, exam_type='mock', is_paid=True).exists()
+        })
+        self.assertEqual(facets['price'], {
+            'Free': base.filter(year=2021, exam_type='mock', is_paid=False).count(),
+            'Paid': base.filter(year=2021, exam_type='mock', is_paid=True).count(),
+        })
+        self.assertEqual(facets['subject']['Science'], base.filter(year=2021, exam_type='mock', is_paid=True, subject__slug='science').count())
+        self.assertEqual(sorted(p.paper.pk for p in response.context['cards']),
+                         sorted(base.filter(year=2021, exam_type='mock', is_paid=True).values_list('pk', flat=True)))
+
+    def test_values_within_a_facet_are_ored(self):
+        response, _, _ = self.browse('?subject=science&subject=mathematics&year=2020&year=2022')
+        self.assertEqual(response.context['total_count'], QuestionPaper.objects.filter(year__in=[2020, 2022]).count())
+
+    def test_options_toggle_their_value(self):
+        response, _, _ = self.browse('?year=2020')
+        years = next(f for f in response.context['facets'] if f['param'] == 'year')['options']
+        selected = next(o for o in years if o['selected'])
+        self.assertEqual(selected['query'], '')
+        self.assertEqual(next(o for o in years if o['label'] == '2021')['query'], 'year=2020&year=2021')
+
+    def test_partial_save_of_a_facet_field_refreshes_counts(self):
+        _, before, _ = self.browse()
+        paper = QuestionPaper.objects.get(slug='paper-1')
+        paper.year = 2019
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.save(update_fields=['year'])
+        _, after, _ = self.browse()
+        self.assertNotIn('2019', before['year'])
+        self.assertEqual(after['year']['2019'], 1)
+
+
+# ====================================================================
+# TYPEAHEAD
+# ====================================================================
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        create_paper('Algebra Basics', slug='algebra-basics')
+        create_paper('Algorithms', slug='algorithms', subject=Subject.objects.create(name='Computing', slug='computing'))
+        create_paper('Hidden', slug='hidden', is_available=False)
+
+    def suggest(self, q):
+        response = Client().get(reverse('shop:search_suggest'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [label for label, url, kind in response.json()['r']]
+
+    def test_prefixes_match_any_word_and_rank_classes_and_subjects_first(self):
+        self.assertEqual(self.suggest('alg'), ['Algebra Basics · Mathematics, JHS 1', 'Algorithms · Computing, JHS 1'])
+        self.assertEqual(self.suggest('ma'), ['Mathematics', 'Algebra Basics · Mathematics, JHS 1'])
+        self.assertEqual(self.suggest('jhs alg comp'), ['Algorithms · Computing, JHS 1'])
+        self.assertEqual(self.suggest('JHS')[0], 'JHS 1')
+        self.assertEqual(self.suggest('hidden'), [])
+        self.assertEqual(self.suggest('  '), [])
+
+    def test_answers_from_memory_and_rebuilds_on_catalog_change(self):
+        self.suggest('alg')
+        with self.assertNumQueries(0):
+            self.suggest('algebra')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_paper('Alchemy', slug='alchemy')
+        self.assertIn('Alchemy · Mathematics, JHS 1', self.suggest('alc'))
+
+    def test_urls_point_at_the_suggested_pages(self):
+        response = Client().get(reverse('shop:search_suggest'), {'q': 'algebra'})
+        label, url, kind = response.json()['r'][0]
+        self.assertEqual((url, kind), (QuestionPaper.objects.get(slug='algebra-basics').get_absolute_url(), 'p'))
+
+
+
+# ====================================================================
+# PDF CONTENT SEARCH
+# ====================================================================
+
+class PdfTextTests(TransactionTestCase):
+    def setUp(self):
+        use_temp_storage(self)
+        caches['default'].clear()
+
+    def create_pdf_paper(self, title, texts):
+        paper = create_paper(title, slug=slugify(title), pdf_file='')
+        paper.pdf_file.save(f'{title}.pdf', ContentFile(make_pdf(texts=texts)))
+        pdf_metadata.extract_paper(paper.pk)
+        return paper
+
+    def run_command(self):
+        out = io.StringIO()
+        call_command('extract_pdf_text', '--workers', '2', stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_pages_are_indexed_once_per_content_hash(self):
+        biology = self.create_pdf_paper('Biology', ['Cells and tissues', 'Photosynthesis in green plants'])
+        self.create_pdf_paper('Biology Copy', ['Cells and tissues', 'Photosynthesis in green plants'])
+        sample = FreeSample.objects.create(question_paper=self.create_pdf_paper('Maths', ['Fractions']))
+        sample.sample_pdf.save('sample.pdf', ContentFile(make_pdf(texts=['Solve the simultaneous equations'])))
+
+        self.assertIn('Indexed 3 new PDFs', self.run_command())
+        self.assertEqual(PdfDocument.objects.count(), 3)
+        # Nothing changed, so nothing is downloaded or parsed again
+        self.assertIn('Every PDF already has its text indexed', self.run_command())
+
+        hits = pdf_text.search_content('photosynth')
+        self.assertEqual([(h.paper.title, h.page_number, h.in_sample) for h in hits],
+                         [('Biology', 2, False), ('Biology Copy', 2, False)])
+        # Paid papers' own text is never quoted
+        self.assertEqual(hits[0].snippet, '')
+        hits = pdf_text.search_content('simultaneous equations')
+        self.assertEqual([(h.paper.title, h.in_sample) for h in hits], [('Maths', True)])
+        self.assertIn('<mark>simultaneous</mark>', hits[0].snippet)
+
+        # A replaced file is re-parsed; unavailable papers drop out of the hits
+        biology.pdf_file.save('Biology v2.pdf', ContentFile(make_pdf(texts=['Respiration'])))
+        pdf_metadata.extract_paper(biology.pk)
+        self.assertIn('Indexed 1 new PDFs', self.run_command())
+        self.assertEqual([h.paper.title for h in pdf_text.search_content('respiration')], ['Biology'])
+        QuestionPaper.objects.filter(pk=biology.pk).update(is_available=False)
+        self.assertEqual(pdf_text.search_content('respiration'), [])
+
+    def test_search_page_shows_content_snippets(self):
+        free = self.create_pdf_paper('Biology', ['Photosynthesis in green plants'])
+        QuestionPaper.objects.filter(pk=free.pk).update(is_paid=False, price=0)
+        self.create_pdf_paper('Chemistry', ['Cover page', 'Photosynthesis and the carbon cycle'])
+        self.run_command()
+        response = Client().get(reverse('shop:search_papers'), {'q': 'photosynthesis'})
+        self.assertContains(response, 'Found inside papers')
+        self.assertContains(response, '<mark>Photosynthesis</mark> in green plants')
+        self.assertContains(response, 'Page 2')
+        self.assertNotContains(response, 'carbon cycle')
+        self.assertNotContains(response, 'No Results Found')
+
+
+# ====================================================================
+# PREVIEWS
+# ====================================================================
+
+class PreviewTests(TransactionTestCase):
+    def setUp(self):
+        self.storage_dir = use_temp_storage(self)
+        caches['default'].clear()
+
+    def create_pdf_paper(self, title, texts):
+        paper = create_paper(title, slug=slugify(title), pdf_file='')
+        paper.pdf_file.save(f'{title}.pdf', ContentFile(make_pdf(texts=texts)))
+        pdf_metadata.extract_paper(paper.pk)
+        return QuestionPaper.objects.get(pk=paper.pk)
+
+    def run_command(self):
+        out = io.StringIO()
+        call_command('render_previews', '--workers', '2', stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_thumbnails_are_rendered_once_per_content_hash(self):
+        biology = self.create_pdf_paper('Biology', ['Cells', 'Tissues', 'Organs'])
+        copy = self.create_pdf_paper('Biology Copy', ['Cells', 'Tissues', 'Organs'])
+        self.assertIsNone(biology.thumbnail_url)
+
+        self.assertIn('Rendered 1 PDFs', self.run_command())
+        biology.refresh_from_db()
+        copy.refresh_from_db()
+        self.assertEqual(len(biology.thumbnail_names), previews.PREVIEW_PAGES)
+        self.assertEqual(biology.thumbnail_urls, copy.thumbnail_urls)
+        self.assertEqual(biology.thumbnail_url, reverse('shop:preview_image', args=['paper', biology.content_hash, 1]))
+        self.assertTrue(os.path.exists(os.path.join(self.storage_dir, biology.thumbnail_names[0])))
+        self.assertIn('Every PDF already has its previews', self.run_command())
+
+        # A replaced file hides the stale thumbnail until its own is rendered
+        biology.pdf_file.save('Biology v2.pdf', ContentFile(make_pdf(texts=['Respiration'])))
+        pdf_metadata.extract_paper(biology.pk)
+        biology.refresh_from_db()
+        self.assertIsNone(biology.thumbnail_url)
+        self.assertIn('Rendered 1 PDFs', self.run_command())
+        biology.refresh_from_db()
+        self.assertEqual(len(biology.thumbnail_names), 1)
+
+    def test_sample_previews_are_watermarked_and_small(self):
+        from PIL import Image
+        paper = self.create_pdf_paper('Maths', ['Fractions'])
+        sample = FreeSample.objects.create(question_paper=paper)
+        sample.sample_pdf.save('sample.pdf', ContentFile(make_pdf(pages=3)))
+        self.run_command()
+        sample.refresh_from_db()
+        self.assertEqual(len(sample.preview_urls), previews.PREVIEW_PAGES)
+
+        path = os.path.join(self.storage_dir, sample.preview_names[0])
+        with Image.open(path) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.width, previews.SAMPLE_PREVIEW_WIDTH)
+            # A blank page only stays white where the watermark is not drawn
+            self.assertLess(min(image.convert('L').getdata()), 245)
+
+        response = Client().get(paper.get_absolute_url())
+        self.assertContains(response, 'Free Sample Preview')
+        self.assertContains(response, sample.preview_urls[0])
+
+    def test_preview_images_are_cached_as_immutable(self):
+        paper = self.create_pdf_paper('Biology', ['Cells'])
+        self.run_command()
+        paper.refresh_from_db()
+        url = reverse('shop:preview_image', args=['paper', paper.content_hash, 1])
+        self.assertEqual(paper.thumbnail_url, url)
+        response = Client().get(url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        with open(os.path.join(self.storage_dir, paper.thumbnail_names[0]), 'rb') as fh:
+            self.assertEqual(b''.join(response.streaming_content), fh.read())
+
+        # Remote storage URLs are linked directly; the view only redirects older links there
+        with mock.patch('shop.previews.local_path', return_value=None):
+            storage_url = default_storage.url(paper.thumbnail_names[0])
+            self.assertEqual(paper.thumbnail_url, storage_url)
+            response = Client().get(url)
+        self.assertRedirects(response, storage_url, fetch_redirect_response=False)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        self.assertEqual(Client().get(url.replace('/1.webp', '/2.webp')).status_code, 404)
+        missing = reverse('shop:preview_image', args=['paper', '0' * 64, 1])
+        self.assertEqual(Client().get(missing).status_code, 404)
+        self.assertEqual(Client().get(url.replace('/paper/', '/other/')).status_code, 404)
+
+    def test_failing_pdfs_back_off(self):
+        paper = self.create_pdf_paper('Biology', ['Cells'])
+        with mock.patch('shop.management.commands.render_previews.save_images', side_effect=OSError('storage down')):
+            self.assertIn('Rendered 0 PDFs (0 reused stored images, 1 failed)', self.run_command())
+            failure = PdfJobFailure.objects.get(task='previews', source=paper.pdf_file.name)
+            self.assertEqual((failure.attempts, failure.last_error), (1, 'OSError: storage down'))
+
+            # Not downloaded again until the delay has passed, then the delay doubles
+            self.assertIn('Every PDF already has its previews', self.run_command())
+            PdfJobFailure.objects.update(retry_at=timezone.now())
+            self.assertIn('1 failed', self.run_command())
+        failure.refresh_from_db()
+        self.assertEqual(failure.attempts, 2)
+        delay = (failure.retry_at - failure.updated_at).total_seconds()
+        self.assertAlmostEqual(delay, 2 * settings.PDF_JOB_RETRY_DELAY, delta=5)
+
+        PdfJobFailure.objects.update(retry_at=timezone.now())
+        self.assertIn('Rendered 1 PDFs', self.run_command())
+        self.assertFalse(PdfJobFailure.objects.exists())
+
+    def test_names_chosen_by_storage_are_recorded(self):
+        self.storage_dir = use_temp_storage(self, backend='shop.tests.RenamingStorage')
+        paper = self.create_pdf_paper('Biology', ['Cells', 'Tissues'])
+        self.run_command()
+        paper.refresh_from_db()
+        name = paper.thumbnail_names[0]
+        self.assertNotEqual(name, previews.preview_name('paper', paper.content_hash, 1))
+        self.assertTrue(os.path.exists(os.path.join(self.storage_dir, name)))
+        response = Client().get(paper.thumbnail_url)
+        with open(os.path.join(self.storage_dir, name), 'rb') as fh:
+            self.assertEqual(b''.join(response.streaming_content), fh.read())
+
+        # A second paper with the same bytes reuses the recorded names without rendering
+        copy = self.create_pdf_paper('Biology Copy', ['Cells', 'Tissues'])
+        self.assertIn('Every PDF already has its previews (1 papers reused', self.run_command())
+        copy.refresh_from_db()
+        self.assertEqual(copy.thumbnail_names, paper.thumbnail_names)
+
+
+# ====================================================================
+# PROTECTED PDFS
+# ====================================================================
+
+@override_settings(DOWNLOAD_SERVE_MODE='stream', DOWNLOAD_BUFFER_ENABLED=False)
+class ProtectedPdfTests(TransactionTestCase):
+    def setUp(self):
+        use_temp_storage(self)
+        caches['default'].clear()
+
+    def create_pdf_paper(self, title, **kwargs):
+        paper = create_paper(title, slug=slugify(title), pdf_file='', **kwargs)
+        paper.pdf_file.save(f'{title}.pdf', ContentFile(make_pdf(texts=['Question 1'])))
+        pdf_metadata.extract_paper(paper.pk)
+        return QuestionPaper.objects.get(pk=paper.pk)
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('encrypt_papers', '--workers', '2', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def download(self, paper):
+        response = Client().get(self.download_url(paper))
+        self.assertEqual(response.status_code, 200)
+        return PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+
+    def download_url(self, paper):
+        return download_links.order_download_urls(create_verified_order(paper))[paper.pk]
+
+    def test_downloads_switch_to_the_encrypted_copy(self):
+        paper = self.create_pdf_paper('Biology')
+        # Until the worker has run, the uploaded file is sent as before
+        with self.assertLogs('shop.downloads', 'WARNING'):
+            self.assertFalse(self.download(paper).is_encrypted)
+
+        self.assertIn('Encrypted 1 PDFs', self.run_command())
+        paper.refresh_from_db()
+        reader = self.download(paper)
+        self.assertTrue(reader.is_encrypted)
+        self.assertEqual(reader.trailer['/Encrypt']['/V'], 5)  # AES-256
+        self.assertFalse(reader.decrypt('INSIGHT_WRONG'))
+        self.assertTrue(reader.decrypt(paper.password))
+        self.assertIn('Question 1', reader.pages[0].extract_text())
+        self.assertEqual(paper.downloads.count(), 2)
+
+        # Same file and password: the stored copy is reused without downloading
+        self.create_pdf_paper('Biology Copy', password=paper.password)
+        self.assertIn('1 reused stored copies', self.run_command())
+        self.assertEqual(QuestionPaper.objects.get(slug='biology-copy').protected_pdf_name, paper.protected_pdf_name)
+
+    @override_settings(PROTECTED_PDF_WAIT=True)
+    def test_downloads_can_wait_for_the_encrypted_copy(self):
+        paper = self.create_pdf_paper('Biology')
+        response = Client().get(self.download_url(paper))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+        self.run_command()
+        self.assertTrue(self.download(paper).is_encrypted)
+
+    def test_names_chosen_by_storage_are_recorded(self):
+        storage_dir = use_temp_storage(self, backend='shop.tests.RenamingStorage')
+        paper = self.create_pdf_paper('Biology')
+        self.run_command()
+        paper.refresh_from_db()
+        name = paper.protected_pdf_name
+        self.assertNotEqual(name, protected_pdfs.artifact_name(paper.content_hash, paper.password))
+        self.assertTrue(os.path.exists(os.path.join(storage_dir, name)))
+        self.assertTrue(self.download(paper).decrypt(paper.password))
+
+        self.create_pdf_paper('Biology Copy', password=paper.password)
+        self.assertIn('1 reused stored copies', self.run_command())
+        self.assertEqual(QuestionPaper.objects.get(slug='biology-copy').protected_pdf_name, name)
+
+    def test_rotation_re_encrypts_with_the_new_password(self):
+        biology = self.create_pdf_paper('Biology')
+        maths = self.create_pdf_paper('Maths')
+        self.run_command()
+        biology.refresh_from_db()
+        old_name = biology.protected_pdf_name
+        self.assertIsNotNone(old_name)
+        buyer = create_verified_order(biology, maths, phone_number='0207654321')
+        url = download_links.order_download_urls(buyer)[biology.pk]
+
+        self.assertIn('Rotated the passwords of 1 papers', self.run_command('--rotate-passwords', '--paper', 'biology'))
+        rotated = QuestionPaper.objects.get(pk=biology.pk)
+        self.assertNotEqual(rotated.password, biology.password)
+        self.assertNotEqual(rotated.protected_pdf_name, old_name)
+        self.assertFalse(self.download(rotated).decrypt(biology.password))
+        self.assertTrue(self.download(rotated).decrypt(rotated.password))
+        self.assertEqual(QuestionPaper.objects.get(pk=maths.pk).password, maths.password)
+
+        # The earlier buyer is texted the new password, which opens what their link now sends
+        sms = SmsMessage.objects.get(order=buyer)
+        self.assertEqual(sms.phone_number, '+233207654321')
+        self.assertIn(f'Biology: {rotated.password}', sms.content)
+        self.assertNotIn('Maths', sms.content)
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        reader = PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertTrue(reader.decrypt(sms.content.split('Biology: ')[1].split('\n')[0]))
+
+
+# ====================================================================
+# SIGNED DOWNLOAD LINKS
+# ====================================================================
+
+@override_settings(DOWNLOAD_SERVE_MODE='stream', DOWNLOAD_BUFFER_ENABLED=False, PROTECTED_PDF_DELIVERY=False)
+class DownloadLinkTests(TestCase):
+    def setUp(self):
+        use_temp_storage(self)
+        caches['default'].clear()
+        self.body = make_pdf(pages=2)
+        self.paper = create_paper('Linked', pdf_file='')
+        self.paper.pdf_file.save('linked.pdf', ContentFile(self.body))
+        self.order = create_verified_order(self.paper)
+        self.url = download_links.order_download_urls(self.order)[self.paper.pk]
+
+    def selects(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q for q in ctx.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+
+    def test_paid_papers_need_a_signed_link(self):
+        response = self.client.get(reverse('shop:download_file', args=[self.paper.slug]))
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(list(self.paper.downloads.values_list('order_id', flat=True)), [self.order.pk])
+
+        response = self.client.get(reverse('shop:order_callback'), {'reference': self.order.ref})
+        self.assertContains(response, self.url)
+
+    def test_tampered_and_expired_tokens_are_rejected_without_queries(self):
+        token = self.url.rstrip('/').rsplit('/', 1)[-1]
+        order_id, paper_id, expires, signature = token.split('.')
+        other = create_paper('Other')
+        expired = download_links.make_token(self.order.pk, self.paper.pk, time.time() - 1)
+        for bad in (f'{order_id}.{other.pk}.{expires}.{signature}', expired, 'garbage'):
+            response, selects = self.selects(reverse('shop:signed_download', args=[bad]))
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(selects, [])
+        link = download_links.read_token(token)
+        self.assertEqual((link.order_id, link.paper_id), (self.order.pk, self.paper.pk))
+        self.assertAlmostEqual(link.expires, self.order.verified_at.timestamp() + settings.DOWNLOAD_LINK_TTL, delta=1)
+
+    def test_signed_storage_urls_are_cached_until_they_expire(self):
+        signed = 'https://storage.example.com/linked.pdf?signature=abc'
+        with mock.patch.object(download_links, 'sign_storage_url', return_value=signed) as sign:
+            response = self.client.get(self.url)
+            self.assertRedirects(response, signed, fetch_redirect_response=False)
+            # Repeat downloads: no re-signing and no database reads
+            response, selects = self.selects(self.url)
+            self.assertRedirects(response, signed, fetch_redirect_response=False)
+            self.assertEqual(selects, [])
+            self.assertEqual(sign.call_count, 1)
+            self.assertEqual(self.paper.downloads.count(), 2)
+
+            # A new file drops the cached URL
+            with self.captureOnCommitCallbacks(execute=True):
+                self.paper.pdf_file.save('linked-v2.pdf', ContentFile(self.body))
+            self.client.get(self.url)
+            self.assertEqual(sign.call_count, 2)
+
+
+# ====================================================================
+# ENTITLEMENTS
+# ====================================================================
+
+class EntitlementTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def owned(self, **identity):
+        return entitlements.owned_paper_ids(entitlements.buyer_identities(**identity))
+
+    def test_verification_entitles_every_buyer_identity_once(self):
+        user = User.objects.create_user('buyer', 'Buyer@Example.com', 'pw')
+        paper = create_paper('Owned')
+        order = Order.objects.create(user=user, email='Buyer@Example.com', phone_number='024 123 4567', total_amount=5)
+        OrderItem.objects.create(order=order, paper=paper, price=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(fulfillment.verify_and_fulfill(order))
+            self.assertFalse(fulfillment.verify_and_fulfill(order))
+        self.assertEqual(set(Entitlement.objects.values_list('identity', flat=True)),
+                         {f'user:{user.pk}', 'email:buyer@example.com', 'phone:+233241234567'})
+        self.assertEqual(self.owned(email=' buyer@example.COM'), {paper.pk})
+        self.assertEqual(self.owned(phone='0241234567'), {paper.pk})
+        self.assertEqual(self.owned(email='someone@example.com'), set())
+
+    def test_backfill_reads_orders_and_legacy_payments_in_batches(self):
+        papers = [create_paper(f'Paper {i}') for i in range(3)]
+        for i, paper in enumerate(papers):
+            create_verified_order(paper, email=f'buyer{i}@example.com')
+        Order.objects.create(email='unpaid@example.com', phone_number='0241234567', total_amount=5)
+        Payment.objects.create(question_paper=papers[0], email='legacy@example.com', verified=True)
+        Payment.objects.create(question_paper=papers[1], email='legacy@example.com', verified=False)
+
+        for _ in range(2):
+            out = io.StringIO()
+            call_command('backfill_entitlements', '--batch-size', '2', stdout=out)
+            self.assertIn('Backfilled 3 verified orders', out.getvalue())
+            self.assertIn('Backfilled 1 verified payments', out.getvalue())
+            self.assertEqual(Entitlement.objects.count(), 3 * 2 + 1)
+        self.assertEqual(self.owned(email='legacy@example.com'), {papers[0].pk})
+        self.assertEqual(self.owned(email='buyer2@example.com'), {papers[2].pk})
+
+    def test_admin_verification_grants_and_revokes_payments(self):
+        paper, other = create_paper('Legacy'), create_paper('Other')
+        first = Payment.objects.create(question_paper=paper, email='legacy@example.com')
+        second = Payment.objects.create(question_paper=paper, email='legacy@example.com', phone_number='0241234567')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        url = reverse('admin:shop_payment_changelist')
+
+        # The action runs on a filtered changelist, which no longer matches once updated
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{url}?verified__exact=0',
+                             {'action': 'mark_as_verified', '_selected_action': [first.pk, second.pk]})
+        self.assertEqual(Payment.objects.filter(verified=True).count(), 2)
+        self.assertEqual(self.owned(email='legacy@example.com'), {paper.pk})
+        self.assertEqual(self.owned(phone='0241234567'), {paper.pk})
+
+        # The second payment still covers the email after the first is withdrawn
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'action': 'mark_as_unverified', '_selected_action': [first.pk]})
+        self.assertEqual(self.owned(email='legacy@example.com'), {paper.pk})
+        self.assertEqual(Entitlement.objects.get(identity='email:legacy@example.com').payment_id, second.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'action': 'mark_as_unverified', '_selected_action': [second.pk]})
+        self.assertEqual(self.owned(email='legacy@example.com'), set())
+        self.assertFalse(Entitlement.objects.exists())
+
+        # Ticking the editable column goes through save_model
+        third = Payment.objects.create(question_paper=other, email='edited@example.com')
+        payments = list(Payment.objects.order_by('-date_created', '-pk'))
+        form = {'form-TOTAL_FORMS': len(payments), 'form-INITIAL_FORMS': len(payments), '_save': 'Save'}
+        for i, payment in enumerate(payments):
+            form[f'form-{i}-id'] = payment.pk
+            if payment.pk == third.pk:
+                form[f'form-{i}-verified'] = 'on'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, form)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.owned(email='edited@example.com'), {other.pk})
+
+    def test_listings_badge_purchases_with_one_cached_lookup(self):
+        owned = create_paper('Owned', is_paid=False, price=0)
+        create_paper('Not Owned')
+        self.client.post(reverse('shop:cart_add', args=[owned.pk]), {'quantity': 1, 'override': False})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('shop:checkout'), {'email': 'anon@example.com', 'phone_number': '0241234567'})
+        self.assertEqual(Entitlement.objects.filter(paper=owned).count(), 2)
+
+        url = reverse('shop:all_papers')
+        self.assertContains(self.client.get(url), '>Purchased</span>', count=1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertContains(self.client.get(url), '>Purchased</span>', count=1)
+        self.assertFalse([q for q in ctx.captured_queries if 'shop_entitlement' in q['sql']])
+        # Other visitors share the cached page and cards, without the badge
+        self.assertNotContains(Client().get(url), '>Purchased</span>')
+        self.assertNotContains(Client().get(url), '>Purchased</span>')
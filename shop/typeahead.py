@@ -0,0 +1,111 @@
+# shop/typeahead.py
+
+import bisect
+import heapq
+import re
+import threading
+from functools import lru_cache
+from django.urls import reverse
+from .catalog import get_catalog_snapshot, get_catalog_version
+
+MAX_SUGGESTIONS = 8
+MAX_QUERY_LENGTH = 100
+WORD_RE = re.compile(r'\w+')
+
+# Suggestion kinds, in the order they rank
+CLASS, SUBJECT, PAPER = 'c', 's', 'p'
+
+
+def words(text):
+    return WORD_RE.findall(text.casefold())
+
+
+class PrefixIndex:
+    """Sorted word list over catalog labels, answering prefix queries with bisect.
+
+    Suggestions are numbered in rank order (classes, then subjects, then
+    papers by title), so the best matches for a query are simply the lowest
+    numbered ones. Answers are memoized per query; the index is immutable
+    and replaced wholesale when the catalog changes.
+    """
+
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        self.suggestion_words = [tuple(words(label)) for label, _, _ in suggestions]
+        postings = {}
+        for number, label_words in enumerate(self.suggestion_words):
+            for word in set(label_words):
+                postings.setdefault(word, []).append(number)
+        # Parallel arrays: sorted distinct words and their ascending suggestion numbers
+        self.keys = sorted(postings)
+        self.postings = [tuple(postings[word]) for word in self.keys]
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    def _matching(self, prefix):
+        """Suggestion numbers with a word starting with ``prefix``, ascending, possibly repeated."""
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+        return heapq.merge(*self.postings[start:end])
+
+    def _lookup(self, query, limit):
+        tokens = words(query)
+        if not tokens:
+            return ()
+        # Seek on the longest token (the narrowest range), then check the rest
+        tokens.sort(key=len, reverse=True)
+        rest = tokens[1:]
+        found, last = [], None
+        for number in self._matching(tokens[0]):
+            if number == last:
+                continue
+            last = number
+            label_words = self.suggestion_words[number]
+            if all(any(w.startswith(t) for w in label_words) for t in rest):
+                found.append(self.suggestions[number])
+                if len(found) == limit:
+                    break
+        return tuple(found)
+
+    def search(self, query, limit=MAX_SUGGESTIONS):
+        return self.lookup(query[:MAX_QUERY_LENGTH].casefold().strip(), limit)
+
+
+def build_index(snapshot):
+    """(label, url, kind) suggestions for every class, subject and reachable paper in ``snapshot``."""
+    classes, subjects, papers = [], {}, []
+    for class_level in snapshot['classes']:
+        classes.append((class_level['name'], reverse('shop:term_list', args=[class_level['slug']]), CLASS))
+        for term in class_level['terms']:
+            for node in term['subjects']:
+                subject = node['subject']
+                subjects.setdefault(subject['slug'], (
+                    subject['name'], f"{reverse('shop:browse_papers')}?subject={subject['slug']}", SUBJECT,
+                ))
+                for paper in node['papers']:
+                    url = reverse('shop:paper_detail', args=[class_level['slug'], term['slug'], subject['slug'], paper['slug']])
+                    papers.append((f"{paper['title']} · {subject['name']}, {class_level['name']}", url, PAPER))
+    return PrefixIndex(sorted(classes) + sorted(subjects.values()) + sorted(papers))
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """This worker's index, rebuilt from the catalog snapshot when the catalog version moves."""
+    global _index, _index_version
+    version = get_catalog_version()
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = build_index(get_catalog_snapshot())
+                _index_version = version
+    return _index
+
+
+def suggest(query, limit=MAX_SUGGESTIONS):
+    return get_index().search(query, limit)
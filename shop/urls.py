@@ -15,9 +15,16 @@ urlpatterns = [
     path('checkout/', views.checkout, name='checkout'),
     path('order/callback/', views.order_callback, name='order_callback'),
 
+    # Downloads
+    path('download/<slug:paper_slug>/', views.download_file, name='download_file'),
+    path('download/link/<str:token>/', views.signed_download, name='signed_download'),
+    path('previews/<str:kind>/<str:content_hash>/<int:page>.webp', views.preview_image, name='preview_image'),
+
     # Search & Browse
     path('search/', views.search_papers, name='search_papers'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('papers/', views.all_papers, name='all_papers'),
+    path('papers/browse/', views.browse_papers, name='browse_papers'),
     path('papers/year/<int:year>/', views.papers_by_year, name='papers_by_year'),
     path('papers/type/<str:exam_type>/', views.papers_by_type, name='papers_by_type'),
     
@@ -32,11 +39,13 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('profile/', views.profile, name='profile'),
     path('history/', views.purchase_history, name='purchase_history'),
+    path('page-cache/stats/', views.page_cache_stats, name='page_cache_stats'),
 
     # Hierarchical Navigation (Keep at bottom)
     path('', views.class_list, name='class_list'),
     path('<slug:class_slug>/', views.term_list, name='term_list'),
     path('<slug:class_slug>/<slug:term_slug>/', views.subject_list, name='subject_list'),
+    path('<slug:class_slug>/<slug:term_slug>/<slug:subject_slug>/', views.subject_papers_list, name='subject_papers_list'),
     path('<slug:class_slug>/<slug:term_slug>/<slug:subject_slug>/<slug:paper_slug>/', 
          views.paper_detail, 
          name='paper_detail'),
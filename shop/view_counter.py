@@ -0,0 +1,132 @@
+# shop/view_counter.py
+
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+VIEW_KEY = 'shop:views:{}'
+
+
+def _cache():
+    return caches[getattr(settings, 'VIEW_COUNTER_CACHE', 'default')]
+
+
+def _key(paper_id):
+    return VIEW_KEY.format(paper_id)
+
+
+def _incr(cache, key, delta):
+    # add() then incr() so the first view of a paper does not race another worker
+    while True:
+        cache.add(key, 0, timeout=None)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            # Evicted between add() and incr(); seed it again
+            continue
+
+
+_dirty = set()
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_timer = None
+
+
+def record_view(paper_id):
+    """Count one view. The database is only touched when the pending views are flushed."""
+    global _timer
+    _incr(_cache(), _key(paper_id), 1)
+    with _lock:
+        _dirty.add(paper_id)
+        if _timer is None:
+            _timer = threading.Timer(getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 10), _flush_from_timer)
+            _timer.daemon = True
+            _timer.start()
+
+
+def pending_views(paper_id):
+    return max(_cache().get(_key(paper_id)) or 0, 0)
+
+
+def _claim(cache, keys):
+    """Move the pending counts for ``keys`` out of the cache.
+
+    Each count is taken with an atomic decr(), so views recorded while we
+    flush stay in the cache for the next run. When two flushers race for the
+    same key the loser only keeps what was still there and puts the rest back.
+    """
+    claimed = {}
+    for key, seen in cache.get_many(keys).items():
+        if not seen or seen <= 0:
+            continue
+        try:
+            remaining = cache.decr(key, seen)
+        except ValueError:
+            continue
+        owned = min(max(remaining + seen, 0), seen)
+        if owned < seen:
+            cache.incr(key, seen - owned)
+        if owned:
+            claimed[key] = owned
+    return claimed
+
+
+def flush_views(paper_ids):
+    """Write pending views for ``paper_ids`` as one ``F('views') + n`` UPDATE per distinct delta."""
+    from .models import QuestionPaper
+    cache = _cache()
+    keys = {_key(pk): pk for pk in paper_ids}
+    claimed = _claim(cache, list(keys))
+    by_delta = defaultdict(list)
+    for key, delta in claimed.items():
+        by_delta[delta].append(keys[key])
+    written = 0
+    for delta, ids in by_delta.items():
+        try:
+            QuestionPaper.objects.filter(pk__in=ids).update(views=F('views') + delta)
+            written += delta * len(ids)
+        except Exception:
+            logger.exception("Could not write %s views for papers %s; keeping them pending", delta, ids)
+            for pk in ids:
+                _incr(cache, _key(pk), delta)
+    return written
+
+
+def flush():
+    """Flush every paper this process has counted views for."""
+    global _timer
+    with _flush_lock:
+        with _lock:
+            if _timer is not None and _timer is not threading.current_thread():
+                _timer.cancel()
+            ids, _timer = list(_dirty), None
+            _dirty.clear()
+        if not ids:
+            return 0
+        return flush_views(ids)
+
+
+def flush_all(chunk_size=500):
+    """Flush pending views for every paper, whichever process counted them."""
+    from .models import QuestionPaper
+    ids = list(QuestionPaper.objects.values_list('id', flat=True))
+    return sum(flush_views(ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size))
+
+
+def _flush_from_timer():
+    try:
+        flush()
+    except Exception:
+        logger.exception("View counter flush failed")
+    finally:
+        close_old_connections()
+
+
+atexit.register(flush)
@@ -1,29 +1,46 @@
 # shop/views.py
 
+import hashlib
+import hmac
 import json
-import requests
 import logging
 import re
+import time
 from django import forms
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse, Http404
+from django.views.decorators.http import require_http_methods
+from django.http import FileResponse, JsonResponse, HttpResponse, Http404
 from django.urls import reverse
-from django.db import models
+from django.db import models, transaction
+from django.core.files.storage import default_storage
 from django.core.mail import send_mail
+from django.core.paginator import Paginator
 from django.db.models import Count
 from django.contrib.auth.models import User
 from django.contrib.auth import login as auth_login, authenticate, logout as auth_logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from .models import Classes, Term, Subject, QuestionPaper, Payment, DownloadHistory, Order, OrderItem, Profile
 from django.utils import timezone
-from .cart import Cart
+from .cart import get_cart
+from .catalog import get_catalog_snapshot
+from .downloads import ProtectedCopyNotReady, delivered_file, serve_paper_file
+from .fragments import render_paper_cards
+from .listings import get_listing_page, listing_queryset
+from .page_cache import cache_anonymous_page
+from .view_counter import record_view
+from . import download_links, entitlements, facets, gateways, page_cache, pdf_text, previews, search, typeahead
 from .forms import CartAddPaperForm, CheckoutForm
+from .fulfillment import verify_and_fulfill
 
 logger = logging.getLogger(__name__)
 
+SEARCH_RESULTS_PER_PAGE = 20
+
 # ====================================================================
 # AUTHENTICATION FORMS
 # ====================================================================
@@ -60,38 +77,6 @@ class ProfileUpdateForm(forms.ModelForm):
             'profile_picture': forms.FileInput(attrs={'class': 'form-control'}),
         }
 
-# ====================================================================
-# UTILITY FUNCTIONS
-# ====================================================================
-
-def format_ghana_phone(phone):
-    if not phone: return phone
-    clean_phone = re.sub(r'\D', '', str(phone))
-    if clean_phone.startswith('0') and len(clean_phone) == 10:
-        return f"+233{clean_phone[1:]}"
-    if clean_phone.startswith('233') and len(clean_phone) == 12:
-        return f"+{clean_phone}"
-    if len(clean_phone) >= 9 and not str(phone).startswith('+'):
-        return f"+{clean_phone}"
-    return phone
-
-def send_sms_fulfillment(phone_number, order_items):
-    if not settings.HTTPSMS_API_KEY: return False
-    to_phone = format_ghana_phone(phone_number)
-    from_phone = "+233542232515" 
-    headers = {"x-api-key": settings.HTTPSMS_API_KEY, "Content-Type": "application/json"}
-    results = []
-    for item in order_items:
-        payload = {
-            "content": f"Your password for {item.paper.title} is: {item.paper.password}. Thanks for using InsiightPrep!",
-            "to": to_phone, "from": from_phone
-        }
-        try:
-            res = requests.post("https://api.httpsms.com/v1/messages/send", headers=headers, json=payload, timeout=15)
-            results.append(res.status_code in [200, 201])
-        except: results.append(False)
-    return all(results)
-
 # ====================================================================
 # 1. AUTHENTICATION VIEWS
 # ====================================================================
@@ -148,8 +133,13 @@ def profile(request):
     else:
         form = ProfileUpdateForm(instance=profile)
     
-    # Get user's verified orders
-    orders = request.user.orders.filter(verified=True).order_by('-created_at')
+    # Get user's verified orders, with download links issued afresh for their owner
+    orders = list(request.user.orders.filter(verified=True).order_by('-created_at').prefetch_related('items__paper'))
+    expires = time.time() + settings.DOWNLOAD_LINK_TTL
+    for order in orders:
+        urls = download_links.order_download_urls(order, expires=expires)
+        for item in order.items.all():
+            item.download_url = urls[item.paper_id]
     return render(request, 'shop/profile.html', {'form': form, 'orders': orders, 'profile': profile})
 
 def purchase_history(request):
@@ -162,7 +152,7 @@ def purchase_history(request):
 # ====================================================================
 
 def cart_add(request, paper_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     paper = get_object_or_404(QuestionPaper, id=paper_id)
     form = CartAddPaperForm(request.POST)
     if form.is_valid():
@@ -171,17 +161,17 @@ def cart_add(request, paper_id):
     return redirect('shop:cart_detail')
 
 def cart_remove(request, paper_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     paper = get_object_or_404(QuestionPaper, id=paper_id)
     cart.remove(paper)
     return redirect('shop:cart_detail')
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     return render(request, 'shop/cart_detail.html', {'cart': cart})
 
 def checkout(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if not cart: return redirect('shop:class_list')
     
     total_price = cart.get_total_price()
@@ -189,33 +179,36 @@ def checkout(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            order = Order.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                email=form.cleaned_data['email'],
-                phone_number=form.cleaned_data['phone_number'],
-                total_amount=total_price
-            )
-            for item in cart:
-                OrderItem.objects.create(order=order, paper=item['paper'], price=item['price'])
+            with transaction.atomic():
+                order = Order.objects.create(
+                    user=request.user if request.user.is_authenticated else None,
+                    email=form.cleaned_data['email'],
+                    phone_number=form.cleaned_data['phone_number'],
+                    total_amount=total_price
+                )
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, paper=item['paper'], price=item['price']) for item in cart
+                ])
+            entitlements.remember_buyer(request, order.email, order.phone_number)
             
             # Handle Free Order (Total = 0)
             if total_price == 0:
-                order.verified = True
-                order.save()
-                send_sms_fulfillment(order.phone_number, order.items.all())
+                verify_and_fulfill(order)
                 cart.clear()
                 # Use redirect() with reverse and parameters correctly
                 return redirect(f"{reverse('shop:order_callback')}?reference={order.ref}")
 
             # Paystack API Call for Paid Orders
-            url = "https://api.paystack.co/transaction/initialize"
-            headers = {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}", "Content-Type": "application/json"}
             data = {
                 "email": order.email, "amount": order.amount_in_pesewas(),
                 "reference": str(order.ref), "callback_url": f"{request.scheme}://{request.get_host()}{reverse('shop:order_callback')}",
                 "channels": ["mobile_money"],
             }
-            res = requests.post(url, headers=headers, data=json.dumps(data)).json()
+            try:
+                res = gateways.paystack_initialize(data)
+            except gateways.GatewayError:
+                logger.exception("Paystack initialize failed for order %s", order.ref)
+                return render(request, 'shop/error.html', {'message': 'Payment service is temporarily unavailable. Please try again shortly.'})
             if res.get('status'):
                 cart.clear()
                 return redirect(res['data']['authorization_url'])
@@ -242,79 +235,326 @@ def order_callback(request):
     
     # If total price is > 0, we need to verify with Paystack
     if not order.verified and order.total_amount > 0:
-        headers = {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}", "Content-Type": "application/json"}
-        res = requests.get(f"https://api.paystack.co/transaction/verify/{reference}", headers=headers).json()
+        try:
+            res = gateways.paystack_verify(reference)
+        except gateways.GatewayError:
+            # The webhook will still verify the order once Paystack recovers
+            logger.warning("Paystack verify failed for order %s", reference, exc_info=True)
+            res = {}
         if res.get('status') and res['data']['status'] == 'success':
-            order.verified = True
-            order.transaction_id = res['data']['id']
-            order.save()
-            send_sms_fulfillment(order.phone_number, order.items.all())
+            verify_and_fulfill(order, transaction_id=res['data'].get('id'))
     
-    return render(request, 'shop/order_complete.html', {'order': order})
+    items = list(order.items.select_related('paper'))
+    urls = download_links.order_download_urls(order)
+    for item in items:
+        item.download_url = urls.get(item.paper_id)
+    return render(request, 'shop/order_complete.html', {'order': order, 'items': items})
 
 # ====================================================================
 # 3. LIST & DETAIL VIEWS
 # ====================================================================
 
+def purchased_slots(request):
+    """Card slots badging the papers the browsing buyer owns; one entitlement lookup per page."""
+    owned = entitlements.purchased_paper_ids(request)
+    badge = render_to_string('shop/includes/purchased_badge.html') if owned else ''
+    return lambda paper: {'purchased': badge if paper.pk in owned else ''}
+
+@cache_anonymous_page('class_list')
 def class_list(request):
+    catalog = get_catalog_snapshot()
     return render(request, 'shop/class_list.html', {
-        'classes': Classes.objects.all(),
-        'total_papers': QuestionPaper.objects.filter(is_available=True).count(),
-        'total_downloads': DownloadHistory.objects.count(),
+        'classes': catalog['classes'],
+        'total_papers': catalog['total_papers'],
     })
 
+@cache_anonymous_page('term_list')
 def term_list(request, class_slug):
-    class_level = get_object_or_404(Classes, slug=class_slug)
-    return render(request, 'shop/term_list.html', {'class_level': class_level, 'terms': class_level.terms.all()})
+    class_level = get_catalog_snapshot()['classes_by_slug'].get(class_slug)
+    if class_level is None:
+        raise Http404("No class matches the given query.")
+    return render(request, 'shop/term_list.html', {'class_level': class_level, 'terms': class_level['terms']})
 
+@cache_anonymous_page('subject_list')
 def subject_list(request, class_slug, term_slug):
-    class_level = get_object_or_404(Classes, slug=class_slug)
-    term = get_object_or_404(Term, class_name=class_level, slug=term_slug)
-    papers = QuestionPaper.objects.filter(class_level=class_level, term=term, is_available=True).select_related('subject')
-    subjects = {}
-    for p in papers:
-        if p.subject_id not in subjects: subjects[p.subject_id] = {'subject': p.subject, 'papers': []}
-        subjects[p.subject_id]['papers'].append(p)
-    return render(request, 'shop/subject_list.html', {'class_level': class_level, 'term': term, 'subjects_list': list(subjects.values())})
+    class_level = get_catalog_snapshot()['classes_by_slug'].get(class_slug)
+    term = class_level['terms_by_slug'].get(term_slug) if class_level else None
+    if term is None:
+        raise Http404("No term matches the given query.")
+    return render(request, 'shop/subject_list.html', {'class_level': class_level, 'term': term, 'subjects_list': term['subjects']})
+
+@cache_anonymous_page('subject_papers_list')
+def subject_papers_list(request, class_slug, term_slug, subject_slug):
+    class_level = get_catalog_snapshot()['classes_by_slug'].get(class_slug)
+    term = class_level['terms_by_slug'].get(term_slug) if class_level else None
+    node = next((n for n in term['subjects'] if n['subject']['slug'] == subject_slug), None) if term else None
+    if node is None:
+        raise Http404("No subject matches the given query.")
+    # Only the cache keys are loaded here; cards that miss are fetched in one query
+    papers = QuestionPaper.objects.filter(
+        is_available=True, class_level_id=class_level['id'], term_id=term['id'], subject_id=node['subject']['id'],
+    ).order_by('title', 'id').only('id', 'updated_at')
+    return render(request, 'shop/subject_papers_list.html', {
+        'class_level': class_level,
+        'term': term,
+        'subject': node['subject'],
+        'cards': render_paper_cards(papers, 'shop/includes/subject_paper_card.html', slots=purchased_slots(request)),
+    })
 
+def count_cached_paper_view(request, meta):
+    record_view(meta['paper_id'])
+
+@cache_anonymous_page('paper_detail', on_hit=count_cached_paper_view)
 def paper_detail(request, class_slug, term_slug, subject_slug, paper_slug):
-    paper = get_object_or_404(QuestionPaper, class_level__slug=class_slug, term__slug=term_slug, subject__slug=subject_slug, slug=paper_slug, is_available=True)
-    return render(request, 'shop/paper_detail.html', {'paper': paper, 'cart_paper_form': CartAddPaperForm()})
+    # The paper slug is unique; the hierarchy segments only have to match the stored path
+    paper = get_object_or_404(QuestionPaper.objects.select_related('class_level', 'term', 'subject', 'free_sample'), slug=paper_slug, is_available=True)
+    if request.path != paper.get_absolute_url():
+        return redirect(paper.get_absolute_url(), permanent=True)
+    paper.increment_views()
+    response = render(request, 'shop/paper_detail.html', {'paper': paper, 'cart_paper_form': CartAddPaperForm()})
+    response.page_cache_meta = {'paper_id': paper.pk}
+    return response
+
+def serve_download(request, paper, order_id=None):
+    try:
+        response, is_new_download = serve_paper_file(request, paper)
+    except gateways.GatewayError:
+        return render(request, 'shop/error.html', {'message': 'The file is temporarily unavailable. Please try again shortly.'}, status=503)
+    except ProtectedCopyNotReady:
+        response = render(request, 'shop/error.html', {'message': 'This paper is being prepared for download. Please try again in a minute.'}, status=503)
+        response['Retry-After'] = '60'
+        return response
+    if is_new_download:
+        DownloadHistory.log_download(paper=paper, request=request, order_id=order_id)
+    return response
 
+@require_http_methods(["GET", "HEAD"])
 def download_file(request, paper_slug):
+    """Free papers only; paid papers are downloaded through their order's signed links."""
     paper = get_object_or_404(QuestionPaper, slug=paper_slug)
-    if not paper.is_available:
+    if not paper.is_available or not paper.pdf_file:
         raise Http404("Not available.")
-    DownloadHistory.log_download(paper=paper, request=request)
-    return redirect(paper.get_secure_pdf_url())
+    if not paper.is_free:
+        return render(request, 'shop/error.html', {'message': 'Use the download link on your order page or profile to download this paper.'}, status=403)
+    return serve_download(request, paper)
+
+@require_http_methods(["GET", "HEAD"])
+def signed_download(request, token):
+    """Per-order signed link. The token is checked without the database; while a storage
+    URL for the paper is cached, the whole request is a redirect."""
+    try:
+        link = download_links.read_token(token)
+    except download_links.InvalidDownloadLink:
+        return render(request, 'shop/error.html', {'message': 'This download link is invalid or has expired.'}, status=403)
+    url = download_links.cached_storage_url(link.paper_id)
+    if url is None:
+        paper = get_object_or_404(QuestionPaper, pk=link.paper_id)
+        if not paper.pdf_file:
+            raise Http404("Not available.")
+        try:
+            field_file, _ = delivered_file(paper)
+        except ProtectedCopyNotReady:
+            return serve_download(request, paper, order_id=link.order_id)
+        url = download_links.storage_url(paper.pk, field_file)
+        if url is None:
+            # Storage cannot sign URLs (e.g. local files): send the file ourselves
+            return serve_download(request, paper, order_id=link.order_id)
+    if request.method == 'GET':
+        DownloadHistory.log_download(paper_id=link.paper_id, request=request, order_id=link.order_id)
+    return redirect(url)
+
+PREVIEW_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+@require_http_methods(["GET", "HEAD"])
+def preview_image(request, kind, content_hash, page):
+    """Send a rendered thumbnail or sample preview kept on local disk, or redirect to it in storage.
+
+    Pages link here only for local storage (see shop.previews.preview_urls);
+    remote images are linked directly, and the redirect keeps older cached pages working.
+    """
+    if kind not in previews.KINDS or not PREVIEW_HASH_RE.match(content_hash) or not 1 <= page <= previews.PREVIEW_PAGES:
+        raise Http404("Unknown preview.")
+    names = previews.stored_names(kind, content_hash)
+    if len(names) < page:
+        raise Http404("Preview not rendered yet.")
+    path = previews.local_path(names[page - 1])
+    if path:
+        response = FileResponse(open(path, 'rb'), content_type='image/webp')
+    else:
+        response = redirect(default_storage.url(names[page - 1]))
+    response['Cache-Control'] = previews.PREVIEW_CACHE_CONTROL
+    return response
 
 # ====================================================================
 # OTHERS
 # ====================================================================
+def valid_paystack_signature(request):
+    """Check X-Paystack-Signature (HMAC-SHA512 of the raw body) in constant time."""
+    signature = request.headers.get('X-Paystack-Signature', '')
+    if not signature or not settings.PAYSTACK_SECRET_KEY:
+        return False
+    expected = hmac.new(settings.PAYSTACK_SECRET_KEY.encode(), request.body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
 @csrf_exempt
 def paystack_webhook(request):
     if request.method != 'POST': return HttpResponse(status=400)
-    payload = json.loads(request.body)
+    # Reject forged calls before touching the payload or the database
+    if not valid_paystack_signature(request): return HttpResponse(status=401)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponse(status=400)
     if payload.get('event') == 'charge.success':
-        ref = payload['data']['reference']
-        order = Order.objects.filter(ref=ref).first()
+        data = payload.get('data') or {}
+        order = Order.objects.filter(ref=data.get('reference')).only('id', 'ref', 'user', 'email', 'phone_number', 'verified').first()
+        # A single conditional UPDATE: entitlements and the SMS are the only other writes here
         if order and not order.verified:
-            order.verified = True
-            order.transaction_id = payload['data'].get('id')
-            order.save()
-            send_sms_fulfillment(order.phone_number, order.items.all())
+            verify_and_fulfill(order, transaction_id=data.get('id'))
     return JsonResponse({'status': 'success'})
 
 def contact_us(request): return render(request, 'shop/contact_us.html')
+@cache_anonymous_page('faq')
 def faq(request): return render(request, 'shop/faq.html')
+@cache_anonymous_page('about')
 def about(request): return render(request, 'shop/about.html')
+@cache_anonymous_page('privacy_policy')
 def privacy_policy(request): return render(request, 'shop/privacy_policy.html')
+@cache_anonymous_page('terms_of_service')
 def terms_of_service(request): return render(request, 'shop/terms_of_service.html')
+@staff_member_required
+def page_cache_stats(request):
+    return JsonResponse({'views': page_cache.stats()})
+
+# ====================================================================
+# SEARCH
+# ====================================================================
+
+def search_card_slots(request):
+    purchased = purchased_slots(request)
+
+    def slots(paper):
+        snippet = getattr(paper, 'highlighted_snippet', '')
+        return {
+            'title': getattr(paper, 'highlighted_title', '') or paper.title,
+            'snippet': render_to_string('shop/includes/search_snippet.html', {'snippet': snippet}) if snippet else '',
+            **purchased(paper),
+        }
+    return slots
+
+@require_http_methods(["GET", "HEAD"])
+def search_suggest(request):
+    """Typeahead: ``{"q": ..., "r": [[label, url, kind], ...]}`` with kind c(lass)/s(ubject)/p(aper)."""
+    q = request.GET.get('q', '')
+    response = JsonResponse({'q': q, 'r': [list(s) for s in typeahead.suggest(q)]})
+    # Keystrokes repeat prefixes; let the browser reuse answers for a minute
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
 def search_papers(request):
     q = request.GET.get('q', '').strip()
-    papers = QuestionPaper.objects.filter(title__icontains=q, is_available=True) if q else []
-    return render(request, 'shop/search_results.html', {'papers': papers, 'query': q})
+    class_level = request.GET.get('class_level', '')
+    selected_class = int(class_level) if class_level.isdigit() else None
+    results = search.search(q, class_level_id=selected_class)
+    page_obj = Paginator(results, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'shop/search_results.html', {
+        'papers': page_obj.object_list,
+        'cards': render_paper_cards(page_obj.object_list, 'shop/includes/search_result_card.html', slots=search_card_slots(request)),
+        'query': q,
+        # Papers whose PDF text mentions the query; shown above the title matches on the first page
+        'content_hits': pdf_text.search_content(q) if page_obj.number == 1 else [],
+        'results_count': page_obj.paginator.count,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+        'selected_class': selected_class,
+        'all_classes': Classes.objects.only('id', 'name', 'slug'),
+        'all_subjects': Subject.objects.only('id', 'name', 'slug'),
+        'years': sorted({p.year for p in page_obj.object_list}, reverse=True),
+    })
+
+# ====================================================================
+# PAPER LISTINGS
+# ====================================================================
+
+EXAM_TYPE_DESCRIPTIONS = {
+    'endterm': "End-Term examinations are comprehensive tests administered at the end of an academic term to assess students' understanding of the entire term's curriculum.",
+    'midterm': "Mid-Term examinations are tests given halfway through an academic term to evaluate students' progress and understanding of the material covered so far.",
+    'cat': "Continuous Assessment Tests (CATs) are periodic evaluations conducted throughout the term to monitor students' ongoing progress and understanding.",
+    'assignment': 'Assignments are tasks given to students to complete outside of class time, designed to reinforce learning and develop independent study skills.',
+    'final': 'Final examinations are comprehensive tests at the end of an academic year or course, covering all material taught throughout the year.',
+    'mock': 'Mock examinations are practice tests designed to simulate actual examination conditions, helping students prepare for their final exams.',
+    'others': 'Other types of educational papers including worksheets, practice tests, and supplementary materials.',
+}
+
+def listing_stats(papers):
+    """Counts shown above a filtered listing, in one aggregate query."""
+    return papers.aggregate(
+        total_count=Count('id'),
+        class_count=Count('class_level', distinct=True),
+        subject_count=Count('subject', distinct=True),
+        free_count=Count('id', filter=models.Q(is_paid=False)),
+        paid_count=Count('id', filter=models.Q(is_paid=True)),
+    )
+
+def available_years():
+    return list(QuestionPaper.objects.filter(is_available=True).order_by('-year').values_list('year', flat=True).distinct())
+
+@cache_anonymous_page('all_papers')
 def all_papers(request):
-    return render(request, 'shop/all_papers.html', {'papers': QuestionPaper.objects.filter(is_available=True).order_by('-created_at')[:50]})
-def papers_by_year(request, year): return render(request, 'shop/papers_by_year.html', {'year': year})
-def papers_by_type(request, exam_type): return render(request, 'shop/papers_by_type.html', {'exam_type': exam_type})
+    page = get_listing_page(request, listing_queryset(), ('created_at', 'id'))
+    return render(request, 'shop/all_papers.html', {
+        'page': page,
+        'cards': render_paper_cards(page.object_list, 'shop/includes/all_papers_card.html', slots=purchased_slots(request)),
+    })
+
+@cache_anonymous_page('papers_by_year')
+def papers_by_year(request, year):
+    papers = listing_queryset(year=year)
+    page = get_listing_page(request, papers, ('id',))
+    years = available_years()
+    return render(request, 'shop/papers_by_year.html', {
+        'year': year,
+        'papers': page.object_list,
+        'page': page,
+        'available_years': years,
+        'other_years': [y for y in years if y != year],
+        'classes': get_catalog_snapshot()['classes'],
+        'subjects': Subject.objects.only('id', 'name', 'slug'),
+        **listing_stats(QuestionPaper.objects.filter(is_available=True, year=year)),
+    })
+
+@cache_anonymous_page('papers_by_type')
+def papers_by_type(request, exam_type):
+    exam_types = dict(QuestionPaper._meta.get_field('exam_type').choices)
+    if exam_type not in exam_types:
+        raise Http404("No such exam type.")
+    papers = listing_queryset(exam_type=exam_type)
+    page = get_listing_page(request, papers, ('id',))
+    return render(request, 'shop/papers_by_type.html', {
+        'exam_type': exam_type,
+        'exam_type_display': exam_types[exam_type],
+        'type_description': EXAM_TYPE_DESCRIPTIONS[exam_type],
+        'papers': page.object_list,
+        'page': page,
+        'years': available_years(),
+        'classes': get_catalog_snapshot()['classes'],
+        'subjects': Subject.objects.only('id', 'name', 'slug'),
+        **listing_stats(QuestionPaper.objects.filter(is_available=True, exam_type=exam_type)),
+    })
+
+@cache_anonymous_page('browse_papers')
+def browse_papers(request):
+    cube = facets.get_facet_cube()
+    selection = facets.parse_selection(request.GET, cube)
+    papers = listing_queryset(**facets.selection_filters(selection))
+    page = get_listing_page(request, papers, ('created_at', 'id'))
+    query = request.GET.copy()
+    query.pop('after', None)
+    return render(request, 'shop/browse_papers.html', {
+        'page': page,
+        'pager_query': query.urlencode(),
+        'cards': render_paper_cards(page.object_list, 'shop/includes/all_papers_card.html', slots=purchased_slots(request)),
+        'facets': facets.facet_options(request.GET, cube, selection, facets.facet_counts(cube, selection)),
+        'total_count': facets.total_count(cube, selection),
+        'has_selection': bool(selection),
+    })
@@ -9,9 +9,10 @@ urlpatterns = [
     # Admin path remains the same
     path('admin/', admin.site.urls),
 
-    # 🔥 Point the root path to the shop app's URLs
-    path('', include('shop.urls')),
-
     # The webhook MUST remain here for the Paystack link to be at the root level (e.g., /webhooks/paystack/)
+    # and it must come before shop.urls, whose '<class_slug>/<term_slug>/' pattern would swallow it.
     path('webhooks/paystack/', paystack_webhook, name='paystack-webhook'),
+
+    # 🔥 Point the root path to the shop app's URLs
+    path('', include('shop.urls')),
 ]
\ No newline at end of file